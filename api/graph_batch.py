@@ -0,0 +1,137 @@
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlencode
+
+from api.http_client import GraphHttpClient, graph_client
+from constant import GRAPH_BATCH_SIZE, GRAPH_BATCH_WINDOW
+from utils.scheduler import TimerScheduler
+
+
+class _BatchOperation:
+    __slots__ = ("request", "future")
+
+    def __init__(self, request: Dict[str, Any], future: Future):
+        self.request = request
+        self.future = future
+
+
+class GraphBatchCoalescer:
+    """
+    Coalesces Graph API operations issued within a short window into one
+    `batch` POST of up to 50 operations, and fans the results back to callers.
+
+    Operations are grouped by (base url, access token), since a batch runs
+    with a single token. The first operation of a group arms a flush after
+    `window` seconds; a full group is flushed right away.
+    """
+    def __init__(
+        self,
+        window: float = GRAPH_BATCH_WINDOW,
+        max_batch: int = GRAPH_BATCH_SIZE,
+        client: GraphHttpClient = graph_client,
+    ):
+        self.window = window
+        self.max_batch = max_batch
+        self.client = client
+        self.pending: Dict[Tuple[str, str], List[_BatchOperation]] = {}
+        self.lock = threading.Lock()
+        self.scheduler = TimerScheduler(max_workers=4, name="graph-batch")
+
+        # metrics
+        self.batches = 0
+        self.operations = 0
+
+    def submit(
+        self,
+        base_url: str,
+        access_token: str,
+        method: str,
+        relative_url: str,
+        body: Dict[str, Any] | None = None,
+    ) -> Future:
+        """
+        Queues one operation of the next batch.
+        :param body: Form fields of a POST operation, non-string values are JSON encoded.
+        :return: A future resolving to `(status_code, body)`, `body` being the
+            decoded JSON response of this operation.
+        """
+        request = {"method": method, "relative_url": relative_url}
+        if body:
+            request["body"] = urlencode({
+                key: value if isinstance(value, str) else json.dumps(value)
+                for key, value in body.items()
+            })
+        operation = _BatchOperation(request, Future())
+
+        key = (base_url, access_token)
+        full_group = None
+        with self.lock:
+            group = self.pending.setdefault(key, [])
+            group.append(operation)
+            if len(group) >= self.max_batch:
+                # taken out at once, later operations start a new group
+                full_group = self.pending.pop(key)
+                self.scheduler.cancel(key)
+            elif len(group) == 1:
+                self.scheduler.schedule(key, self.window, self._flush, key)
+
+        if full_group:
+            self._send(key, full_group)
+        return operation.future
+
+    def _flush(self, key: Tuple[str, str]):
+        with self.lock:
+            group = self.pending.pop(key, [])
+        if group:
+            self._send(key, group)
+
+    def _send(self, key: Tuple[str, str], group: List[_BatchOperation]):
+        base_url, access_token = key
+
+        with self.lock:
+            self.batches += 1
+            self.operations += len(group)
+
+        payload = {"access_token": access_token, "batch": [operation.request for operation in group]}
+        try:
+            response = self.client.post(base_url, json=payload, headers={'Content-Type': 'application/json'})
+        except Exception as e:
+            print(f"[GraphBatchCoalescer] Batch of {len(group)} failed: {e}")
+            for operation in group:
+                operation.future.set_result((None, {}))
+            return
+
+        if not response.ok:
+            print("[GraphBatchCoalescer] Batch error:", response.text)
+            for operation in group:
+                operation.future.set_result((response.status_code, {}))
+            return
+
+        results = response.json()
+        for operation, item in zip(group, results):
+            # `null` items are operations Graph did not get to run
+            if not item:
+                operation.future.set_result((None, {}))
+                continue
+            try:
+                body = json.loads(item.get("body") or "{}")
+            except ValueError:
+                body = {}
+            operation.future.set_result((item.get("code"), body))
+        for operation in group[len(results):]:
+            operation.future.set_result((None, {}))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "operations": self.operations,
+                "avg_batch_size": self.operations / (self.batches or 1),
+                "round_trips_saved": self.operations - self.batches,
+            }
+
+
+# shared by every Graph API call of the process
+graph_batch = GraphBatchCoalescer()
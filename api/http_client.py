@@ -0,0 +1,256 @@
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constant import GRAPH_BACKOFF_FACTOR, GRAPH_MAX_BACKOFF, GRAPH_MAX_RETRIES, GRAPH_POOL_SIZE, GRAPH_TIMEOUT
+
+# Graph error codes meaning "throttled, try again later"
+GRAPH_RATE_LIMIT_CODES = {4, 17, 32, 613, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80014}
+GRAPH_USAGE_HEADERS = ("x-business-use-case-usage", "x-app-usage", "x-page-usage", "x-ad-account-usage")
+# server errors retried for idempotent calls, throttling is handled apart
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+_ID_SEGMENT = re.compile(r"\d")
+
+
+class GraphHttpClient:
+    """
+    Shared HTTP client for the Meta Graph API.
+
+    - One `requests.Session` per host, so connections (TCP + TLS) are kept
+      alive and pooled between calls.
+    - Every call has a (connect, read) timeout.
+    - Throttled or failed calls are retried with exponential backoff, see
+      `retry_delay`. Non-idempotent calls (sending a message) are only retried
+      when the request was rejected, never after a timeout or a 5xx, so a
+      message is not delivered twice.
+    - Latency, error and retry counters are kept per endpoint.
+    """
+    def __init__(
+        self,
+        timeout: Tuple[float, float] = GRAPH_TIMEOUT,
+        max_retries: int = GRAPH_MAX_RETRIES,
+        backoff_factor: float = GRAPH_BACKOFF_FACTOR,
+        max_backoff: float = GRAPH_MAX_BACKOFF,
+        pool_size: int = GRAPH_POOL_SIZE,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.sessions: Dict[str, requests.Session] = {}
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def _get_session(self, url: str) -> requests.Session:
+        host = urlparse(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self.sessions[host] = session
+            return session
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        """
+        The endpoint of a call in the stats, ids replaced:
+        "GET /v22.0/t_123/messages" -> "GET /{id}/messages".
+        """
+        segments = urlparse(url).path.strip("/").split("/")
+        if segments and segments[0].startswith("v") and _ID_SEGMENT.search(segments[0]):
+            segments = segments[1:]
+        segments = ["{id}" if _ID_SEGMENT.search(segment) else segment for segment in segments]
+        return f"{method} /{'/'.join(segments)}"
+
+    @staticmethod
+    def _rate_limit_wait(response: Any) -> Optional[float]:
+        """
+        Seconds to wait before retrying a throttled response, None if it is not throttled.
+        """
+        throttled = response.status_code == 429
+        try:
+            error = response.json().get("error", {})
+            throttled = throttled or error.get("code") in GRAPH_RATE_LIMIT_CODES
+        except (ValueError, AttributeError):
+            pass
+        if not throttled:
+            return None
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+
+        # e.g. {"<id>": [{"estimated_time_to_regain_access": 2, ...}]}, in minutes
+        wait = 0.0
+        for header in GRAPH_USAGE_HEADERS:
+            value = response.headers.get(header)
+            if not value:
+                continue
+            try:
+                usage = json.loads(value)
+            except ValueError:
+                continue
+            entries = [item for items in usage.values() for item in items] if isinstance(usage, dict) else [usage]
+            for entry in entries:
+                if isinstance(entry, dict):
+                    wait = max(wait, float(entry.get("estimated_time_to_regain_access", 0)) * 60)
+        return wait
+
+    def _backoff(self, attempt: int) -> float:
+        delay = self.backoff_factor * (2 ** attempt)
+        return min(self.max_backoff, delay + random.uniform(0, delay / 2))
+
+    def retry_delay(
+        self,
+        response: Any,
+        attempt: int,
+        idempotent: bool,
+        max_retries: Optional[int] = None,
+    ) -> Optional[float]:
+        """
+        Retry policy of a failed response, shared by the sync and async clients:
+
+        - a throttled call (429 or a Graph rate limit code) was not processed
+          and is retried, non-idempotent or not, after `Retry-After` or the
+          usage headers' time to regain access, unless that is longer than
+          `max_backoff`;
+        - a 5xx is retried for idempotent calls only, the request may have
+          been processed (e.g. a message sent);
+        - anything else is not retried.
+
+        :param response: A `requests` or `httpx` response.
+        :param attempt: Retries made so far.
+        :return: Seconds to wait before the next attempt, None to give up.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        if attempt >= max_retries:
+            return None
+        wait = self._rate_limit_wait(response)
+        if wait is None:
+            if idempotent and response.status_code in RETRY_STATUS_CODES:
+                return self._backoff(attempt)
+            return None
+        if wait > self.max_backoff:
+            print(f"[GraphHttpClient] throttled for {wait:.0f}s, giving up")
+            return None
+        return max(wait, self._backoff(attempt))
+
+    def error_retry_delay(
+        self,
+        attempt: int,
+        idempotent: bool,
+        connect_timeout: bool,
+        max_retries: Optional[int] = None,
+    ) -> Optional[float]:
+        """
+        Retry policy of a call that got no response, see `retry_delay`. A
+        connect timeout never reached Graph and is always retried, any other
+        error only for idempotent calls.
+        :return: Seconds to wait before the next attempt, None to give up.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        if attempt >= max_retries or not (idempotent or connect_timeout):
+            return None
+        return self._backoff(attempt)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        idempotent: Optional[bool] = None,
+        max_retries: Optional[int] = None,
+        **kwargs,
+    ) -> requests.Response:
+        """
+        Sends a request through the pooled session of the URL's host.
+        Raises the last `requests` exception if every attempt failed to connect.
+        :param idempotent: Whether the call may be retried after a timeout or a
+            5xx, defaults to True for GET only, see `retry_delay`.
+        """
+        idempotent = method.upper() == "GET" if idempotent is None else idempotent
+        max_retries = self.max_retries if max_retries is None else max_retries
+        kwargs.setdefault("timeout", self.timeout)
+        session = self._get_session(url)
+        endpoint = self.endpoint(method.upper(), url)
+
+        attempt = 0
+        while True:
+            start_time = time.monotonic()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self.record(endpoint, time.monotonic() - start_time, error=True)
+                delay = self.error_retry_delay(attempt, idempotent, isinstance(e, requests.ConnectTimeout), max_retries)
+                if delay is None:
+                    raise
+                print(f"[GraphHttpClient] {endpoint} failed ({e}), retry in {delay:.2f}s")
+            else:
+                self.record(endpoint, time.monotonic() - start_time, error=not response.ok)
+                if response.ok:
+                    return response
+                delay = self.retry_delay(response, attempt, idempotent, max_retries)
+                if delay is None:
+                    return response
+                print(f"[GraphHttpClient] {endpoint} returned {response.status_code}, retry in {delay:.2f}s")
+
+            attempt += 1
+            self.record_retry(endpoint)
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def _endpoint_stats(self, endpoint: str) -> Dict[str, float]:
+        stats = self.stats.get(endpoint)
+        if stats is None:
+            stats = self.stats[endpoint] = {
+                "calls": 0, "errors": 0, "retries": 0, "total_latency": 0.0, "max_latency": 0.0,
+            }
+        return stats
+
+    def record(self, endpoint: str, latency: float, error: bool):
+        with self.lock:
+            stats = self._endpoint_stats(endpoint)
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    def record_retry(self, endpoint: str):
+        with self.lock:
+            self._endpoint_stats(endpoint)["retries"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                endpoint: {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "retries": stats["retries"],
+                    "avg_latency_ms": stats["total_latency"] / (stats["calls"] or 1) * 1000,
+                    "max_latency_ms": stats["max_latency"] * 1000,
+                }
+                for endpoint, stats in self.stats.items()
+            }
+
+
+# shared by every Graph API call of the process
+graph_client = GraphHttpClient()
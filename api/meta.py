@@ -1,4 +1,3 @@
-import requests
 import os
 from dotenv import load_dotenv
 import json
@@ -17,15 +16,49 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 APP_ID = os.getenv("APP_ID")
 
 # === CONFIG ===
-from constant import MESSAGE_OBJECT_TYPE, FACEBOOK_URL, INSTA_URL, RESUME_BOT_KEYWORD, NUM_MESSAGE_CONTEXT, IMAGE_ATTACHMENT_TYPE
+from api.graph_batch import graph_batch
+from api.http_client import graph_client
+from constant import MESSAGE_OBJECT_TYPE, FACEBOOK_URL, INSTA_URL, RESUME_BOT_KEYWORD, NUM_MESSAGE_CONTEXT, IMAGE_ATTACHMENT_TYPE, CONVERSATION_PAGE_SIZE, GRAPH_BATCH_WINDOW, GRAPH_TIMEOUT
+
+def _get_base_url_and_token(object_type=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    if object_type == MESSAGE_OBJECT_TYPE["instagram"]:
+        return INSTA_URL['base'], INSTA_ACCESS_TOKEN
+    return FACEBOOK_URL['base'], PAGE_ACCESS_TOKEN
+
+def _is_batched(object_type=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    """
+    Whether calls of this platform go through the batch coalescer: only the
+    Facebook Graph API has a batch endpoint, graph.instagram.com has none.
+    """
+    return GRAPH_BATCH_WINDOW > 0 and object_type == MESSAGE_OBJECT_TYPE["facebook_page"]
+
+def _batched_call(method, relative_url, object_type=MESSAGE_OBJECT_TYPE["facebook_page"], body=None):
+    """
+    Run one Graph operation as part of the next coalesced batch request.
+    :return: (status_code, body), status_code is None if the operation did not run.
+    """
+    base_url, access_token = _get_base_url_and_token(object_type)
+    future = graph_batch.submit(base_url, access_token, method, relative_url, body)
+    return future.result(timeout=GRAPH_BATCH_WINDOW + sum(GRAPH_TIMEOUT))
 
 def get_message_by_id(message_id, message_object=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    if _is_batched(message_object):
+        try:
+            status_code, data = _batched_call("GET", f"{message_id}?fields=message", message_object)
+            if status_code == 200:
+                return data.get("message")
+            print("Error fetching message:", status_code, data)
+            return ""
+        except Exception as e:
+            print("Exception fetching message:", e)
+            return ""
+
     url = f"{FACEBOOK_URL['base']}/{message_id}?fields=message&access_token={PAGE_ACCESS_TOKEN}"
     if message_object == MESSAGE_OBJECT_TYPE["instagram"]:
         url = f"{INSTA_URL['base']}/{message_id}?fields=message&access_token={INSTA_ACCESS_TOKEN}"
     headers = {'Content-Type': 'application/json'}
     try:
-        response = requests.get(url, headers=headers)
+        response = graph_client.get(url, headers=headers)
         if response.ok:
             data = response.json()
             return data.get("message")
@@ -36,30 +69,94 @@ def get_message_by_id(message_id, message_object=MESSAGE_OBJECT_TYPE["facebook_p
         print("Exception fetching message:", e)
         return ""
 
-def get_conversation_messages_by_user_id(user_id):
+def iter_conversations(object_type=MESSAGE_OBJECT_TYPE["facebook_page"],
+                       user_id=None,
+                       fields="participants",
+                       limit=CONVERSATION_PAGE_SIZE):
     """
-    Get all messages between the page and a specific user_id (PSID).
+    Lazily yield the page (or Instagram account) conversations, following
+    `paging.next` one page at a time so callers can stop early.
+    If `user_id` is given, Graph only returns the conversation with that user.
+    """
+    if object_type == MESSAGE_OBJECT_TYPE["instagram"]:
+        url = INSTA_URL['conversation_message']
+        access_token = INSTA_ACCESS_TOKEN
+    else:
+        url = FACEBOOK_URL['conversation_message']
+        access_token = PAGE_ACCESS_TOKEN
+    params = {"fields": fields, "limit": limit, "access_token": access_token}
+    if object_type == MESSAGE_OBJECT_TYPE["instagram"]:
+        params["platform"] = "instagram"
+    if user_id:
+        params["user_id"] = user_id
+
+    while url:
+        response = graph_client.get(url, params=params)
+        if not response.ok:
+            print("Error fetching conversations:", response.text)
+            return
+        body = response.json()
+        yield from body.get("data", [])
+        # `next` already carries every query parameter
+        url, params = body.get("paging", {}).get("next"), None
+
+def get_conversation_id_by_user_id(user_id, object_type=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    """
+    Find the id of the conversation between the page and a specific user_id (PSID/IGSID).
+    Uses the `user_id` filter, and where Graph ignores it scans the
+    conversations page by page until the participant is found.
+    """
+    try:
+        for convo in iter_conversations(object_type, user_id=user_id):
+            participants = convo.get("participants", {}).get("data", [])
+            if any(p.get("id") == user_id for p in participants):
+                return convo["id"]
+        return None
+    except Exception as e:
+        print("Exception during conversation fetch:", e)
+        return None
+
+def get_conversation_messages(conversation_id, object_type=MESSAGE_OBJECT_TYPE["facebook_page"], limit=NUM_MESSAGE_CONTEXT):
+    """
+    Get the last `limit` messages of a conversation with their sender and text in
+    one call, oldest first.
+    :return: list of (sender_id, message)
     """
-    url = f"{FACEBOOK_URL['conversation_message']}?fields=participants&access_token={PAGE_ACCESS_TOKEN}"
+    base_url, access_token = _get_base_url_and_token(object_type)
+    url = f"{base_url}/{conversation_id}/messages"
+    params = {"fields": "message,from", "limit": limit, "access_token": access_token}
     try:
-        response = requests.get(url)
+        response = graph_client.get(url, params=params)
         if response.ok:
-            conversations = response.json().get("data", [])
-            for convo in conversations:
-                participants = convo.get("participants", {}).get("data", [])
-                participant_ids = [p["id"] for p in participants]
-                if user_id in participant_ids:
-                    convo_id = convo["id"]
-                    # Found the conversation with this user
-                    messages_url = f"{FACEBOOK_URL['base']}/{convo_id}/messages?access_token={PAGE_ACCESS_TOKEN}"
-                    msg_response = requests.get(messages_url)
-                    if msg_response.ok:
-                        return msg_response.json().get("data", [])
-                    else:
-                        print("rror fetching messages:", msg_response.text)
-                        return []
+            messages = response.json().get("data", [])
+            # Graph returns newest first
+            return [
+                (msg.get("from", {}).get("id", None), msg.get("message", ""))
+                for msg in reversed(messages)
+            ]
         else:
-            print("Error fetching conversations:", response.text)
+            print("Error fetching messages:", response.text)
+            return []
+    except Exception as e:
+        print("Exception during message fetch:", e)
+        return []
+
+def get_conversation_messages_by_user_id(user_id, object_type=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    """
+    Get all messages between the page and a specific user_id (PSID).
+    """
+    convo_id = get_conversation_id_by_user_id(user_id, object_type)
+    if not convo_id:
+        return []
+    # Found the conversation with this user
+    base_url, access_token = _get_base_url_and_token(object_type)
+    messages_url = f"{base_url}/{convo_id}/messages?access_token={access_token}"
+    try:
+        msg_response = graph_client.get(messages_url)
+        if msg_response.ok:
+            return msg_response.json().get("data", [])
+        else:
+            print("rror fetching messages:", msg_response.text)
             return []
     except Exception as e:
         print("Exception during conversation fetch:", e)
@@ -83,7 +180,7 @@ def batch_get_messages_by_ids(message_ids, object_type=MESSAGE_OBJECT_TYPE["face
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = graph_client.post(url, json=payload, headers=headers, idempotent=True)
         if response.ok:
             results = response.json()
             messages = []
@@ -117,7 +214,7 @@ def batch_get_messages_by_ids_v2(message_ids, object_type=MESSAGE_OBJECT_TYPE["f
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = graph_client.post(url, json=payload, headers=headers, idempotent=True)
         if response.ok:
             results = response.json()
             messages = []
@@ -171,7 +268,8 @@ def _upload_image_get_attachment_id(image_source: str,
                 }),
                 'access_token': access_token
             }
-            response = requests.post(url, files=files, data=data) if (source_type == IMAGE_ATTACHMENT_TYPE["file"]) else requests.post(url, data=data)
+            # the file handle is consumed by the first attempt, no retry
+            response = graph_client.post(url, files=files, data=data, max_retries=0) if (source_type == IMAGE_ATTACHMENT_TYPE["file"]) else graph_client.post(url, data=data)
             response.raise_for_status()
             result = response.json()
             return result.get("attachment_id")
@@ -197,7 +295,7 @@ def send_meta_message(
     }
     headers = {'Content-Type': 'application/json'}
     try:
-        requests.post(url, json=payload, headers=headers)
+        graph_client.post(url, json=payload, headers=headers)
     except Exception as e:
         print("Error sending message to FB:", e)
 
@@ -243,13 +341,20 @@ def send_meta_image(psid: str,
 
     headers = {'Content-Type': 'application/json'}
     try:
-        r = requests.post(url, headers=headers, json=payload)
+        r = graph_client.post(url, headers=headers, json=payload)
         if not r.ok:
             print("❌ Image send failed:", r.text)
     except Exception as e:
         print("Exception sending image:", e)
 
 def send_typing_indicator(psid, platform=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    if _is_batched(platform):
+        # fire and forget, goes out with the next batch
+        base_url, access_token = _get_base_url_and_token(platform)
+        graph_batch.submit(base_url, access_token, "POST", "me/messages",
+                           {"recipient": {"id": psid}, "sender_action": "typing_on"})
+        return
+
     url = f"{FACEBOOK_URL['typing']}?access_token={PAGE_ACCESS_TOKEN}"
     if (platform == MESSAGE_OBJECT_TYPE["instagram"]):
         url = f"{INSTA_URL['typing']}?access_token={INSTA_ACCESS_TOKEN}"
@@ -259,7 +364,7 @@ def send_typing_indicator(psid, platform=MESSAGE_OBJECT_TYPE["facebook_page"]):
         "sender_action": "typing_on"
     }
     headers = {'Content-Type': 'application/json'}
-    requests.post(url, headers=headers, json=payload)
+    graph_client.post(url, headers=headers, json=payload)
 
 def associate_label_to_conversation(label_id: str,
                                     conversation_id: str,
@@ -275,7 +380,7 @@ def associate_label_to_conversation(label_id: str,
     url = f"{base}/{conversation_id}/custom_labels"
     params = {"access_token": access_token}
     json_data = {"label": label_id}
-    resp = requests.post(url, params=params, json=json_data)
+    resp = graph_client.post(url, params=params, json=json_data)
     if not resp.ok:
         print("Error associating label:", resp.status_code, resp.text)
     return resp.ok
@@ -285,13 +390,24 @@ def get_labels_of_conversation(conversation_id: str,
     """
     Return list of label IDs attached to a thread.
     """
+    if _is_batched(object_type):
+        try:
+            status_code, data = _batched_call("GET", f"{conversation_id}/custom_labels", object_type)
+        except Exception as e:
+            print("Exception fetching conversation labels:", e)
+            return []
+        if status_code == 200:
+            return [item.get("id") for item in data.get("data", [])]
+        print("Error fetching conversation labels:", status_code, data)
+        return []
+
     access_token = os.getenv("PAGE_ACCESS_TOKEN") \
         if object_type == MESSAGE_OBJECT_TYPE["facebook_page"] \
         else os.getenv("INSTA_ACCESS_TOKEN")
     base = FACEBOOK_URL['base'] if object_type == MESSAGE_OBJECT_TYPE["facebook_page"] else INSTA_URL['base']
     url = f"{base}/{conversation_id}/custom_labels"
     params = {"access_token": access_token}
-    resp = requests.get(url, params=params)
+    resp = graph_client.get(url, params=params)
     if resp.ok:
         data = resp.json().get("data", [])
         return [item.get("id") for item in data]
@@ -0,0 +1,165 @@
+"""
+Async counterparts of the `api.meta` calls used on the request path, for the
+ASGI entry point. They share the retry policy and per-endpoint counters of
+`api.http_client.graph_client`.
+"""
+import asyncio
+import time
+
+import httpx
+
+from api.http_client import graph_client
+from api import meta as meta_api
+from constant import (
+    CONVERSATION_PAGE_SIZE,
+    FACEBOOK_URL,
+    GRAPH_POOL_SIZE,
+    GRAPH_TIMEOUT,
+    INSTA_URL,
+    MESSAGE_OBJECT_TYPE,
+    NUM_MESSAGE_CONTEXT,
+)
+
+_client: httpx.AsyncClient | None = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GRAPH_TIMEOUT[1], connect=GRAPH_TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=GRAPH_POOL_SIZE * 5, max_keepalive_connections=GRAPH_POOL_SIZE),
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def request(method, url, idempotent=None, **kwargs) -> httpx.Response:
+    """
+    Same retry policy as `GraphHttpClient.request`, without blocking the loop.
+    """
+    idempotent = method.upper() == "GET" if idempotent is None else idempotent
+    endpoint = graph_client.endpoint(method.upper(), url)
+    attempt = 0
+    while True:
+        start_time = time.monotonic()
+        try:
+            response = await get_client().request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            graph_client.record(endpoint, time.monotonic() - start_time, error=True)
+            delay = graph_client.error_retry_delay(attempt, idempotent, isinstance(e, httpx.ConnectTimeout))
+            if delay is None:
+                raise
+        else:
+            graph_client.record(endpoint, time.monotonic() - start_time, error=not response.is_success)
+            if response.is_success:
+                return response
+            delay = graph_client.retry_delay(response, attempt, idempotent)
+            if delay is None:
+                return response
+
+        attempt += 1
+        graph_client.record_retry(endpoint)
+        await asyncio.sleep(delay)
+
+async def get_message_by_id(message_id, message_object=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    base_url, access_token = meta_api._get_base_url_and_token(message_object)
+    try:
+        response = await request("GET", f"{base_url}/{message_id}",
+                                 params={"fields": "message", "access_token": access_token})
+        if response.is_success:
+            return response.json().get("message")
+        print("Error fetching message:", response.text)
+        return ""
+    except Exception as e:
+        print("Exception fetching message:", e)
+        return ""
+
+async def get_conversation_id_by_user_id(user_id, object_type=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    if object_type == MESSAGE_OBJECT_TYPE["instagram"]:
+        url, access_token = INSTA_URL['conversation_message'], meta_api.INSTA_ACCESS_TOKEN
+    else:
+        url, access_token = FACEBOOK_URL['conversation_message'], meta_api.PAGE_ACCESS_TOKEN
+    params = {"fields": "participants", "limit": CONVERSATION_PAGE_SIZE,
+              "access_token": access_token, "user_id": user_id}
+    if object_type == MESSAGE_OBJECT_TYPE["instagram"]:
+        params["platform"] = "instagram"
+    try:
+        while url:
+            response = await request("GET", url, params=params)
+            if not response.is_success:
+                print("Error fetching conversations:", response.text)
+                return None
+            body = response.json()
+            for convo in body.get("data", []):
+                participants = convo.get("participants", {}).get("data", [])
+                if any(p.get("id") == user_id for p in participants):
+                    return convo["id"]
+            url, params = body.get("paging", {}).get("next"), None
+        return None
+    except Exception as e:
+        print("Exception during conversation fetch:", e)
+        return None
+
+async def get_conversation_messages(conversation_id, object_type=MESSAGE_OBJECT_TYPE["facebook_page"], limit=NUM_MESSAGE_CONTEXT):
+    base_url, access_token = meta_api._get_base_url_and_token(object_type)
+    try:
+        response = await request("GET", f"{base_url}/{conversation_id}/messages",
+                                 params={"fields": "message,from", "limit": limit, "access_token": access_token})
+        if response.is_success:
+            messages = response.json().get("data", [])
+            # Graph returns newest first
+            return [
+                (msg.get("from", {}).get("id", None), msg.get("message", ""))
+                for msg in reversed(messages)
+            ]
+        print("Error fetching messages:", response.text)
+        return []
+    except Exception as e:
+        print("Exception during message fetch:", e)
+        return []
+
+async def get_labels_of_conversation(conversation_id, object_type=MESSAGE_OBJECT_TYPE["facebook_page"]) -> list[str]:
+    base_url, access_token = meta_api._get_base_url_and_token(object_type)
+    try:
+        response = await request("GET", f"{base_url}/{conversation_id}/custom_labels",
+                                 params={"access_token": access_token})
+        if response.is_success:
+            return [item.get("id") for item in response.json().get("data", [])]
+        print("Error fetching conversation labels:", response.status_code, response.text)
+        return []
+    except Exception as e:
+        print("Exception fetching conversation labels:", e)
+        return []
+
+async def _post_message(psid, message, object_type, endpoint="message"):
+    url = FACEBOOK_URL[endpoint] if object_type == MESSAGE_OBJECT_TYPE["facebook_page"] else INSTA_URL[endpoint]
+    access_token = meta_api.PAGE_ACCESS_TOKEN if object_type == MESSAGE_OBJECT_TYPE["facebook_page"] else meta_api.INSTA_ACCESS_TOKEN
+    return await request("POST", url, params={"access_token": access_token},
+                         json={"recipient": {"id": psid}, **message})
+
+async def send_meta_message(psid, message, message_object=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    try:
+        await _post_message(psid, {"message": {"text": message[:2000]}}, message_object)
+    except Exception as e:
+        print("Error sending message to FB:", e)
+
+async def send_meta_image(psid, image_url, object_type=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    try:
+        response = await _post_message(psid, {"message": {"attachment": {
+            "type": "image", "payload": {"url": image_url, "is_reusable": False},
+        }}}, object_type)
+        if not response.is_success:
+            print("❌ Image send failed:", response.text)
+    except Exception as e:
+        print("Exception sending image:", e)
+
+async def send_typing_indicator(psid, platform=MESSAGE_OBJECT_TYPE["facebook_page"]):
+    try:
+        # same endpoint as `meta.send_typing_indicator`
+        await _post_message(psid, {"sender_action": "typing_on"}, platform, endpoint="typing")
+    except Exception as e:
+        print("Error sending typing indicator:", e)
@@ -1,30 +1,51 @@
+import atexit
 import os
+import re
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 from dotenv import load_dotenv
-from flask import Flask, render_template_string, request
+from flask import Flask, jsonify, render_template_string, request
 from google import genai
 from google.genai import types as genai_types
 from google.genai.chats import Chat
 
 from api import meta as meta_api
+from api.graph_batch import graph_batch
+from api.http_client import graph_client
+from controller.ContextBudgetController import ContextBudgetController
 from controller.ContextController import ContextController
+from controller.ConversationCacheController import ConversationCacheController
+from controller.EmbeddingCacheController import EmbeddingCacheController
+from controller.EventQueueController import EventQueueController
 from controller.FeedbackController import FeedbackController
+from controller.IngestionController import IngestionController
+from controller.LexicalIndexController import LexicalIndexController
+from controller.PromptCacheController import PromptCacheController
+from controller.ResponseCacheController import ResponseCacheController
 from controller.SessionController import SessionController
+from controller.SpeculativeRetrievalController import PRE_INJECT, SPECULATE, SpeculativeRetrievalController
+from controller.ToolController import ToolController
+from controller.StateBackend import get_state_backend
 from controller.DebounceMessageController import DebounceMessageController, Message
+from controller.DeliveryController import DeliveryController
 from controller.utils.chat import clean_message, convert_to_gemini_chat_history
 from gemini_prompt import (
     DEFAULT_RESPONSE,
+    EXAMPLE_QUESTIONS,
     HTML_GEMINI_CONFIG_FORM,
     SEED,
+    STREAM_ERROR_RESPONSE,
     SYSTEM_PROMPT,
     TEMPERATURE,
     BotMessage,
     get_chat_config_json,
 )
-from script.RAG import text_chunking
-from utils import logging, thread_utils
+from script.RAG import iter_chunks
+from utils import logging
+from utils.stream_parser import JsonStringFieldParser, StreamedReply
 import json
 
 # === Load environment variables ===
@@ -46,11 +67,32 @@ from constant import (
     NUM_MESSAGE_CONTEXT,
     RESUME_BOT_KEYWORD,
     DEBOUNCE_TIME,
+    DEBOUNCE_WORKERS,
     BOT_TYPING_CPM,
+    CONTEXT_TOKEN_BUDGET,
+    DELIVERY_WORKERS,
     IMAGE_SEND_KEYWORD,
-    COLLECTION_NAME
+    INGESTION_CHECKPOINT_DIR,
+    INGESTION_WORKERS,
+    COLLECTION_NAME,
+    EVENT_QUEUE_SIZE,
+    EVENT_WORKERS,
+    HISTORY_TOKEN_BUDGET,
+    HYBRID_RETRIEVAL,
+    MAX_TOOL_HOPS,
+    PRE_INJECT_CONTEXT,
+    PROMPT_CACHE_TTL,
+    RESPONSE_CACHE_THRESHOLD,
+    RESPONSE_CACHE_TTL,
+    RETRIEVAL_MMR_DIVERSITY,
+    RETRIEVAL_N_RESULTS,
+    SPECULATIVE_RETRIEVAL,
+    STREAM_RESPONSES,
 )
 
+# stream replies to Messenger sentence by sentence while they are generated
+STREAM_RESPONSES = bool(int(os.getenv("STREAM_RESPONSES", STREAM_RESPONSES)))
+
 # === Configure Gemini ===
 # Configure Gemini
 client = genai.Client(api_key=API_KEY)
@@ -70,12 +112,82 @@ g_app_config = {"bot_typing_cpm": BOT_TYPING_CPM,
 
 app = Flask(__name__)
 
-chat_sessions = SessionController(client, default_gemini_config=g_gemini_config)
+# system instruction kept in a Gemini context cache, PROMPT_CACHE_TTL=0 disables it
+prompt_cache = PromptCacheController(client, ttl=float(os.getenv("PROMPT_CACHE_TTL", PROMPT_CACHE_TTL)))
+atexit.register(prompt_cache.invalidate)
+
+# sessions, suspensions and debounce buffers, shared between workers with STATE_BACKEND=sqlite
+state_backend = get_state_backend()
+# tokens of history and retrieved documents sent per turn, 0 disables a budget
+context_budget = ContextBudgetController(
+    history_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", HISTORY_TOKEN_BUDGET)),
+    context_tokens=int(os.getenv("CONTEXT_TOKEN_BUDGET", CONTEXT_TOKEN_BUDGET)),
+)
+chat_sessions = SessionController(
+    client,
+    default_gemini_config=g_gemini_config,
+    state_backend=state_backend,
+    fit_history=context_budget.fit_history,
+)
+# keep warm conversations across restarts
+SESSION_SNAPSHOT_PATH = os.getenv("SESSION_SNAPSHOT_PATH")
+if SESSION_SNAPSHOT_PATH:
+    chat_sessions.load_snapshot(SESSION_SNAPSHOT_PATH)
+    atexit.register(chat_sessions.snapshot, SESSION_SNAPSHOT_PATH)
 feedback_controller = FeedbackController(delta_time=0) # for testing, change to 30 for production
-debounce_controller = DebounceMessageController(wait_seconds=DEBOUNCE_TIME) # 5 for testing, change to 10 for production
+debounce_controller = DebounceMessageController(
+    wait_seconds=DEBOUNCE_TIME, # 5 for testing, change to 10 for production
+    max_workers=int(os.getenv("DEBOUNCE_WORKERS", DEBOUNCE_WORKERS)),
+    state_backend=state_backend,
+)
+delivery_controller = DeliveryController(max_workers=int(os.getenv("DELIVERY_WORKERS", DELIVERY_WORKERS)))
+conversation_cache = ConversationCacheController(history_size=NUM_MESSAGE_CONTEXT)
+event_queue = EventQueueController(
+    max_size=int(os.getenv("EVENT_QUEUE_SIZE", EVENT_QUEUE_SIZE)),
+    num_workers=int(os.getenv("EVENT_WORKERS", EVENT_WORKERS)),
+)
+
+# Global context controller, query embeddings also kept on disk with EMBEDDING_CACHE_PATH
+embedding_cache = EmbeddingCacheController(path=os.getenv("EMBEDDING_CACHE_PATH"))
+# vector hits fused with BM25 keyword hits unless HYBRID_RETRIEVAL=0
+context_controller = ContextController(
+    path=db_path,
+    collection_name=COLLECTION_NAME,
+    embedding_cache=embedding_cache,
+    lexical_index=LexicalIndexController() if int(os.getenv("HYBRID_RETRIEVAL", HYBRID_RETRIEVAL)) else None,
+    mmr_diversity=float(os.getenv("RETRIEVAL_MMR_DIVERSITY", RETRIEVAL_MMR_DIVERSITY)),
+)
+RETRIEVAL_N_RESULTS = int(os.getenv("RETRIEVAL_N_RESULTS", RETRIEVAL_N_RESULTS))
+# answers to FAQ-style questions, RESPONSE_CACHE_TTL=0 disables it
+response_cache = ResponseCacheController(
+    embed=context_controller.embed_query,
+    threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", RESPONSE_CACHE_THRESHOLD)),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", RESPONSE_CACHE_TTL)),
+    state_backend=state_backend,
+)
 
-# Global context controller
-context_controller = ContextController(path=db_path, collection_name=COLLECTION_NAME)
+def on_ingestion_complete(job):
+    if job.added or job.removed:
+        response_cache.invalidate("knowledge base updated")
+
+# uploads of /update_context, embedded in the background, unfinished jobs resumed at startup
+ingestion_controller = IngestionController(
+    embed=context_controller.embed_documents,
+    upsert=context_controller.upsert_documents,
+    checkpoint_dir=os.getenv("INGESTION_CHECKPOINT_DIR", INGESTION_CHECKPOINT_DIR),
+    chunker=iter_chunks,
+    model_name=context_controller.model_name,
+    # only new or changed chunks are embedded
+    get_indexed=context_controller.get_indexed_chunks,
+    delete=context_controller.delete_documents,
+    max_workers=int(os.getenv("INGESTION_WORKERS", INGESTION_WORKERS)),
+    on_complete=on_ingestion_complete,
+)
+ingestion_controller.resume()
+# pre-embed the frequent questions without delaying startup
+threading.Thread(
+    target=context_controller.warm_up, args=(EXAMPLE_QUESTIONS,), name="embedding-warm-up", daemon=True
+).start()
 
 tools = [
     {
@@ -98,6 +210,105 @@ tools = [
     }
 ]
 
+def retrieve_testas_information(query: str) -> Dict:
+    documents = context_controller.query_similarity(query, RETRIEVAL_N_RESULTS)
+    return {"documents": context_budget.fit_documents(documents)}
+
+async def aretrieve_testas_information(query: str) -> Dict:
+    documents = await context_controller.aquery_similarity(query, RETRIEVAL_N_RESULTS)
+    return {"documents": context_budget.fit_documents(documents)}
+
+def split_by_query(chunks: List[Dict], num_queries: int) -> List[Dict]:
+    # each chunk answers the query it ranks best for, only once; the queries share the context budget
+    results = []
+    for i in range(num_queries):
+        documents = [chunk["document"] for chunk in chunks if chunk["queries"][0] == i]
+        results.append({"documents": context_budget.fit_documents(documents, share=1 / num_queries)})
+    return results
+
+def retrieve_testas_information_batch(calls: List[Dict]) -> List[Dict]:
+    queries = [call["query"] for call in calls]
+    return split_by_query(context_controller.query_many(queries, RETRIEVAL_N_RESULTS), len(queries))
+
+async def aretrieve_testas_information_batch(calls: List[Dict]) -> List[Dict]:
+    queries = [call["query"] for call in calls]
+    return split_by_query(await context_controller.aquery_many(queries, RETRIEVAL_N_RESULTS), len(queries))
+
+def retrieve_merged(queries: List[str]) -> Dict:
+    chunks = context_controller.query_many(queries, RETRIEVAL_N_RESULTS)
+    return {"documents": context_budget.fit_documents([chunk["document"] for chunk in chunks])}
+
+async def aretrieve_merged(queries: List[str]) -> Dict:
+    chunks = await context_controller.aquery_many(queries, RETRIEVAL_N_RESULTS)
+    return {"documents": context_budget.fit_documents([chunk["document"] for chunk in chunks])}
+
+# runs the tool calls of JSON replies, RAG answers take two model calls
+tool_controller = ToolController(
+    tools,
+    handlers={"retrieve_testas_information": retrieve_testas_information},
+    async_handlers={"retrieve_testas_information": aretrieve_testas_information},
+    # parallel retrieval calls share one embedding request and one vector search
+    batch_handlers={"retrieve_testas_information": retrieve_testas_information_batch},
+    async_batch_handlers={"retrieve_testas_information": aretrieve_testas_information_batch},
+    max_hops=int(os.getenv("MAX_TOOL_HOPS", MAX_TOOL_HOPS)),
+)
+# retrieval started before the model asks for it, see `run_tool_turn`
+speculator = SpeculativeRetrievalController(
+    retrieve_testas_information,
+    aretrieve_testas_information,
+    retrieve_many=retrieve_merged,
+    aretrieve_many=aretrieve_merged,
+    enabled=bool(int(os.getenv("SPECULATIVE_RETRIEVAL", SPECULATIVE_RETRIEVAL))),
+    pre_inject=bool(int(os.getenv("PRE_INJECT_CONTEXT", PRE_INJECT_CONTEXT))),
+)
+
+def get_turn_configs(config: Dict | None):
+    """
+    :return: `(tool_config, answer_config)` of a JSON reply turn, the first
+        declares the tools without JSON output (Gemini does not support both),
+        the second asks for the JSON reply. The system instruction of each
+        goes through the prompt cache.
+    """
+    config = config if config else g_gemini_config
+    tool_config = prompt_cache.apply(tool_controller.without_json(config), tools=tool_controller.tools)
+    return (
+        genai_types.GenerateContentConfig(**tool_config),
+        genai_types.GenerateContentConfig(**prompt_cache.apply(config)),
+    )
+
+def run_tool_turn(send: Callable, user_message: str, config: Dict | None):
+    """
+    Runs a JSON reply turn through the tool loop, the tools are always
+    declared. The retrieval of a message that looks factual starts alongside
+    the first model call, or is injected into the message so that the tool
+    hop is skipped.
+
+    :param send: Sends a message with a config to the chat, see `ToolController.run`.
+    :return: The last model response.
+    """
+    tool_config, answer_config = get_turn_configs(config)
+    kind = speculator.classify(user_message)
+    if kind == PRE_INJECT:
+        documents = speculator.retrieve_now(user_message)["documents"]
+        context = "\n---\n".join(documents)
+        message = f'Context: """{context}"""\n\n{user_message}' if documents else user_message
+        return tool_controller.run(send, message, answer_config, answer_config)
+
+    # the model decides whether to retrieve, a factual looking message is prefetched
+    speculation = speculator.start(user_message) if kind == SPECULATE else None
+    try:
+        return tool_controller.run(
+            send,
+            user_message,
+            tool_config,
+            answer_config,
+            overrides={"retrieve_testas_information": speculation.result} if speculation else None,
+        )
+    finally:
+        if speculation:
+            speculation.finish()
+
+
 # === === === === === === === ACTUAL WORK FUNCTION
 def get_gemini_response_with_context(
     user_message: str,
@@ -144,10 +355,12 @@ def get_gemini_response(
             return None
 
         if config:
-            config = genai_types.GenerateContentConfig(**config)
+            config = genai_types.GenerateContentConfig(**prompt_cache.apply(config))
             
         chat: Chat = chat_session["chat"]  # type: ignore
         response = chat.send_message(user_message, config=config)
+        prompt_cache.record_usage(response)
+        chat_sessions.save_session(sender_id, chat)
         return clean_message(response.text) # type: ignore
     except Exception as e:
         print("Gemini error:", e)
@@ -175,122 +388,196 @@ def get_gemini_response_with_context_json(
     message = f'Context: """{context}"""\n\n{user_message}'
     return get_gemini_response_json(message, sender_id, history, config)
 
-def get_gemini_response_with_context_json_rag(
+def get_gemini_response_json(
     user_message: str,
-    context: str,
     sender_id: str,
     history: List[genai_types.Content] = None,
     config: Dict = None,
 ) -> BotMessage | None:
     """
-    Generates a Gemini response using additional context prepended to the user message.
+    Generates a Gemini response based on the user message and optional session data.
 
     :param user_message: The user's input to the chatbot.
-    :param context: Supplementary context to guide the model's response.
     :param sender_id: Unique identifier used to retrieve or create a chat session.
     :param history: Optional list of past messages (chat history) for context.
     :param system_prompt: Optional instruction to condition the model's response
         style or behavior, this will override the configuration of the chat session.
     :return: The model's generated text reply, or a fallback message on error.
     """
+    # actually generate response:
+    try:
+        chat_session = chat_sessions.get_session(sender_id, history)
+        if chat_session == None:
+            return None
 
-    results = context_controller.query_relavant(user_message)
-    # 3. Prepare the context for the LLM
-    context = "\n---\n".join(results['documents'][0]) if results and results.get('documents') else "No relevant context found."
-
-    message = f"""
-    Dựa trên ngữ cảnh sau, vui lòng trả lời câu hỏi của người dùng. Nếu ngữ cảnh không chứa câu trả lời, hãy nói rằng bạn không biết.
+        chat: Chat = chat_session["chat"]  # type: ignore
 
-    Ngữ cảnh:
-    {context}
+        def send(message, turn_config):
+            response = chat.send_message(message, config=turn_config)
+            prompt_cache.record_usage(response)
+            return response
 
-    Câu hỏi: {user_message}
+        # retrieval tool calls are answered in the same chat
+        _response = run_tool_turn(send, user_message, config)
+        chat_sessions.save_session(sender_id, chat)
 
-    Trả lời:
-    """
-    return get_gemini_response_json(message, sender_id, history, config)
+        if _response.parsed:
+            response: BotMessage = _response.parsed
+            response.message = clean_message(response.message)
+            return response
+        return bot_message_from_text(_response.text or "")
+    except Exception as e:
+        print("Gemini error:", e)
+        return BotMessage(
+            message=DEFAULT_RESPONSE,
+            image_send_threshold=0.0,
+            image_urls=[],
+            customer_potential=0.0,
+        )
 
-def get_gemini_response_json(
+def get_gemini_response_json_stream(
     user_message: str,
     sender_id: str,
+    on_segment: Callable[[str], None],
     history: List[genai_types.Content] = None,
     config: Dict = None,
 ) -> BotMessage | None:
     """
-    Generates a Gemini response based on the user message and optional session data.
+    Streaming version of `get_gemini_response_json`: the `message` field of the
+    JSON reply is decoded while it is generated and cut at sentence and
+    paragraph ends, each segment is handed to `on_segment` as soon as it is
+    complete.
 
     :param user_message: The user's input to the chatbot.
     :param sender_id: Unique identifier used to retrieve or create a chat session.
+    :param on_segment: Called with each cleaned segment of the message, in order.
     :param history: Optional list of past messages (chat history) for context.
-    :param system_prompt: Optional instruction to condition the model's response
-        style or behavior, this will override the configuration of the chat session.
-    :return: The model's generated text reply, or a fallback message on error.
+    :return: The full reply, or a fallback message on error. When the stream
+        fails after segments were sent, a short apology follows them and the
+        partial turn is not saved to the session.
     """
-    # actually generate response:
+    reply = StreamedReply(on_segment, clean_message)
     try:
-        chat_session = chat_sessions.get_session(sender_id, history, tools=tools)
+        chat_session = chat_sessions.get_session(sender_id, history)
         if chat_session == None:
             return None
 
-        if config:
-            config = genai_types.GenerateContentConfig(**config)
-
         chat: Chat = chat_session["chat"]  # type: ignore
-        _response = chat.send_message(user_message, config=config)
 
-        # Check if the model decided to call a function
-        try:
-            function_call = _response.candidates[0].content.parts[0].function_call
-            # If we are here, the model chose a tool. Now we execute it.
-            if function_call.name == "retrieve_testas_information":
-                query_arg = function_call.args['query']
-                _response.text = get_gemini_response_with_context_json_rag(query=query_arg)
-                print(f"-> Final Answer: {_response.text}")
-        except (IndexError, AttributeError):
-            # The model decided to answer directly without using a tool
-            print("\n[Decision: Direct Answer (No Tool)]")
-            print(f"-> Model Response: {_response.text}")
-
-        response = BotMessage(
-            message=clean_message(_response.text),
+        def send(message, turn_config):
+            reply.start_hop()
+            last_chunk, call_chunk = None, None
+            for chunk in chat.send_message_stream(message, config=turn_config):
+                last_chunk = chunk
+                if chunk.function_calls:
+                    call_chunk = chunk
+                reply.feed(chunk.text or "")
+            reply.finish_hop(call_chunk is not None)
+            # usage is reported on the last chunk
+            prompt_cache.record_usage(last_chunk)
+            return call_chunk or last_chunk
+
+        run_tool_turn(send, user_message, config)
+        chat_sessions.save_session(sender_id, chat)
+
+        return bot_message_from_stream(reply.parser)
+    except Exception as e:
+        print("Gemini error:", e)
+        if reply.sent:
+            # the caller does not resend a streamed reply, close the partial one
+            on_segment(STREAM_ERROR_RESPONSE)
+        return BotMessage(
+            message=DEFAULT_RESPONSE,
             image_send_threshold=0.0,
             image_urls=[],
             customer_potential=0.0,
         )
-        if _response.parsed:
-            response: BotMessage = _response.parsed
-            response.message = clean_message(response.message)
-        return response  # type: ignore
-    except Exception as e:
-        print("Gemini error:", e)
+
+
+def bot_message_from_text(text: str) -> BotMessage:
+    """
+    Builds the reply from the raw text of a model turn: the JSON reply if it
+    parses, else the text as message (e.g. a direct answer of a tool hop).
+    """
+    try:
+        data = json.loads(re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip()))
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
         return BotMessage(
-            message=DEFAULT_RESPONSE,
+            message=clean_message(text),
             image_send_threshold=0.0,
             image_urls=[],
             customer_potential=0.0,
         )
+    response = BotMessage(**{
+        "image_send_threshold": 0.0, "image_urls": [], "customer_potential": 0.0, "message": "", **data,
+    })
+    response.message = clean_message(response.message)
+    return response
 
 
+def bot_message_from_stream(parser: JsonStringFieldParser) -> BotMessage:
+    """
+    Builds the reply of a completed stream.
+    """
+    return bot_message_from_text(parser.buffer)
+
+
+def make_segment_sender(sender_id, object_type):
+    """
+    Builds the `on_segment` callback of a streamed reply. Segments are queued
+    to the user in order, paced as if typed since the reply started, so
+    generation time counts as typing time.
+
+    :return: `(on_segment, sent)`, `sent` lists the segments queued so far.
+    """
+    start_time = time.monotonic()
+    sent: List[str] = []
+
+    def on_segment(segment: str):
+        if not segment:
+            return
+        sent.append(segment)
+        typed = sum(len(text) for text in sent)
+        delay = max(0.0, typed / g_app_config["bot_typing_cpm"] * 60 - (time.monotonic() - start_time))
+        delivery_controller.schedule_send(sender_id, delay, meta_api.send_meta_message, sender_id, segment, object_type)
+
+    return on_segment, sent
+
+
+def get_conversation_id(sender_id, object_type):
+    """
+    Get the conversation id with a user, asking the Graph API only on a cache miss.
+    """
+    conversation_id = conversation_cache.get_conversation_id(sender_id)
+    if not conversation_id:
+        conversation_id = meta_api.get_conversation_id_by_user_id(sender_id, object_type)
+        if conversation_id:
+            conversation_cache.set_conversation_id(sender_id, conversation_id)
+    return conversation_id
+
 def get_new_conversation_context(sender_id, object_type):
     """
     Get the context of a new conversation with a user.
     """
-    # Get all messages between the page and the user
-    conversation = meta_api.get_conversation_messages_by_user_id(sender_id)
-    if not conversation:
+    # Recent messages already seen through the webhook, no Graph call
+    recent_messages = conversation_cache.get_history(sender_id)
+    if recent_messages is not None:
+        return recent_messages
+
+    conversation_id = get_conversation_id(sender_id, object_type)
+    if not conversation_id:
         return ""
 
-    last_5_messages = conversation[:NUM_MESSAGE_CONTEXT]
-    message_ids = [msg["id"] for msg in last_5_messages]
-    
-    # Batch fetch the messages by IDs
-    batch_messages = meta_api.batch_get_messages_by_ids_v2(message_ids, object_type)
-    
-    return batch_messages
+    # Fetch the last messages with their content in a single call
+    messages = meta_api.get_conversation_messages(conversation_id, object_type, limit=NUM_MESSAGE_CONTEXT)
+    if messages:
+        conversation_cache.seed_history(sender_id, messages)
+    return messages
 
 def get_conversation_label(sender_id, object_type):
-    conversation = meta_api.get_conversation_messages_by_user_id(sender_id)
-    if not conversation:
+    if not get_conversation_id(sender_id, object_type):
         return ""
     
     # Get the labels of the conversation
@@ -301,6 +588,45 @@ def get_conversation_label(sender_id, object_type):
     # Return the first label
     return labels[0] if labels else ""
 
+def get_cached_response(sender_id, user_message, reply_context, history):
+    """
+    Looks a FAQ-style question up in the response cache, unless it may follow
+    up a recent turn of the user. A cached answer is appended to the user's
+    session as if Gemini had given it.
+
+    :return: `(bot_message, generation)`, bot_message is None on a miss and
+        generation is None if the question is not cacheable.
+    """
+    last_turn_at = chat_sessions.get_last_turn_time(sender_id)
+    if not response_cache.is_cacheable(user_message, reply_context, last_turn_at):
+        return None, None
+    try:
+        cached, generation = response_cache.lookup(user_message)
+    except Exception as e:
+        print("[ResponseCache] lookup error:", e)
+        return None, None
+    if cached is None:
+        return None, generation
+
+    bot_response = BotMessage(**cached)
+    chat_sessions.add_turns(
+        sender_id,
+        [("user", user_message), ("model", bot_response.model_dump_json())],
+        history,
+    )
+    return bot_response, generation
+
+def cache_response(user_message, bot_response: BotMessage | None, generation):
+    """
+    Stores a Gemini answer to a cacheable question, fallback answers excluded.
+    """
+    if generation is None or not bot_response or bot_response.message == DEFAULT_RESPONSE:
+        return
+    try:
+        response_cache.store(user_message, bot_response.model_dump(), generation)
+    except Exception as e:
+        print("[ResponseCache] store error:", e)
+
 def check_owner(object_type, sender_id):
     print("[Webhook]: Check owner", sender_id)
     if object_type == MESSAGE_OBJECT_TYPE["facebook_page"]:
@@ -341,8 +667,24 @@ def get_and_send_message(sender_id, messages : Message, object_type):
             chat_history = convert_to_gemini_chat_history(batch_messages)
             print("[Webhook]: New conversation context", len(batch_messages))
 
+    # FAQ-style questions answered recently skip Gemini
+    bot_response, cache_generation = get_cached_response(sender_id, user_message, reply_context, chat_history)
+
+    send_segment, streamed = make_segment_sender(sender_id, object_type)
+    if bot_response:
+        print("[Webhook]: Answered from the response cache")
+    elif STREAM_RESPONSES:
+        message = f'Context: """{reply_context}"""\n\n{user_message}' if reply_context else user_message
+        bot_response = get_gemini_response_json_stream(
+            message,
+            sender_id,
+            send_segment,
+            history=chat_history,
+            config=g_gemini_config,
+        )
+        cache_response(user_message, bot_response, cache_generation)
     # handle reply if any
-    if reply_context:
+    elif reply_context:
         print("[Webhook]: Reply to message", reply_context)    
         bot_response = get_gemini_response_with_context_json(
             user_message,
@@ -359,6 +701,7 @@ def get_and_send_message(sender_id, messages : Message, object_type):
             history=chat_history,
             config=g_gemini_config,
         )
+        cache_response(user_message, bot_response, cache_generation)
 
     if not bot_response:
         # Suspended, no response
@@ -375,8 +718,12 @@ def get_and_send_message(sender_id, messages : Message, object_type):
     typing_time = len(bot_reply) / g_app_config["bot_typing_cpm"] * 60  
     print("[Webhook]: Bot Reply", bot_reply)
 
-    if bot_reply:
-        thread_utils.delayed_call(typing_time, meta_api.send_meta_message, sender_id, bot_reply, object_type)
+    if streamed:
+        # text already queued segment by segment, the image follows the last one
+        print(f"[Webhook]: Streamed reply in {len(streamed)} messages")
+        typing_time = 0
+    elif bot_reply:
+        delivery_controller.schedule_send(sender_id, typing_time, meta_api.send_meta_message, sender_id, bot_reply, object_type)
     # TODO: might want to add this threshold into a config
     # also image_urls may contains multiple urls (should be up to 5)
     # NOTE: `image_send_threshold` can be above 0.5 without any image_urls. 
@@ -384,8 +731,8 @@ def get_and_send_message(sender_id, messages : Message, object_type):
         image_url = image_urls[0]
         print("[Webhook]: Image URL send", image_url)
         image_url = f"https://{image_url}" if not image_url.startswith("http") else image_url
-        # extra delay for image
-        thread_utils.delayed_call(typing_time, meta_api.send_meta_image, sender_id, image_url, object_type=object_type)
+        # queued after the text reply for this recipient
+        delivery_controller.schedule_send(sender_id, typing_time, meta_api.send_meta_image, sender_id, image_url, object_type=object_type)
 
 # === === === === === === === ROUTING FUNCTION
 def handle_user_feedback(sender_id, user_message, object_type):
@@ -427,6 +774,8 @@ def handle_user_message(message_event, object_type):
         # suspen chat session
         print("[Webhook]: Owner take over conversation", recipient_id)
         chat_sessions.suspend_session(recipient_id)
+        # drop bot replies still "typing" for this user
+        delivery_controller.cancel(recipient_id)
 
         if (RESUME_BOT_KEYWORD in user_message.lower()):
             # resume chat session
@@ -480,6 +829,56 @@ def handle_reaction_event(event, object_type):
         # Reaction removed
         feedback_controller.remove_feedback(message_id)
 
+def dispatch_webhook_events(data, submit_all):
+    """
+    Records the texts of a webhook payload into the conversation cache and hands
+    its message and reaction events to `submit_all` at once, so that a delivery
+    is queued whole or not at all (Meta redelivers a rejected one).
+
+    :param data: The decoded webhook payload.
+    :param submit_all: `(events, object_type) -> bool` with `events` a list of
+        `("message" | "reaction", event)`, False if the events were dropped.
+    :return: `(received, queued)` event counts.
+    """
+    object_type = data.get("object", "")
+    print("================================")
+    print("[Webhook]: Received data:", data)
+    events = []
+    for entry in data.get("entry", []):
+        for message_event in entry.get("messaging", []):
+            if "message" in message_event:
+                sender_id = message_event["sender"]["id"]
+                message = message_event.get("message", {})
+                app_id = message.get("app_id", "")
+                is_echo = message.get("is_echo", False)
+                
+                print("[Webhook]: Received message from", sender_id, "app_id:", app_id, "is_echo:", is_echo, "in", object_type, is_bot_message(app_id, sender_id, object_type))
+
+                # feed the recent-message buffer of the user, page messages included
+                if "text" in message:
+                    user_id = message_event["recipient"]["id"] if check_owner(object_type, sender_id) else sender_id
+                    conversation_cache.record_message(user_id, sender_id, message["text"])
+                
+                #check is bot message
+                if (is_bot_message(app_id, sender_id, object_type) and is_echo == True):
+                    print("[Webhook]: Bot message, ignore")
+                elif "text" in message_event["message"]:
+                    events.append(("message", message_event))
+            elif "reaction" in message_event:
+                events.append(("reaction", message_event))
+    if not events:
+        return 0, 0
+    return len(events), len(events) if submit_all(events, object_type) else 0
+
+def queue_webhook_events(events, object_type) -> bool:
+    """
+    Queues the events of a delivery, those of a sender in order on one worker.
+    """
+    handlers = {"message": handle_user_message, "reaction": handle_reaction_event}
+    return event_queue.submit_all([
+        (handlers[kind], (event, object_type), event["sender"]["id"]) for kind, event in events
+    ])
+
 @app.route("/test")
 def test():
     return "Flask is working!"
@@ -502,6 +901,7 @@ def config():
             return False
 
     if request.method == "POST":
+        system_instruction = g_gemini_config.get("system_instruction")
         form = request.form
         for key in form:
             field_value = form.get(key, "")
@@ -514,6 +914,11 @@ def config():
                 key = key.removeprefix("app_")
                 g_app_config[key] = field_value
 
+        if g_gemini_config.get("system_instruction") != system_instruction:
+            # cached answers were given under the old instruction
+            response_cache.invalidate("system instruction changed")
+            prompt_cache.invalidate()
+
         success = _apply_app_config()
         if success:
             print(f"[Config] Successfully change config.")
@@ -526,6 +931,24 @@ def htop(interval:int):
     log = logging.get_system_usage(interval)
     return log
 
+@app.route("/metrics")
+def metrics():
+    return jsonify({
+        "event_queue": event_queue.get_stats(),
+        "debounce": debounce_controller.get_stats(),
+        "delivery": delivery_controller.get_stats(),
+        "conversation_cache": conversation_cache.get_stats(),
+        "graph_api": graph_client.get_stats(),
+        "graph_batch": graph_batch.get_stats(),
+        "embedding_cache": embedding_cache.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "prompt_cache": prompt_cache.get_stats(),
+        "tools": tool_controller.get_stats(),
+        "budget": context_budget.get_stats(),
+        "speculation": speculator.get_stats(),
+        "ingestion": ingestion_controller.get_stats(),
+    })
+
 @app.route("/reset_session")
 def reset():
     # Reset all sessions
@@ -537,6 +960,7 @@ def update_context():
     """
     Updates the context repository with data from an uploaded JSON file.
     The JSON file should contain a list of strings.
+    Returns 202 with the id of the ingestion job, see `update_context_status`.
     """
     if 'file' not in request.files:
         return "No file part in the request", 400
@@ -545,30 +969,32 @@ def update_context():
         return "No file selected for uploading", 400
     if file and file.filename.endswith('.json'):
         try:
-            # Read the content of the file
-            content = file.read()
-            data = json.loads(content)
-
-            # Assuming the JSON file contains a list of documents (strings)
-            if not isinstance(data, list):
-                return "JSON file must contain a list of documents.", 400
-
-            # Add documents to the repository
-            all_chunks = text_chunking(data)
-            context_controller.add_documents(
-                documents=[chunk['content'] for chunk in all_chunks],
-                metadatas=[{'source_url': chunk['source_url'], 'title': chunk['title'], 'chunk_id': chunk['chunk_id']} for chunk in all_chunks]
-            )
-
-            return f"Successfully added {len(data)} documents to the repository.", 200
-        except json.JSONDecodeError:
-            return "Invalid JSON format.", 400
+            # streamed to disk, parsed, chunked and embedded in the background,
+            # see /update_context/<job_id>
+            job_id = ingestion_controller.submit_documents(file.stream)
+
+            return jsonify({
+                "job_id": job_id,
+                "status_url": f"/update_context/{job_id}",
+            }), 202
+        except ValueError as e:
+            return str(e), 400
         except Exception as e:
             print(f"Error updating context: {e}")
             return "An error occurred while updating the context.", 500
     else:
         return "Invalid file type. Please upload a JSON file.", 400
 
+@app.route("/update_context/<job_id>", methods=["GET"])
+def update_context_status(job_id):
+    """
+    Progress of an upload: status, chunks added, unchanged, removed and failed, throughput.
+    """
+    job = ingestion_controller.get_job(job_id)
+    if job is None:
+        return "Unknown job id", 404
+    return jsonify(job), 200
+
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
     # print(request)
@@ -579,31 +1005,16 @@ def webhook():
         return "Verification failed", 403
 
     elif request.method == 'POST':
-        data = request.get_json()
-        object_type = data.get("object", "")
-        print("================================")
-        print("[Webhook]: Received data:", data)
-        print(f"[GLOBAL] Chat sessions: {list(chat_sessions.sessions.keys())}")
-        print(f"[GLOBAL] Suspended Sessions: {list(chat_sessions.suspended_sessions.keys())}")
-        for entry in data.get("entry", []):
-            for message_event in entry.get("messaging", []):
-                if "message" in message_event:
-                    sender_id = message_event["sender"]["id"]
-                    message = message_event.get("message", {})
-                    app_id = message.get("app_id", "")
-                    is_echo = message.get("is_echo", False)
-                    
-                    print("[Webhook]: Received message from", sender_id, "app_id:", app_id, "is_echo:", is_echo, "in", object_type, is_bot_message(app_id, sender_id, object_type))
-                    
-                    #check is bot message
-                    if (is_bot_message(app_id, sender_id, object_type) and is_echo == True):
-                        print("[Webhook]: Bot message, ignore")
-                    elif "text" in message_event["message"]:
-                        handle_user_message(message_event, object_type)
-                elif "reaction" in message_event:
-                        handle_reaction_event(message_event, object_type)
-        
-        print("[Webhook]: Finished processing")
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return "Invalid payload", 400
+        # Only validate and enqueue here, the heavy lifting (Graph API, Sheets,
+        # Gemini) happens on the event queue workers so Meta gets its 200 fast.
+        received, queued = dispatch_webhook_events(data, queue_webhook_events)
+        print(f"[Webhook]: Queued {queued}/{received} events")
+        if queued < received:
+            # the delivery could not be queued, let Meta redeliver it later
+            return "busy", 503
         return "ok", 200
 
 if __name__ == '__main__':
@@ -0,0 +1,463 @@
+"""
+ASGI entry point, the async counterpart of `app:app`:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 3000
+
+Webhook events are handled as coroutines on the event loop: Graph API calls go
+through `api.meta_async`, Gemini through `client.aio` and retrieval through
+`ContextController.aquery_similarity`, so one process holds thousands of
+in-flight conversations instead of one per thread. Sessions, suspensions,
+debounce buffers and caches are the ones of `app`, every route other than
+`POST /webhook` is served by the Flask app.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+from typing import Callable, Dict, List, Set
+
+from asgiref.wsgi import WsgiToAsgi
+from google.genai import types as genai_types
+
+import app as wsgi
+from api import meta_async
+from constant import ASYNC_MAX_INFLIGHT, NUM_MESSAGE_CONTEXT, RESUME_BOT_KEYWORD
+from controller.DebounceMessageController import Message
+from controller.SpeculativeRetrievalController import PRE_INJECT, SPECULATE
+from controller.utils.chat import clean_message, convert_to_gemini_chat_history
+from gemini_prompt import DEFAULT_RESPONSE, STREAM_ERROR_RESPONSE, BotMessage
+from utils.stream_parser import StreamedReply
+
+MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", ASYNC_MAX_INFLIGHT))
+
+flask_app = WsgiToAsgi(wsgi.app)
+
+# webhook events being handled, strong references so tasks are not collected
+inflight: Set[asyncio.Task] = set()
+# last event task of each sender, the next one waits for it
+sender_tasks: Dict[str, asyncio.Task] = {}
+# pending bot replies per recipient, in sending order
+deliveries: Dict[str, List[asyncio.Task]] = {}
+
+
+def spawn_all(events, object_type) -> bool:
+    """
+    Handles the events of a webhook delivery in the background, all of them,
+    or none if too many events are already being handled. The events of a
+    sender run one after the other, in arrival order.
+    :param events: `("message" | "reaction", event)` pairs, see `app.dispatch_webhook_events`.
+    :return: False if the events were dropped.
+    """
+    if len(inflight) + len(events) > MAX_INFLIGHT:
+        return False
+    handlers = {"message": handle_user_message, "reaction": handle_reaction_event}
+    loop = asyncio.get_running_loop()
+    for kind, event in events:
+        sender_id = event["sender"]["id"]
+        task = loop.create_task(_after(sender_tasks.get(sender_id), handlers[kind](event, object_type)))
+        sender_tasks[sender_id] = task
+        inflight.add(task)
+        task.add_done_callback(functools.partial(_on_task_done, sender_id))
+    return True
+
+async def _after(previous: asyncio.Task | None, coro):
+    if previous is not None:
+        await asyncio.wait([previous])
+    await coro
+
+def _on_task_done(sender_id, task: asyncio.Task):
+    inflight.discard(task)
+    if sender_tasks.get(sender_id) is task:
+        del sender_tasks[sender_id]
+    if not task.cancelled() and task.exception():
+        print("[ASGI] Handler error:", repr(task.exception()))
+
+def _on_reply_done(future: concurrent.futures.Future):
+    if not future.cancelled() and future.exception():
+        print("[ASGI] Error in get_and_send_message:", repr(future.exception()))
+
+
+# === === === === === === === ACTUAL WORK FUNCTION
+async def run_tool_turn(send: Callable, user_message: str, config: Dict | None):
+    """
+    Async version of `app.run_tool_turn`.
+    """
+    # may create or refresh the context caches, a blocking call
+    tool_config, answer_config = await asyncio.to_thread(wsgi.get_turn_configs, config)
+    kind = wsgi.speculator.classify(user_message)
+    if kind == PRE_INJECT:
+        documents = (await wsgi.speculator.aretrieve_now(user_message))["documents"]
+        context = "\n---\n".join(documents)
+        message = f'Context: """{context}"""\n\n{user_message}' if documents else user_message
+        return await wsgi.tool_controller.arun(send, message, answer_config, answer_config)
+
+    # the model decides whether to retrieve, a factual looking message is prefetched
+    speculation = wsgi.speculator.astart(user_message) if kind == SPECULATE else None
+    try:
+        return await wsgi.tool_controller.arun(
+            send,
+            user_message,
+            tool_config,
+            answer_config,
+            overrides={"retrieve_testas_information": speculation.aresult} if speculation else None,
+        )
+    finally:
+        if speculation:
+            speculation.finish()
+
+async def get_gemini_response_json(
+    user_message: str,
+    sender_id: str,
+    history: List[genai_types.Content] = None,
+    config: Dict = None,
+    on_segment: Callable[[str], None] | None = None,
+) -> BotMessage | None:
+    """
+    Async version of `app.get_gemini_response_json`, streamed to `on_segment`
+    if given (see `app.get_gemini_response_json_stream`).
+    """
+    reply = StreamedReply(on_segment, clean_message) if on_segment else None
+    try:
+        # the session may be read from the state backend, a blocking call
+        chat_session = await asyncio.to_thread(wsgi.chat_sessions.get_session, sender_id, history, use_async=True)
+        if chat_session == None:
+            return None
+
+        chat = chat_session["chat"]
+
+        async def send(message, turn_config):
+            response = await chat.send_message(message, config=turn_config)
+            wsgi.prompt_cache.record_usage(response)
+            return response
+
+        async def send_streamed(message, turn_config):
+            reply.start_hop()
+            last_chunk, call_chunk = None, None
+            async for chunk in await chat.send_message_stream(message, config=turn_config):
+                last_chunk = chunk
+                if chunk.function_calls:
+                    call_chunk = chunk
+                reply.feed(chunk.text or "")
+            reply.finish_hop(call_chunk is not None)
+            wsgi.prompt_cache.record_usage(last_chunk)
+            return call_chunk or last_chunk
+
+        if on_segment:
+            await run_tool_turn(send_streamed, user_message, config)
+            await asyncio.to_thread(wsgi.chat_sessions.save_session, sender_id, chat)
+            return wsgi.bot_message_from_stream(reply.parser)
+
+        _response = await run_tool_turn(send, user_message, config)
+        await asyncio.to_thread(wsgi.chat_sessions.save_session, sender_id, chat)
+
+        if _response.parsed:
+            response: BotMessage = _response.parsed
+            response.message = clean_message(response.message)
+            return response
+        return wsgi.bot_message_from_text(_response.text or "")
+    except Exception as e:
+        print("Gemini error:", e)
+        if reply and reply.sent:
+            # the caller does not resend a streamed reply, close the partial one
+            on_segment(STREAM_ERROR_RESPONSE)
+        return BotMessage(
+            message=DEFAULT_RESPONSE,
+            image_send_threshold=0.0,
+            image_urls=[],
+            customer_potential=0.0,
+        )
+
+async def get_conversation_id(sender_id, object_type):
+    conversation_id = wsgi.conversation_cache.get_conversation_id(sender_id)
+    if not conversation_id:
+        conversation_id = await meta_async.get_conversation_id_by_user_id(sender_id, object_type)
+        if conversation_id:
+            wsgi.conversation_cache.set_conversation_id(sender_id, conversation_id)
+    return conversation_id
+
+async def get_new_conversation_context(sender_id, object_type):
+    recent_messages = wsgi.conversation_cache.get_history(sender_id)
+    if recent_messages is not None:
+        return recent_messages
+
+    conversation_id = await get_conversation_id(sender_id, object_type)
+    if not conversation_id:
+        return ""
+
+    messages = await meta_async.get_conversation_messages(conversation_id, object_type, limit=NUM_MESSAGE_CONTEXT)
+    if messages:
+        wsgi.conversation_cache.seed_history(sender_id, messages)
+    return messages
+
+async def get_conversation_label(sender_id, object_type):
+    if not await get_conversation_id(sender_id, object_type):
+        return ""
+
+    labels = await meta_async.get_labels_of_conversation(sender_id, object_type)
+    print("[Webhook]: Conversation labels", labels)
+    return labels[0] if labels else ""
+
+async def get_reply_message_text(message_event, object_type):
+    reply = message_event.get("message", {}).get("reply_to", None)
+    if reply == None:
+        return None
+    return await meta_async.get_message_by_id(reply["mid"], object_type)
+
+
+# ===== === === === === === === DELIVERY
+def schedule_delivery(recipient_id, delay, bot_reply, image_url, object_type):
+    """
+    Sends a reply (text, then image) after `delay` seconds of "typing", after
+    the replies already pending for the recipient.
+    """
+    pending = deliveries.setdefault(recipient_id, [])
+    previous = pending[-1] if pending else None
+    task = asyncio.get_running_loop().create_task(
+        _deliver(previous, delay, recipient_id, bot_reply, image_url, object_type)
+    )
+    pending.append(task)
+    task.add_done_callback(lambda t: _on_delivery_done(recipient_id, t))
+
+async def _deliver(previous, delay, recipient_id, bot_reply, image_url, object_type):
+    sleep = asyncio.sleep(delay)
+    if previous is not None:
+        # keep the typing time running while waiting for the previous reply
+        await asyncio.gather(sleep, asyncio.wait([previous]))
+    else:
+        await sleep
+    if bot_reply:
+        await meta_async.send_meta_message(recipient_id, bot_reply, object_type)
+    if image_url:
+        await meta_async.send_meta_image(recipient_id, image_url, object_type)
+
+def _on_delivery_done(recipient_id, task):
+    pending = deliveries.get(recipient_id)
+    if pending is None:
+        return
+    if task in pending:
+        pending.remove(task)
+    if not pending:
+        deliveries.pop(recipient_id, None)
+
+def make_segment_sender(sender_id, object_type):
+    """
+    Async version of `app.make_segment_sender`.
+    """
+    start_time = asyncio.get_running_loop().time()
+    sent: List[str] = []
+
+    def on_segment(segment: str):
+        if not segment:
+            return
+        sent.append(segment)
+        typed = sum(len(text) for text in sent)
+        elapsed = asyncio.get_running_loop().time() - start_time
+        delay = max(0.0, typed / wsgi.g_app_config["bot_typing_cpm"] * 60 - elapsed)
+        schedule_delivery(sender_id, delay, segment, None, object_type)
+
+    return on_segment, sent
+
+def cancel_deliveries(recipient_id) -> int:
+    pending = deliveries.pop(recipient_id, [])
+    for task in pending:
+        task.cancel()
+    return len(pending)
+
+
+# ===== === === === === === === CORE LOGICS
+async def get_and_send_message(sender_id, messages: List[Message], object_type):
+    print("[Webhook]: Get and send message", sender_id, messages)
+
+    reply_context, full_user_message = [], []
+    for message in messages:
+        if (message.get('reply_to', None) != None):
+            reply_context.append(message['reply_to'])
+        full_user_message.append(message['text'])
+    user_message = "\n".join(full_user_message)
+    reply_context = "\n".join(reply_context) if reply_context else None
+
+    # typing indicator and history bootstrap are independent
+    chat_history = None
+    if not await asyncio.to_thread(wsgi.chat_sessions.is_session_exist, sender_id):
+        _, batch_messages = await asyncio.gather(
+            meta_async.send_typing_indicator(sender_id),
+            get_new_conversation_context(sender_id, object_type),
+        )
+        if batch_messages:
+            chat_history = convert_to_gemini_chat_history(batch_messages)
+            print("[Webhook]: New conversation context", len(batch_messages))
+    else:
+        await meta_async.send_typing_indicator(sender_id)
+
+    # the cache lookup embeds the question, a blocking call
+    bot_response, cache_generation = await asyncio.to_thread(
+        wsgi.get_cached_response, sender_id, user_message, reply_context, chat_history
+    )
+    send_segment, streamed = make_segment_sender(sender_id, object_type)
+    on_segment = send_segment if wsgi.STREAM_RESPONSES else None
+    if bot_response:
+        print("[Webhook]: Answered from the response cache")
+    elif reply_context:
+        bot_response = await get_gemini_response_json(
+            f'Context: """{reply_context}"""\n\n{user_message}',
+            sender_id,
+            history=chat_history,
+            config=wsgi.g_gemini_config,
+            on_segment=on_segment,
+        )
+    else:
+        bot_response = await get_gemini_response_json(
+            user_message,
+            sender_id,
+            history=chat_history,
+            config=wsgi.g_gemini_config,
+            on_segment=on_segment,
+        )
+        await asyncio.to_thread(wsgi.cache_response, user_message, bot_response, cache_generation)
+    if not bot_response:
+        return
+
+    bot_reply = bot_response.message
+    typing_time = len(bot_reply) / wsgi.g_app_config["bot_typing_cpm"] * 60
+
+    image_url = None
+    if bot_response.image_urls and bot_response.image_send_threshold > 0.5:
+        image_url = bot_response.image_urls[0]
+        image_url = f"https://{image_url}" if not image_url.startswith("http") else image_url
+    if streamed:
+        # the text went out segment by segment, the image follows the last one
+        print("[Webhook]: Bot Reply streamed in", len(streamed), "messages")
+        if image_url:
+            schedule_delivery(sender_id, 0, None, image_url, object_type)
+    elif bot_reply or image_url:
+        print("[Webhook]: Bot Reply", bot_reply)
+        schedule_delivery(sender_id, typing_time, bot_reply, image_url, object_type)
+
+async def handle_user_feedback(sender_id, user_message, object_type):
+    feedback_text = user_message[len("/feedback"):].strip()
+    await asyncio.to_thread(wsgi.feedback_controller.log_feedback_text, object_type, sender_id, feedback_text)
+    await meta_async.send_meta_message(sender_id, "Cảm ơn bạn đã góp ý! 💬", object_type)
+
+async def handle_user_message(message_event, object_type):
+    sender_id = message_event["sender"]["id"]
+    user_message = message_event["message"]["text"]
+
+    if user_message.lower().startswith("/feedback"):
+        await handle_user_feedback(sender_id, user_message, object_type)
+        return
+
+    if user_message.lower().startswith("/dev-no-history"):
+        await asyncio.to_thread(wsgi.chat_sessions.delete_session, sender_id)
+        await asyncio.to_thread(wsgi.chat_sessions.create_session, sender_id)
+        print(f"[Webhook]: Chat session reset with no history for {sender_id}")
+        return
+
+    # session state may live in the shared state backend, off the event loop
+    if await asyncio.to_thread(wsgi.chat_sessions.is_chat_suspended, sender_id):
+        print("[Webhook]: Chat session suspended for user", sender_id)
+        return
+
+    # owner take over
+    if wsgi.check_owner(object_type, sender_id):
+        recipient_id = message_event["recipient"]['id']
+        print("[Webhook]: Owner take over conversation", recipient_id)
+        await asyncio.to_thread(wsgi.chat_sessions.suspend_session, recipient_id)
+        cancel_deliveries(recipient_id)
+        if (RESUME_BOT_KEYWORD in user_message.lower()):
+            print("[Webhook]: Owner resume chat session", recipient_id)
+            await asyncio.to_thread(wsgi.chat_sessions.resume_session, recipient_id)
+        return
+
+    # label lookup and reply lookup are independent Graph calls
+    _, reply_message_text = await asyncio.gather(
+        get_conversation_label(sender_id, object_type),
+        get_reply_message_text(message_event, object_type),
+    )
+
+    # the debounce timer fires on a scheduler thread, hand the reply back to the loop
+    loop = asyncio.get_running_loop()
+
+    def debounce_callback(uid, msgs):
+        if msgs:
+            future = asyncio.run_coroutine_threadsafe(get_and_send_message(uid, msgs, object_type), loop)
+            future.add_done_callback(_on_reply_done)
+        else:
+            print("[Webhook]: No messages in debounce buffer")
+
+    await asyncio.to_thread(
+        wsgi.debounce_controller.add_message,
+        sender_id,
+        {
+            "text": user_message,
+            "reply_to": reply_message_text,
+        },
+        debounce_callback
+    )
+
+async def handle_reaction_event(event, object_type):
+    sender_id = event["sender"]["id"]
+    message_id = event["reaction"]["mid"]
+    action = event["reaction"]["action"]
+
+    if action == "react":
+        message = await meta_async.get_message_by_id(message_id, object_type)
+        await asyncio.to_thread(
+            wsgi.feedback_controller.log_feedback,
+            object_type, sender_id, message_id, message,
+            event["reaction"]["reaction"], event["reaction"]["emoji"],
+        )
+    elif action == "unreact":
+        await asyncio.to_thread(wsgi.feedback_controller.remove_feedback, message_id)
+
+
+# === === === === === === === ASGI
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+async def _respond(send, status: int, text: str):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"text/plain; charset=utf-8")],
+    })
+    await send({"type": "http.response.body", "body": text.encode()})
+
+async def webhook(receive, send):
+    try:
+        data = json.loads(await _read_body(receive))
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        await _respond(send, 400, "Invalid payload")
+        return
+
+    received, queued = wsgi.dispatch_webhook_events(data, spawn_all)
+    print(f"[Webhook]: Handling {queued}/{received} events, {len(inflight)} in flight")
+    if queued < received:
+        await _respond(send, 503, "busy")
+        return
+    await _respond(send, 200, "ok")
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await meta_async.close_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/webhook" and scope["method"] == "POST":
+        await webhook(receive, send)
+    else:
+        await flask_app(scope, receive, send)
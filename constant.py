@@ -13,8 +13,17 @@ INSTA_URL = {
     'base': INSTAGRAM_BASE_URL,
     'message': f"{INSTAGRAM_BASE_URL}/me/messages",
     'typing': f"{FACEBOOK_BASE_URL}/me/messages",
+    'conversation_message': f"{INSTAGRAM_BASE_URL}/me/conversations",
 }
 
+GRAPH_TIMEOUT = (3.05, 15) # (connect, read) seconds
+GRAPH_MAX_RETRIES = 3
+GRAPH_BACKOFF_FACTOR = 0.5 # first retry after ~0.5s, then 1s, 2s...
+GRAPH_MAX_BACKOFF = 30 # never wait longer than this before a retry, in second
+GRAPH_POOL_SIZE = 20 # keep-alive connections per Graph host
+GRAPH_BATCH_WINDOW = 0.02 # coalesce Graph calls issued within this window (second), 0 to disable
+GRAPH_BATCH_SIZE = 50 # max operations per Graph batch request
+
 MESSAGE_OBJECT_TYPE = {
     'instagram': 'instagram',
     'facebook_page': 'page'
@@ -29,7 +38,29 @@ IMAGE_SEND_KEYWORD = 'send_image'
 
 RESUME_BOT_KEYWORD = "!!!"
 NUM_MESSAGE_CONTEXT = 10
+CONVERSATION_PAGE_SIZE = 100 # conversations per page when scanning /me/conversations
 DEBOUNCE_TIME = 20
+DEBOUNCE_WORKERS = 8 # threads running debounce callbacks (Gemini replies)
 BOT_TYPING_CPM = 190 # character per minute
+DELIVERY_WORKERS = 4 # threads delivering delayed outbound messages
 
 COLLECTION_NAME = "testas_docs"
+
+EVENT_QUEUE_SIZE = 1000 # max pending webhook events per worker process
+EVENT_WORKERS = 4 # threads processing webhook events per worker process
+ASYNC_MAX_INFLIGHT = 5000 # max webhook events handled at once by the ASGI entry point
+
+RESPONSE_CACHE_THRESHOLD = 0.95 # min cosine similarity to reuse a cached FAQ answer
+RESPONSE_CACHE_TTL = 3600 # in second, 0 disables the response cache
+PROMPT_CACHE_TTL = 3600 # in second, lifetime of the Gemini context cache of the system prompt, 0 disables it
+STREAM_RESPONSES = 1 # 1 to send replies sentence by sentence while Gemini generates them
+MAX_TOOL_HOPS = 1 # model turns fed with tool results before the final JSON reply
+SPECULATIVE_RETRIEVAL = 1 # 1 to start retrieval of factual-looking messages alongside the first model call
+PRE_INJECT_CONTEXT = 1 # 1 to answer clear knowledge-base questions with retrieved context in one model call
+HYBRID_RETRIEVAL = 1 # 1 to fuse BM25 keyword hits with the vector hits
+RETRIEVAL_N_RESULTS = 3 # chunks returned to the model per retrieval
+RETRIEVAL_MMR_DIVERSITY = 0 # weight of diversity when re-ranking the retrieved chunks (0 to 1), 0 disables it
+HISTORY_TOKEN_BUDGET = 2000 # session history tokens sent per turn, older turns are summarized, 0 disables it
+CONTEXT_TOKEN_BUDGET = 1500 # retrieved document tokens sent per turn, 0 disables it
+INGESTION_WORKERS = 4 # embedding requests in flight while ingesting an upload
+INGESTION_CHECKPOINT_DIR = "ingestion_jobs" # progress of uploads, resumed after a restart
@@ -0,0 +1,192 @@
+import re
+import threading
+from typing import Any, Dict, List, Tuple
+
+from utils.tokens import estimate_tokens
+
+HISTORY_TOKEN_BUDGET = 2000  # session history sent with each message
+CONTEXT_TOKEN_BUDGET = 1500  # retrieved documents of a turn
+SUMMARY_TOKEN_BUDGET = 200  # part of the history budget kept for the summary of the dropped turns
+SUMMARY_QUESTION_TOKENS = 30  # per question of the summary
+RECENT_TURNS = 4  # turns sent as they are, retrieved context included
+MIN_TRUNCATED_TOKENS = 32  # a document cut shorter than this is left out
+
+# retrieved documents or reply context prefixed to a user message, see `app.run_tool_turn`
+_CONTEXT_BLOCK = re.compile(r'^Context: """.*?"""\s*', re.DOTALL)
+_SUMMARY_PREFIX = 'Context: """Earlier questions of the user: '
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cuts a text between words to about `max_tokens` tokens.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    words, tokens = [], 0
+    for word in text.split():
+        tokens += estimate_tokens(word)
+        if tokens > max_tokens:
+            break
+        words.append(word)
+    return " ".join(words) + " …"
+
+def _strip_context(text: str) -> str:
+    # a turn that is only context (e.g. an owner message) is kept as is
+    stripped = _CONTEXT_BLOCK.sub("", text)
+    return stripped if stripped.strip() else text
+
+
+class ContextBudgetController:
+    """
+    Keeps the input tokens of a turn flat over long conversations:
+
+    - `fit_history` trims a session's `(role, text)` turns to the history
+      budget. Retrieved context is dropped from all but the recent turns,
+      then the oldest turns are dropped and their questions kept as a short
+      summary prefixed to the first remaining user turn. Trimmed sessions are
+      saved back as such, so they stay within the budget;
+    - `fit_documents` keeps the retrieved documents, best first, that fit the
+      context budget, the last one truncated.
+
+    Tokens are estimated (see `utils.tokens`), the tokens of each section
+    are logged and aggregated in `get_stats`.
+    """
+    def __init__(
+        self,
+        history_tokens: int = HISTORY_TOKEN_BUDGET,
+        context_tokens: int = CONTEXT_TOKEN_BUDGET,
+        summary_tokens: int = SUMMARY_TOKEN_BUDGET,
+        recent_turns: int = RECENT_TURNS,
+    ):
+        """
+        :param history_tokens: Budget of the session history, 0 disables trimming.
+        :param context_tokens: Budget of the retrieved documents of a turn, 0 disables it.
+        :param summary_tokens: Part of the history budget for the summary of dropped turns.
+        :param recent_turns: Latest turns whose retrieved context is kept.
+        """
+        self.history_tokens = history_tokens
+        self.context_tokens = context_tokens
+        self.summary_tokens = summary_tokens
+        self.recent_turns = recent_turns
+        self.lock = threading.Lock()
+
+        # metrics
+        self.histories = 0
+        self.history_tokens_sent = 0
+        self.turns_dropped = 0
+        self.contexts = 0
+        self.context_tokens_sent = 0
+        self.documents_dropped = 0
+        self.documents_truncated = 0
+
+    def _summarize(self, questions: List[str]) -> str:
+        # the most recent questions that fit the summary budget
+        limit = self.summary_tokens - estimate_tokens(_SUMMARY_PREFIX + '"""')
+        summary = ""
+        for question in reversed(questions):
+            candidate = f"{question}; {summary}" if summary else question
+            if estimate_tokens(candidate) > limit:
+                break
+            summary = candidate
+        return summary
+
+    def _first_kept(self, turns: List[Tuple[str, str]]) -> int:
+        # the latest turns within the budget, room left for the summary
+        start, tokens = len(turns), 0
+        while start > 0:
+            tokens += estimate_tokens(turns[start - 1][1])
+            if tokens > self.history_tokens - self.summary_tokens:
+                break
+            start -= 1
+        # the history starts with a user turn
+        while start < len(turns) and turns[start][0] != "user":
+            start += 1
+        return start
+
+    def fit_history(self, turns: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        :param turns: `(role, text)` turns of a session, oldest first.
+        :return: The turns within the history budget.
+        """
+        if not self.history_tokens or not turns:
+            return turns
+
+        turns, questions = list(turns), []
+        summary_block = _CONTEXT_BLOCK.match(turns[0][1]) if turns[0][1].startswith(_SUMMARY_PREFIX) else None
+        if summary_block:
+            # the summary of an earlier trim, carried over
+            questions.append(summary_block.group(0).strip()[len(_SUMMARY_PREFIX):-3])
+            turns[0] = (turns[0][0], turns[0][1][summary_block.end():])
+        # retrieved context of older turns was used for their answers already,
+        # the recent turns lose theirs too if they do not fit otherwise
+        for recent_turns in (self.recent_turns, 0):
+            recent = len(turns) - recent_turns
+            fitted = [
+                (role, _strip_context(text) if i < recent and role == "user" else text)
+                for i, (role, text) in enumerate(turns)
+            ]
+            start = self._first_kept(fitted)
+            if start <= recent:
+                break
+        dropped, turns = fitted[:start], fitted[start:]
+
+        for role, text in dropped:
+            question = " ".join(_CONTEXT_BLOCK.sub("", text).split()) if role == "user" else ""
+            if question:
+                questions.append(truncate_tokens(question, SUMMARY_QUESTION_TOKENS))
+        summary = self._summarize(questions)
+        if summary and turns:
+            turns[0] = ("user", f'{_SUMMARY_PREFIX}{summary}"""\n\n{turns[0][1]}')
+
+        sent = sum(estimate_tokens(text) for _, text in turns)
+        with self.lock:
+            self.histories += 1
+            self.history_tokens_sent += sent
+            self.turns_dropped += len(dropped)
+        if dropped:
+            print(f"[Budget] history: {len(turns)} turns, {sent} tokens, {len(dropped)} older turns summarized")
+        return turns
+
+    def fit_documents(self, documents: List[str], share: float = 1.0) -> List[str]:
+        """
+        :param documents: Retrieved documents, best first.
+        :param share: Part of the context budget for these documents, e.g. 1/n
+            for each of n retrievals of the same turn.
+        :return: The documents within the budget, the last one possibly truncated.
+        """
+        if not self.context_tokens or not documents:
+            return documents
+        budget = int(self.context_tokens * share)
+        fitted, tokens, truncated = [], 0, 0
+        for document in documents:
+            remaining = budget - tokens
+            document_tokens = estimate_tokens(document)
+            if document_tokens > remaining:
+                # a useful part of a document, or nothing
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    fitted.append(truncate_tokens(document, remaining))
+                    tokens += remaining
+                    truncated += 1
+                break
+            fitted.append(document)
+            tokens += document_tokens
+
+        with self.lock:
+            self.contexts += 1
+            self.context_tokens_sent += tokens
+            self.documents_dropped += len(documents) - len(fitted)
+            self.documents_truncated += truncated
+        print(f"[Budget] context: {len(fitted)}/{len(documents)} documents, {tokens} tokens")
+        return fitted
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "history_tokens": self.history_tokens,
+                "context_tokens": self.context_tokens,
+                "avg_history_tokens": self.history_tokens_sent / (self.histories or 1),
+                "turns_dropped": self.turns_dropped,
+                "avg_context_tokens": self.context_tokens_sent / (self.contexts or 1),
+                "documents_dropped": self.documents_dropped,
+                "documents_truncated": self.documents_truncated,
+            }
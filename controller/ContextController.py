@@ -1,90 +1,307 @@
+import asyncio
 import os
-import chromadb
+import threading
+import time
 from google import genai
 
+from controller.EmbeddingCacheController import EmbeddingCacheController
+from controller.IngestionController import chunk_hash
+from controller.LexicalIndexController import LexicalIndexController
+from controller.VectorStore import get_vector_store
+from utils.ranking import maximal_marginal_relevance, reciprocal_rank_fusion
+
+RETRIEVAL_CANDIDATES = 20 # hits of each retriever fused or diversified into the final results
+LEXICAL_INDEX_REFRESH = 300 # in second, rebuild of the lexical index for chunks ingested by other workers
+
 class ContextController:
     """
-    Manages the connection to ChromaDB and handles similarity queries
-    to retrieve relevant context for the chatbot.
+    Manages the connection to the vector store (Chroma or a local index) and
+    handles similarity queries to retrieve relevant context for the chatbot.
     """
     batch_size = 100
+    page_size = 500 # records per collection read when building the lexical index
 
-    def __init__(self, path: str = "chroma_db", collection_name: str = "facebook_posts"):
+    def __init__(
+        self,
+        path: str = "chroma_db",
+        collection_name: str = "facebook_posts",
+        embedding_cache: EmbeddingCacheController | None = None,
+        backend: str | None = None,
+        lexical_index: LexicalIndexController | None = None,
+        mmr_diversity: float = 0.0,
+        n_candidates: int = RETRIEVAL_CANDIDATES,
+        lexical_refresh_seconds: float = LEXICAL_INDEX_REFRESH,
+    ):
         """
-        Initializes the ChromaDB client and gets or creates a collection.
+        Initializes the vector store and gets or creates a collection.
 
         Args:
-            path (str): The path to the directory where ChromaDB data will be stored.
+            path (str): The path to the directory where local vector data will be stored.
             collection_name (str): The name of the collection to use.
+            embedding_cache (EmbeddingCacheController, optional): Cache of query
+                embeddings, an in-memory one by default.
+            backend (str, optional): `cloud`, `persistent` or `local`, read from
+                `VECTOR_BACKEND` by default.
+            lexical_index (LexicalIndexController, optional): BM25 index fused with
+                the vector hits (hybrid retrieval), dense retrieval only without it.
+            mmr_diversity (float): Weight of diversity in the re-ranking of the
+                hits (maximal marginal relevance), 0 disables it.
+            n_candidates (int): Hits of each retriever considered for fusion and re-ranking.
+            lexical_refresh_seconds (float): Age after which the lexical index is
+                rebuilt from the collection, for the chunks ingested by other workers.
         """
+        self.embedding_cache = embedding_cache if embedding_cache else EmbeddingCacheController()
+        self.lexical_index = lexical_index
+        self.mmr_diversity = mmr_diversity
+        self.n_candidates = n_candidates
+        self.lexical_refresh_seconds = lexical_refresh_seconds
+        self.lexical_build_lock = threading.Lock()
         API_KEY = os.getenv("GEMINI_API_KEY")
-        CHROMA_API_KEY = os.getenv("CHROMA_API_KEY")
         self.client = genai.Client(api_key=API_KEY)
         self.model_name = 'models/text-embedding-004'
         try:
-            # Using a persistent client to store data on disk
-            self.client_DB = chromadb.CloudClient(
-                api_key=CHROMA_API_KEY,
-                tenant='cd268c1a-064e-41e7-9286-35350f1ab529',
-                database='KNI'
-            )
-
-            self.collection = self.client_DB.get_or_create_collection(name=collection_name)
-
-            print(f"Successfully connected to ChromaDB and loaded collection '{collection_name}'.")
+            self.collection = get_vector_store(backend, path, collection_name)
+            print(f"Successfully loaded collection '{collection_name}'.")
 
         except Exception as e:
             print(f"Error initializing ContextController: {e}")
-            self.client = None
-            self.collection = None  
+            self.collection = None
 
     def add_documents(self, documents: list[str], metadatas: list[dict] = None, ids: list[str] = None):
         """
-        Adds documents to the ChromaDB collection.
+        Adds documents to the collection, embedded in batches. A batch whose
+        embedding fails is left out as a whole, the others keep their own
+        embeddings.
 
         Args:
             documents (list[str]): A list of document texts to add.
             metadatas (list[dict], optional): A list of metadata dictionaries corresponding to the documents.
-            ids (list[str], optional): A list of unique IDs for the documents. If not provided, they will be generated.
+            ids (list[str], optional): A list of unique IDs for the documents. If not provided, the
+                content hashes are used.
         """
         if not self.collection:
             print("Collection is not available. Cannot add documents.")
             return
 
+        metadatas = metadatas if metadatas else [{} for _ in documents]
         if not ids:
-            # Generate simple sequential IDs if none are provided
-            start_id = self.collection.count()
-            ids = [str(i) for i in range(start_id, start_id + len(documents))]
+            ids = [
+                chunk_hash({"source_url": metadata.get("source_url", ""), "content": document})
+                for document, metadata in zip(documents, metadatas)
+            ]
 
-        all_embeddings = []
-        chunk_contents = documents
-    
+        added = 0
+        num_batches = (len(documents) + self.batch_size - 1) // self.batch_size
         # Process the chunks in batches to respect API limits
-        for i in range(0, len(chunk_contents), self.batch_size):
-            batch = chunk_contents[i:i + self.batch_size]
+        for i in range(0, len(documents), self.batch_size):
+            batch = slice(i, i + self.batch_size)
             try:
-                # Call the Gemini API
-                result = self.client.models.embed_content(
-                    model=self.model_name,
-                    contents=batch,
+                embeddings = self.embed_documents(documents[batch])
+                self.upsert_documents(
+                    ids=ids[batch],
+                    documents=documents[batch],
+                    embeddings=embeddings,
+                    metadatas=metadatas[batch],
                 )
-                embeddings = [emb.values for emb in result.embeddings]
-
-                all_embeddings.extend(embeddings)
-                print(f"  - Embedded batch {i//self.batch_size + 1}/{(len(chunk_contents) + self.batch_size - 1)//self.batch_size}")
+                added += len(embeddings)
+                print(f"  - Embedded batch {i//self.batch_size + 1}/{num_batches}")
             except Exception as e:
                 print(f"An error occurred during embedding batch {i//self.batch_size + 1}: {e}")
-                
+        print(f"Successfully added {added} documents to the collection.")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embeds document texts in one call, bypassing the query embedding cache.
+        """
+        return self._embed(texts)
+
+    def upsert_documents(self, ids: list[str], documents: list[str], embeddings: list[list[float]], metadatas: list[dict]):
+        """
+        Adds documents with their embeddings, replacing the ones with the same ids.
+        """
+        if not self.collection:
+            raise RuntimeError("Collection is not available. Cannot add documents.")
+        self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, documents, metadatas)
+
+    def get_indexed_chunks(self, source_urls: list[str]) -> dict[str, dict]:
+        """
+        Returns the ids and metadata of the chunks indexed for the given sources.
+        """
+        if not self.collection or not source_urls:
+            return {}
+        results = self.collection.get(where={"source_url": {"$in": list(source_urls)}}, include=["metadatas"])
+        return dict(zip(results["ids"], results["metadatas"]))
+
+    def delete_documents(self, ids: list[str]):
+        """
+        Deletes documents by id.
+        """
+        if self.collection and ids:
+            self.collection.delete(ids=ids)
+            if self.lexical_index is not None:
+                self.lexical_index.delete(ids)
+
+    def _embed(self, texts: list[str]) -> list[list[float]]:
+        result = self.client.models.embed_content(
+            model=self.model_name,
+            contents=texts,
+        )
+        return [emb.values for emb in result.embeddings]
+
+    def embed_queries(self, query_texts: list[str]) -> list[list[float]]:
+        """
+        Embeds query texts, only the ones missing from the embedding cache go
+        to the Gemini API, in one call.
+
+        Args:
+            query_texts (list[str]): The queries to embed.
+
+        Returns:
+            list[list[float]]: One embedding per query, in order.
+        """
+        return self.embedding_cache.get_many(query_texts, self.model_name, self._embed)
+
+    def embed_query(self, query_text: str) -> list[float]:
+        """
+        Embeds a single query text, see `embed_queries`.
+        """
+        return self.embed_queries([query_text])[0]
+
+    def warm_up(self, query_texts: list[str]) -> int:
+        """
+        Pre-embeds frequent questions into the embedding cache.
+
+        Returns:
+            int: The number of questions that were not cached yet.
+        """
+        misses = self.embedding_cache.misses
+        try:
+            self.embed_queries(query_texts)
+        except Exception as e:
+            print(f"Error warming up the embedding cache: {e}")
+        return self.embedding_cache.misses - misses
+
+    def _build_lexical_index(self):
+        ids, documents, metadatas = [], [], []
+        try:
+            while True:
+                page = self.collection.get(include=["documents", "metadatas"], limit=self.page_size, offset=len(ids))
+                ids.extend(page["ids"])
+                documents.extend(page["documents"])
+                metadatas.extend(page["metadatas"])
+                if len(page["ids"]) < self.page_size:
+                    break
+            self.lexical_index.build(ids, documents, metadatas)
+            print(f"[ContextController] Lexical index built with {len(ids)} chunks")
+        except Exception as e:
+            print(f"Error building the lexical index: {e}")
+            # retried at the next refresh rather than at every query
+            self.lexical_index.built_at = time.monotonic()
+
+    def _refresh_lexical_index(self):
+        if self.lexical_index.built_at is None:
+            with self.lexical_build_lock:
+                if self.lexical_index.built_at is None:
+                    self._build_lexical_index()
+        elif (
+            time.monotonic() - self.lexical_index.built_at > self.lexical_refresh_seconds
+            and self.lexical_build_lock.acquire(blocking=False)
+        ):
+            # queries keep using the current index meanwhile
+            def rebuild():
+                try:
+                    self._build_lexical_index()
+                finally:
+                    self.lexical_build_lock.release()
+            threading.Thread(target=rebuild, name="lexical-index", daemon=True).start()
+
+    def _rank_many(self, query_texts: list[str], query_embeddings: list[list[float]], n_results: int) -> list[list[dict]]:
+        """
+        Dense hits of all queries in one collection query, fused with the
+        lexical hits by reciprocal rank fusion and diversified with maximal
+        marginal relevance when enabled.
+        """
+        rerank = self.lexical_index is not None or self.mmr_diversity > 0
+        n_candidates = max(n_results, self.n_candidates) if rerank else n_results
+        results = self.collection.query(query_embeddings=query_embeddings, n_results=n_candidates)
+        chunks, all_ranked = {}, []
+        if self.lexical_index is not None:
+            self._refresh_lexical_index()
+        for i, query_text in enumerate(query_texts):
+            dense = []
+            for id_, document, metadata in zip(results["ids"][i], results["documents"][i], results["metadatas"][i]):
+                chunks[id_] = {"id": id_, "document": document, "metadata": metadata or {}}
+                dense.append(id_)
+            rankings = [dense]
+            if self.lexical_index is not None:
+                lexical = []
+                for id_, _ in self.lexical_index.search(query_text, n_candidates):
+                    if id_ not in chunks:
+                        hit = self.lexical_index.get(id_)
+                        if hit is None:
+                            continue
+                        chunks[id_] = {"id": id_, "document": hit[0], "metadata": hit[1]}
+                    lexical.append(id_)
+                rankings.append(lexical)
+            all_ranked.append(reciprocal_rank_fusion(rankings)[:n_candidates])
+
+        if self.mmr_diversity > 0 and any(len(ranked) > n_results for ranked in all_ranked):
+            candidates = list({id_: None for ranked in all_ranked for id_, _ in ranked})
+            embedded = self.collection.get(ids=candidates, include=["embeddings"])
+            vectors = dict(zip(embedded["ids"], embedded["embeddings"]))
+            for i, ranked in enumerate(all_ranked):
+                ranked = [(id_, score) for id_, score in ranked if id_ in vectors]
+                # fused scores relative to the best hit as relevance
+                top_score = ranked[0][1] if ranked else 1.0
+                picked = maximal_marginal_relevance(
+                    [score / top_score for _, score in ranked],
+                    [vectors[id_] for id_, _ in ranked],
+                    n_results,
+                    self.mmr_diversity,
+                )
+                all_ranked[i] = [ranked[j] for j in picked]
+        return [[chunks[id_] for id_, _ in ranked[:n_results]] for ranked in all_ranked]
+
+    def _rank(self, query_text: str, query_embedding: list[float], n_results: int) -> list[dict]:
+        return self._rank_many([query_text], [query_embedding], n_results)[0]
+
+    @staticmethod
+    def _merge(per_query: list[list[dict]]) -> list[dict]:
+        # best ranks of every query first, a chunk found by several queries once
+        merged = {}
+        for rank, i, chunk in sorted(
+            (rank, i, chunk) for i, chunks in enumerate(per_query) for rank, chunk in enumerate(chunks)
+        ):
+            if chunk["id"] not in merged:
+                merged[chunk["id"]] = dict(chunk, queries=[])
+            merged[chunk["id"]]["queries"].append(i)
+        return list(merged.values())
+
+    def query_chunks(self, query_text: str, n_results: int = 3) -> list[dict]:
+        """
+        Queries the collection for the chunks most relevant to the query text.
+
+        Args:
+            query_text (str): The text to find relevant chunks for.
+            n_results (int): The number of chunks to return.
+
+        Returns:
+            list[dict]: `id`, `document` and `metadata` of each chunk, best first.
+                        Returns an empty list if an error occurs or no results are found.
+        """
+        if not self.collection:
+            print("Collection is not available. Cannot perform query.")
+            return []
+
         try:
-            self.collection.add(
-                documents=documents,
-                embeddings=all_embeddings,
-                metadatas=metadatas,
-                ids=ids
-            )
-            print(f"Successfully added {len(documents)} documents to the collection.")
+            # 1. Embed the query, skipped for a question seen before
+            query_embedding = self.embed_query(query_text)
+            return self._rank(query_text, query_embedding, n_results)
         except Exception as e:
-            print(f"Error adding documents: {e}")
+            print(f"Error during similarity query: {e}")
+            return []
 
     def query_similarity(self, query_text: str, n_results: int = 3) -> list[str]:
         """
@@ -98,24 +315,92 @@ class ContextController:
             list[str]: A list of the most similar document texts.
                        Returns an empty list if an error occurs or no results are found.
         """
+        return [chunk["document"] for chunk in self.query_chunks(query_text, n_results)]
+
+    def query_many(self, query_texts: list[str], n_results: int = 3) -> list[dict]:
+        """
+        Queries the collection for several queries at once (e.g. the questions
+        of merged messages, or parallel tool calls): the queries missing from
+        the embedding cache are embedded in one call and searched in one
+        collection query.
+
+        Args:
+            query_texts (list[str]): The texts to find relevant chunks for.
+            n_results (int): The number of chunks of each query.
+
+        Returns:
+            list[dict]: The chunks of all queries, each once, best ranks of every
+                query first. `queries` lists the indexes of the queries that
+                found a chunk, the one it ranks best for first.
+        """
         if not self.collection:
             print("Collection is not available. Cannot perform query.")
             return []
+        if not query_texts:
+            return []
 
-        # 1. Embed the query
-        query_embedding = self.client.models.embed_content(
-            model=self.model_name,
-            contents=[query_text],
-        ).embeddings[0].values
-        print(f"Query embedding: {query_embedding[:5]}... (truncated)")
+        try:
+            query_embeddings = self.embed_queries(query_texts)
+            return self._merge(self._rank_many(query_texts, query_embeddings, n_results))
+        except Exception as e:
+            print(f"Error during similarity query: {e}")
+            return []
+
+    async def _aembed_queries(self, query_texts: list[str]) -> list[list[float]]:
+        # async version of `embed_queries`, the misses embedded in one `client.aio` call
+        embeddings = [self.embedding_cache.get(text, self.model_name) for text in query_texts]
+        missing = list({text: None for text, embedding in zip(query_texts, embeddings) if embedding is None})
+        if missing:
+            result = await self.client.aio.models.embed_content(model=self.model_name, contents=missing)
+            embedded = {}
+            for text, embedding in zip(missing, result.embeddings):
+                embedded[text] = embedding.values
+                self.embedding_cache.put(text, self.model_name, embedding.values)
+            embeddings = [
+                embedding if embedding is not None else embedded[text]
+                for text, embedding in zip(query_texts, embeddings)
+            ]
+        return embeddings
+
+    async def aquery_similarity(self, query_text: str, n_results: int = 3) -> list[str]:
+        """
+        Async version of `query_similarity`, for the ASGI entry point. The
+        embedding goes through `client.aio`, the blocking queries run in a
+        worker thread.
+
+        Args:
+            query_text (str): The text to find similar documents for.
+            n_results (int): The number of similar documents to return.
+
+        Returns:
+            list[str]: A list of the most similar document texts.
+        """
+        if not self.collection:
+            print("Collection is not available. Cannot perform query.")
+            return []
+
+        try:
+            query_embeddings = await self._aembed_queries([query_text])
+            chunks = await asyncio.to_thread(self._rank, query_text, query_embeddings[0], n_results)
+            return [chunk["document"] for chunk in chunks]
+        except Exception as e:
+            print(f"Error during similarity query: {e}")
+            return []
+
+    async def aquery_many(self, query_texts: list[str], n_results: int = 3) -> list[dict]:
+        """
+        Async version of `query_many`.
+        """
+        if not self.collection:
+            print("Collection is not available. Cannot perform query.")
+            return []
+        if not query_texts:
+            return []
 
         try:
-            results = self.collection.query(
-                query_embeddings=query_embedding, # Query takes a list of embeddings
-                n_results=3
-            )
-            # The result is a dictionary, we are interested in the 'documents' for the first query
-            return results.get('documents', [[]])[0]
+            query_embeddings = await self._aembed_queries(query_texts)
+            per_query = await asyncio.to_thread(self._rank_many, query_texts, query_embeddings, n_results)
+            return self._merge(per_query)
         except Exception as e:
             print(f"Error during similarity query: {e}")
             return []
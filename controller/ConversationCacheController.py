@@ -0,0 +1,109 @@
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+
+CONVERSATION_CACHE_SIZE = 10000
+CONVERSATION_CACHE_TTL = 86400  # in second
+
+
+class _RecentMessages:
+    __slots__ = ("messages", "complete")
+
+    def __init__(self, size: int):
+        self.messages: Deque[Tuple[str | None, str]] = deque(maxlen=size)
+        # True once seeded from the Graph API, the buffer then holds the real
+        # tail of the conversation and not only what this worker has seen.
+        self.complete = False
+
+
+class ConversationCacheController:
+    """
+    Caches what session bootstrap needs from the Graph API:
+
+    - PSID -> conversation id (LRU + TTL), so the full `/me/conversations`
+      scan runs at most once per user.
+    - A ring buffer of the last messages per user, fed by webhook messages
+      (incoming, echoes and owner replies).
+
+    The ring buffer is only used as chat history once seeded from the Graph
+    API: a buffer fed by webhooks alone may miss messages (e.g. sent before
+    this worker started, or delivered to another worker), even when full.
+    """
+    def __init__(
+        self,
+        max_users: int = CONVERSATION_CACHE_SIZE,
+        ttl: int = CONVERSATION_CACHE_TTL,
+        history_size: int = 10,
+    ):
+        self.history_size = history_size
+        self.conversation_ids: TTLCache = TTLCache(maxsize=max_users, ttl=ttl)
+        self.recent_messages: TTLCache = TTLCache(maxsize=max_users, ttl=ttl)
+        self.lock = threading.Lock()
+
+        # metrics
+        self.id_hits = 0
+        self.id_misses = 0
+        self.history_hits = 0
+        self.history_misses = 0
+
+    def get_conversation_id(self, user_id: str) -> Optional[str]:
+        with self.lock:
+            conversation_id = self.conversation_ids.get(user_id)
+            if conversation_id:
+                self.id_hits += 1
+            else:
+                self.id_misses += 1
+            return conversation_id
+
+    def set_conversation_id(self, user_id: str, conversation_id: str):
+        with self.lock:
+            self.conversation_ids[user_id] = conversation_id
+
+    def record_message(self, user_id: str, sender_id: str | None, text: str):
+        """
+        Appends a message of the conversation with `user_id` to its ring buffer.
+        """
+        with self.lock:
+            recent = self.recent_messages.get(user_id)
+            if recent is None:
+                recent = _RecentMessages(self.history_size)
+            recent.messages.append((sender_id, text))
+            # re-set to refresh the TTL
+            self.recent_messages[user_id] = recent
+
+    def seed_history(self, user_id: str, messages: List[Tuple[str | None, str]]):
+        """
+        Replaces the user's ring buffer with the conversation tail fetched from
+        the Graph API (oldest first).
+        """
+        with self.lock:
+            recent = _RecentMessages(self.history_size)
+            recent.messages.extend(messages)
+            recent.complete = True
+            self.recent_messages[user_id] = recent
+
+    def get_history(self, user_id: str) -> Optional[List[Tuple[str | None, str]]]:
+        """
+        :return: The last messages (oldest first) if the buffer was seeded from
+            the Graph API, None if the Graph API must be asked.
+        """
+        with self.lock:
+            recent = self.recent_messages.get(user_id)
+            if recent is not None and recent.complete:
+                self.history_hits += 1
+                return list(recent.messages)
+            self.history_misses += 1
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "conversation_ids": len(self.conversation_ids),
+                "conversation_id_hits": self.id_hits,
+                "conversation_id_misses": self.id_misses,
+                "recent_message_buffers": len(self.recent_messages),
+                "history_hits": self.history_hits,
+                "history_misses": self.history_misses,
+            }
@@ -1,7 +1,10 @@
 # utils/debounce.py
 import threading
 import time
-from typing import Dict, List, Callable, TypedDict
+from typing import Any, Dict, List, Callable, TypedDict
+
+from controller.StateBackend import InMemoryStateBackend, StateBackend
+from utils.scheduler import TimerScheduler
 
 class Message(TypedDict):
     text: str
@@ -11,11 +14,17 @@ class DebounceMessageController:
     """
     Per-user debounce: collect messages during a quiet-period window
     and call a callback once after inactivity.
+
+    All users share one `TimerScheduler` thread; re-arming a user's deadline
+    is a heap push, and callbacks run on the scheduler's bounded pool.
+    Buffers live in the `StateBackend`, so with a shared backend fragments
+    received by different workers end up in one buffer and only the worker
+    that finds it due pops it.
     """
-    def __init__(self, wait_seconds: int = 10):
+    def __init__(self, wait_seconds: int = 10, max_workers: int = 8, state_backend: StateBackend | None = None):
         self.wait_seconds = wait_seconds
-        self.buffers: Dict[str, List[Message]] = {}
-        self.timers: Dict[str, threading.Timer] = {}
+        self.state_backend = state_backend if state_backend else InMemoryStateBackend()
+        self.scheduler = TimerScheduler(max_workers=max_workers, name="debounce")
         self.lock = threading.Lock()
 
     def add_message(
@@ -28,27 +37,30 @@ class DebounceMessageController:
         """Add a message and (re)start that user’s debounce timer."""
         with self.lock:
             # append to buffer
-            self.buffers.setdefault(user_id, []).append(message)
-
-            # cancel previous timer if running
-            if user_id in self.timers:
-                self.timers[user_id].cancel()
-
-            # start fresh timer
-            timer = threading.Timer(
-                self.wait_seconds,
-                self._fire,
-                args=(user_id, callback)
-            )
-            timer.daemon = True
-            self.timers[user_id] = timer
-            timer.start()
+            self.state_backend.append_message(user_id, message, time.time() + self.wait_seconds)
+
+            # (re)arm the user's deadline, replaces any pending one
+            self.scheduler.schedule(user_id, self.wait_seconds, self._fire, user_id, callback)
 
     def _fire(self, user_id: str, callback: Callable[[str, List[str]], None]):
         print(f"[DebounceMessageController] _fire called, user_id = {user_id}")
         """Timer expiry → call callback with all buffered messages."""
         with self.lock:
-            messages = self.buffers.pop(user_id, [])
-            self.timers.pop(user_id, None)
+            if self.scheduler.is_pending(user_id):
+                # a new message re-armed the timer while this one was dispatched
+                return
+            messages, deadline = self.state_backend.pop_messages_if_due(user_id, time.time())
+            if messages is None:
+                # another worker pushed the deadline, check again then
+                self.scheduler.schedule(user_id, deadline - time.time(), self._fire, user_id, callback)
+                return
         if messages:
-            callback(user_id, messages)
\ No newline at end of file
+            callback(user_id, messages)
+
+    def get_stats(self) -> Dict[str, Any]:
+        pending_buffers, pending_messages = self.state_backend.count_buffers()
+        return {
+            "pending_buffers": pending_buffers,
+            "pending_messages": pending_messages,
+            **self.scheduler.get_stats(),
+        }
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict
+
+from utils.scheduler import TimerScheduler
+
+
+class OutboundSend:
+    __slots__ = ("due", "callback", "args", "kwargs")
+
+    def __init__(self, due: float, callback: Callable[..., Any], args: tuple, kwargs: dict):
+        self.due = due
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+
+
+class DeliveryController:
+    """
+    Holds delayed outbound sends (simulated typing time) as lightweight records
+    instead of sleeping threads.
+
+    Each recipient has a FIFO of pending sends and at most one timer armed on
+    the shared scheduler, so sends to the same recipient go out in the order
+    they were scheduled (text before image) and never run concurrently.
+    """
+    def __init__(self, max_workers: int = 4):
+        self.scheduler = TimerScheduler(max_workers=max_workers, name="delivery")
+        self.queues: Dict[str, Deque[OutboundSend]] = {}
+        self.draining: set = set()
+        self.lock = threading.Lock()
+
+        # metrics
+        self.sent = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def schedule_send(self, recipient_id: str, delay: float, callback: Callable[..., Any], *args, **kwargs):
+        """
+        Call `callback(*args, **kwargs)` after `delay` seconds, but never before
+        the sends already pending for `recipient_id`.
+        """
+        due = time.monotonic() + max(0.0, delay)
+        with self.lock:
+            queue = self.queues.setdefault(recipient_id, deque())
+            if queue:
+                due = max(due, queue[-1].due)
+            queue.append(OutboundSend(due, callback, args, kwargs))
+            if len(queue) == 1 and recipient_id not in self.draining:
+                self.scheduler.schedule_at(recipient_id, due, self._drain, recipient_id)
+
+    def cancel(self, recipient_id: str) -> int:
+        """
+        Drop every pending send for `recipient_id`, e.g. when the owner takes over.
+        A send that is already being delivered is not interrupted.
+        :return: The number of dropped sends.
+        """
+        with self.lock:
+            self.scheduler.cancel(recipient_id)
+            queue = self.queues.pop(recipient_id, None)
+            dropped = len(queue) if queue else 0
+            self.cancelled += dropped
+        if dropped:
+            print(f"[DeliveryController] Cancelled {dropped} pending sends for {recipient_id}")
+        return dropped
+
+    def _drain(self, recipient_id: str):
+        with self.lock:
+            self.draining.add(recipient_id)
+        try:
+            while True:
+                with self.lock:
+                    queue = self.queues.get(recipient_id)
+                    if not queue:
+                        self.queues.pop(recipient_id, None)
+                        return
+                    head = queue[0]
+                    if head.due > time.monotonic():
+                        self.scheduler.schedule_at(recipient_id, head.due, self._drain, recipient_id)
+                        return
+                    queue.popleft()
+
+                failed = False
+                try:
+                    head.callback(*head.args, **head.kwargs)
+                except Exception as e:
+                    failed = True
+                    print(f"[DeliveryController] Error sending to {recipient_id}: {e}")
+                with self.lock:
+                    if failed:
+                        self.failed += 1
+                    else:
+                        self.sent += 1
+        finally:
+            with self.lock:
+                self.draining.discard(recipient_id)
+                # a send scheduled while draining may not have armed a timer
+                queue = self.queues.get(recipient_id)
+                if queue and not self.scheduler.is_pending(recipient_id):
+                    self.scheduler.schedule_at(recipient_id, queue[0].due, self._drain, recipient_id)
+
+    def pending_count(self, recipient_id: str | None = None) -> int:
+        with self.lock:
+            if recipient_id is not None:
+                return len(self.queues.get(recipient_id, ()))
+            return sum(len(queue) for queue in self.queues.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            pending_sends = sum(len(queue) for queue in self.queues.values())
+            pending_recipients = len(self.queues)
+        return {
+            "pending_sends": pending_sends,
+            "pending_recipients": pending_recipients,
+            "sent": self.sent,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            **self.scheduler.get_stats(),
+        }
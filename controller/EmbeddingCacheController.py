@@ -0,0 +1,141 @@
+import re
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+EMBEDDING_CACHE_SIZE = 5000
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = " ?!.…"
+
+
+def normalize_query(text: str) -> str:
+    """
+    "  TestAS là gì ? " and "testas là gì" share one embedding: Unicode NFC,
+    case folded, whitespace collapsed, trailing punctuation dropped.
+    """
+    text = unicodedata.normalize("NFC", text).casefold()
+    return _WHITESPACE.sub(" ", text).strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+class EmbeddingCacheController:
+    """
+    Caches query embeddings by (model name, normalized text), so repeated
+    questions skip the embedding call.
+
+    - An in-memory LRU tier of `max_entries` vectors.
+    - An optional SQLite tier at `path`, vectors stored as float32 blobs. It is
+      shared by every worker of the host and survives restarts.
+    """
+    def __init__(self, max_entries: int = EMBEDDING_CACHE_SIZE, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.path = path
+        self.entries: OrderedDict[str, List[float]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        if path:
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+
+        # metrics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(text: str, model_name: str) -> str:
+        return f"{model_name}\x00{normalize_query(text)}"
+
+    def _remember(self, key: str, vector: List[float]):
+        with self.lock:
+            self.entries[key] = vector
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, text: str, model_name: str) -> Optional[List[float]]:
+        key = self._key(text, model_name)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+        if self.path:
+            row = self._connect().execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row:
+                vector = array("f", row[0]).tolist()
+                self._remember(key, vector)
+                with self.lock:
+                    self.disk_hits += 1
+                return vector
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, model_name: str, vector: List[float]):
+        key = self._key(text, model_name)
+        vector = list(vector)
+        self._remember(key, vector)
+        if self.path:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                (key, array("f", vector).tobytes()),
+            )
+
+    def get_many(
+        self,
+        texts: List[str],
+        model_name: str,
+        embed: Callable[[List[str]], List[List[float]]],
+    ) -> List[List[float]]:
+        """
+        Returns the embeddings of `texts`, in order. The misses are embedded
+        with a single `embed` call, duplicates included once.
+        """
+        vectors: List[Optional[List[float]]] = [self.get(text, model_name) for text in texts]
+        missing: Dict[str, List[int]] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(normalize_query(texts[i]), []).append(i)
+
+        if missing:
+            indexes = list(missing.values())
+            embedded = embed([texts[positions[0]] for positions in indexes])
+            for positions, vector in zip(indexes, embedded):
+                self.put(texts[positions[0]], model_name, vector)
+                for i in positions:
+                    vectors[i] = list(vector)
+        return vectors  # type: ignore
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.path:
+            self._connect().execute("DELETE FROM embeddings")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / (lookups or 1),
+            }
@@ -0,0 +1,136 @@
+import queue
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class EventQueueController:
+    """
+    Bounded in-process work queue drained by a fixed pool of worker threads.
+    The webhook only validates and enqueues events, the workers do the slow
+    part (Graph API calls, Google Sheets, Gemini) off the request thread.
+
+    Each worker has its own queue and the events of a key (e.g. the sender's
+    PSID) always go to the same one, so they are handled in arrival order.
+    """
+    def __init__(self, max_size: int = 1000, num_workers: int = 4, name: str = "event-worker"):
+        """
+        :param max_size: Pending events over all workers.
+        :param num_workers: Worker threads, each with its own queue.
+        """
+        self.max_size = max_size
+        self.num_workers = num_workers
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=max(1, -(-max_size // num_workers))) for _ in range(num_workers)
+        ]
+        self.lock = threading.Lock()
+        self.submit_lock = threading.Lock()  # free room is checked and filled at once
+        self.next_queue = 0  # of events without key
+
+        # metrics
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.total_wait_time = 0.0
+        self.total_process_time = 0.0
+        self.max_wait_time = 0.0
+        self.max_process_time = 0.0
+
+        self.workers = []
+        for i, worker_queue in enumerate(self.queues):
+            worker = threading.Thread(target=self._worker_loop, args=(worker_queue,), name=f"{name}-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def _queue_index(self, key: Optional[Hashable]) -> int:
+        if key is None:
+            self.next_queue = (self.next_queue + 1) % self.num_workers
+            return self.next_queue
+        return hash(key) % self.num_workers
+
+    def submit(self, handler: Callable[..., Any], *args, key: Optional[Hashable] = None, **kwargs) -> bool:
+        """
+        Enqueue `handler(*args, **kwargs)` without blocking.
+        :param key: Events with the same key are handled in order, by one worker.
+        :return: True if the event was queued, False if the queue is full.
+        """
+        return self._put_all([(handler, args, kwargs, key)])
+
+    def submit_all(self, jobs: List[Tuple[Callable[..., Any], tuple, Optional[Hashable]]]) -> bool:
+        """
+        Enqueue several `(handler, args, key)` jobs, all of them or none.
+        :return: True if the jobs were queued, False if there is no room for all of them.
+        """
+        return self._put_all([(handler, args, {}, key) for handler, args, key in jobs])
+
+    def _put_all(self, jobs: List[Tuple[Callable[..., Any], tuple, Dict[str, Any], Optional[Hashable]]]) -> bool:
+        if not jobs:
+            return True
+        with self.submit_lock:
+            indexes = [self._queue_index(key) for _, _, _, key in jobs]
+            needed = Counter(indexes)
+            # the workers only take events out, the room checked here stays free
+            if any(self.queues[i].maxsize - self.queues[i].qsize() < count for i, count in needed.items()):
+                with self.lock:
+                    self.dropped += len(jobs)
+                names = ", ".join(sorted({handler.__name__ for handler, _, _, _ in jobs}))
+                print(f"[EventQueueController] Queue full ({self.max_size}), dropping {len(jobs)} events for {names}")
+                return False
+            enqueued_time = time.monotonic()
+            for i, (handler, args, kwargs, _) in zip(indexes, jobs):
+                self.queues[i].put_nowait((enqueued_time, handler, args, kwargs))
+
+        with self.lock:
+            self.enqueued += len(jobs)
+        return True
+
+    def _worker_loop(self, worker_queue: queue.Queue):
+        while True:
+            enqueued_time, handler, args, kwargs = worker_queue.get()
+            start_time = time.monotonic()
+            failed = False
+            try:
+                handler(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                print(f"[EventQueueController] Error in {handler.__name__}: {e}")
+            finally:
+                end_time = time.monotonic()
+                self._record(start_time - enqueued_time, end_time - start_time, failed)
+                worker_queue.task_done()
+
+    def _record(self, wait_time: float, process_time: float, failed: bool):
+        with self.lock:
+            self.processed += 1
+            if failed:
+                self.failed += 1
+            self.total_wait_time += wait_time
+            self.total_process_time += process_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            self.max_process_time = max(self.max_process_time, process_time)
+
+    def join(self):
+        """
+        Blocks until every queued event has been processed.
+        """
+        for worker_queue in self.queues:
+            worker_queue.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            processed = self.processed or 1
+            return {
+                "queue_depth": sum(worker_queue.qsize() for worker_queue in self.queues),
+                "queue_capacity": self.max_size,
+                "workers": self.num_workers,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "avg_wait_ms": self.total_wait_time / processed * 1000,
+                "max_wait_ms": self.max_wait_time * 1000,
+                "avg_process_ms": self.total_process_time / processed * 1000,
+                "max_process_ms": self.max_process_time * 1000,
+            }
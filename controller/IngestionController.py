@@ -0,0 +1,489 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from utils.json_stream import batched, iter_json_array
+
+INGESTION_BATCH_SIZE = 100  # chunks per embedding request
+INGESTION_WORKERS = 4  # embedding requests in flight
+INGESTION_MAX_RETRIES = 3
+INGESTION_BACKOFF = 1.0  # in second, doubled after every failed attempt
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+INPUT_CHUNKS = "chunks"
+INPUT_DOCUMENTS = "documents"
+
+
+def chunk_hash(chunk: Dict[str, Any]) -> str:
+    """
+    Stable id of a chunk: the hash of its source and content, the same
+    chunk uploaded twice is upserted in place.
+    """
+    payload = f"{chunk.get('source_url', '')}\n{chunk['content']}"
+    return hashlib.sha256(payload.encode("utf8")).hexdigest()[:32]
+
+
+class IngestionJob:
+    """
+    Progress of one upload, also what `/update_context/<job_id>` returns.
+    """
+    def __init__(self, job_id: str, total: int, created: float | None = None, input: str = INPUT_CHUNKS):
+        self.id = job_id
+        self.input = input
+        self.input_path = None
+        self.status = JOB_QUEUED
+        self.total = total  # chunks read so far for a streamed upload
+        self.added = 0  # new or changed chunks, embedded and upserted
+        self.unchanged = 0  # already indexed with the same content and model
+        self.removed = 0  # indexed for an uploaded source, gone from it
+        self.skipped = 0  # duplicates within the upload
+        self.failed = 0
+        self.error = None
+        self.created = created if created else time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished if self.finished else time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "added": self.added,
+            "unchanged": self.unchanged,
+            "removed": self.removed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "error": self.error,
+            "elapsed": elapsed,
+            "chunks_per_second": self.added / elapsed if elapsed else 0.0,
+        }
+
+
+class IngestionController:
+    """
+    Background ingestion of chunks into the vector store:
+
+    - `submit` (chunks) and `submit_documents` (an uploaded JSON array of
+      documents) return a job id at once, the job runs on its own thread;
+    - an upload is streamed from disk: documents are parsed one at a time,
+      chunked by a generator and read in batches, while at most a few batches
+      wait for the embedding pool, so memory follows the batch size rather
+      than the corpus size (only the 32-char ids of chunks seen are kept);
+    - chunks are embedded in batches by a bounded pool of concurrent
+      requests, a failed request is retried with backoff;
+    - each batch is upserted with its own embeddings, under content-hash ids,
+      so a failed batch never shifts the others;
+    - indexing is incremental: a chunk already indexed with the same hash and
+      embedding model is not embedded again, and the chunks of an uploaded
+      `source_url` that are not in the upload anymore are deleted (sources
+      absent from the upload are left alone);
+    - with a `checkpoint_dir`, the input of a job and the ids of every
+      upserted batch are written to disk, `resume` restarts unfinished jobs
+      after a crash from where they stopped, and any worker can read a job's
+      progress.
+    """
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[List[float]]],
+        upsert: Callable[..., None],
+        checkpoint_dir: Optional[str] = None,
+        chunker: Optional[Callable[[Iterable[Dict[str, Any]]], Iterator[Dict[str, Any]]]] = None,
+        model_name: str = "",
+        get_indexed: Optional[Callable[[List[str]], Dict[str, Dict[str, Any]]]] = None,
+        delete: Optional[Callable[[List[str]], None]] = None,
+        batch_size: int = INGESTION_BATCH_SIZE,
+        max_workers: int = INGESTION_WORKERS,
+        max_retries: int = INGESTION_MAX_RETRIES,
+        backoff: float = INGESTION_BACKOFF,
+        on_complete: Optional[Callable[[IngestionJob], None]] = None,
+    ):
+        """
+        :param embed: Returns the embeddings of a batch of texts.
+        :param upsert: Called with `ids`, `documents`, `embeddings` and `metadatas` of a batch.
+        :param chunker: Turns documents into chunks lazily, for `submit_documents`.
+        :param model_name: Embedding model, stored with every chunk.
+        :param get_indexed: Returns `{id: metadata}` of the chunks indexed for
+            some source urls, None disables incremental indexing.
+        :param delete: Deletes chunks by id.
+        :param on_complete: Called once a job finished, e.g. to invalidate caches.
+        """
+        self.embed = embed
+        self.upsert = upsert
+        self.checkpoint_dir = checkpoint_dir
+        self.chunker = chunker
+        self.model_name = model_name
+        self.get_indexed = get_indexed
+        self.delete = delete
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_in_flight = 2 * max_workers  # batches read ahead of the embedding pool
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.on_complete = on_complete
+        self.jobs: Dict[str, IngestionJob] = {}
+        self.lock = threading.Lock()
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+        # metrics
+        self.embed_retries = 0
+        self.embed_calls = 0
+        self.chunks_added = 0
+        self.chunks_unchanged = 0
+        self.chunks_removed = 0
+
+    # === checkpoints
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{job_id}.{suffix}")
+
+    def _write_job(self, job: IngestionJob, chunks: Optional[List[Dict[str, Any]]] = None):
+        """
+        Writes the job's status, and its chunks once when given.
+        """
+        if not self.checkpoint_dir:
+            return
+        if chunks is not None:
+            with open(self._path(job.id, INPUT_CHUNKS), "w", encoding="utf8") as f:
+                json.dump(chunks, f, ensure_ascii=False)
+        state = {
+            "status": job.status,
+            "input": job.input,
+            "total": job.total,
+            "created": job.created,
+            "error": job.error,
+        }
+        tmp_path = self._path(job.id, "json.tmp")
+        with open(tmp_path, "w", encoding="utf8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._path(job.id, "json"))
+
+    def _read_done(self, job_id: str) -> set:
+        if not self.checkpoint_dir or not os.path.exists(self._path(job_id, "done")):
+            return set()
+        with open(self._path(job_id, "done"), encoding="utf8") as f:
+            return {line.strip() for line in f if line.strip()}
+
+    def _mark_done(self, job_id: str, ids: List[str]):
+        if not self.checkpoint_dir:
+            return
+        with self.lock, open(self._path(job_id, "done"), "a", encoding="utf8") as f:
+            f.write("".join(f"{id_}\n" for id_ in ids))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _claim(self, job_id: str) -> bool:
+        """
+        Takes the job's lock file, so that a single worker resumes it. A lock
+        left by a process that is gone is taken over.
+        """
+        if not self.checkpoint_dir:
+            return True
+        lock_path = self._path(job_id, "lock")
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    with open(lock_path) as f:
+                        pid = int(f.read())
+                    if pid <= 0:
+                        raise ValueError(pid)
+                    os.kill(pid, 0)
+                    return False
+                except (ProcessLookupError, ValueError):
+                    try:
+                        os.remove(lock_path)
+                    except FileNotFoundError:
+                        pass
+                except PermissionError:
+                    # alive, owned by another user
+                    return False
+                except FileNotFoundError:
+                    pass
+        return False
+
+    def _release(self, job_id: str):
+        if self.checkpoint_dir:
+            try:
+                os.remove(self._path(job_id, "lock"))
+            except FileNotFoundError:
+                pass
+
+    # === jobs
+    def submit(self, chunks: List[Dict[str, Any]]) -> str:
+        """
+        Queues chunks (`content`, `source_url`, `title`, `chunk_id`) for ingestion.
+        :return: The job id.
+        """
+        job = IngestionJob(uuid.uuid4().hex, len(chunks))
+        if self.checkpoint_dir:
+            job.input_path = self._path(job.id, INPUT_CHUNKS)
+        with self.lock:
+            self.jobs[job.id] = job
+        self._write_job(job, chunks)
+        self._claim(job.id)
+        self._start(job, lambda: iter(chunks))
+        return job.id
+
+    def submit_documents(self, fp: IO[bytes]) -> str:
+        """
+        Queues an uploaded JSON array of documents, copied to disk as is and
+        parsed by the job.
+        :raises ValueError: If the upload is not a JSON array.
+        :return: The job id.
+        """
+        job = IngestionJob(uuid.uuid4().hex, 0, input=INPUT_DOCUMENTS)
+        if self.checkpoint_dir:
+            job.input_path = self._path(job.id, INPUT_DOCUMENTS)
+        else:
+            fd, job.input_path = tempfile.mkstemp(suffix=".json")
+            os.close(fd)
+        with open(job.input_path, "wb") as f:
+            shutil.copyfileobj(fp, f)
+        with open(job.input_path, "rb") as f:
+            head = f.read(64).lstrip(b"\xef\xbb\xbf \t\r\n")
+        if not head.startswith(b"["):
+            os.remove(job.input_path)
+            raise ValueError("JSON file must contain a list of documents.")
+
+        with self.lock:
+            self.jobs[job.id] = job
+        self._write_job(job)
+        self._claim(job.id)
+        self._start(job, lambda: self._read_input(job.input_path, INPUT_DOCUMENTS))
+        return job.id
+
+    def _read_input(self, path: str, input: str) -> Iterator[Dict[str, Any]]:
+        """
+        Streams the chunks of a job's input file.
+        """
+        with open(path, "rb") as f:
+            items = iter_json_array(f)
+            if input == INPUT_DOCUMENTS:
+                items = self.chunker(items)
+            yield from items
+
+    def resume(self) -> List[str]:
+        """
+        Restarts the unfinished jobs of the checkpoint directory.
+        :return: The ids of the resumed jobs.
+        """
+        if not self.checkpoint_dir:
+            return []
+        resumed = []
+        for name in sorted(os.listdir(self.checkpoint_dir)):
+            if not name.endswith(".json"):
+                continue
+            job_id = name[:-len(".json")]
+            try:
+                with open(self._path(job_id, "json"), encoding="utf8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[Ingestion] unreadable checkpoint {name}: {e}")
+                continue
+            if state["status"] not in (JOB_QUEUED, JOB_RUNNING) or not self._claim(job_id):
+                continue
+            input = state.get("input", INPUT_CHUNKS)
+            job = IngestionJob(job_id, state["total"], state["created"], input)
+            job.input_path = self._path(job_id, input)
+            with self.lock:
+                self.jobs[job_id] = job
+            print(f"[Ingestion] resuming job {job_id}")
+            self._start(job, lambda path=job.input_path, input=input: self._read_input(path, input))
+            resumed.append(job_id)
+        return resumed
+
+    def _start(self, job: IngestionJob, source: Callable[[], Iterator[Dict[str, Any]]]):
+        threading.Thread(target=self._run, args=(job, source), name=f"ingestion-{job.id[:8]}", daemon=True).start()
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        :return: The job's progress, read from the checkpoints for a job of another worker.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not self.checkpoint_dir or not os.path.exists(self._path(job_id, "json")):
+            return None
+        with open(self._path(job_id, "json"), encoding="utf8") as f:
+            state = json.load(f)
+        job = IngestionJob(job_id, state["total"], state["created"])
+        job.status, job.error = state["status"], state.get("error")
+        job.added = len(self._read_done(job_id))
+        return job.to_dict()
+
+    def _embed_with_retry(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.lock:
+                    self.embed_calls += 1
+                embeddings = self.embed(texts)
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"got {len(embeddings)} embeddings for {len(texts)} texts")
+                return embeddings
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                with self.lock:
+                    self.embed_retries += 1
+                delay = self.backoff * 2 ** attempt
+                print(f"[Ingestion] embedding failed ({e}), retry in {delay}s")
+                time.sleep(delay)
+
+    def _process(self, job: IngestionJob, batch: List[Dict[str, Any]]):
+        ids = [chunk_hash(chunk) for chunk in batch]
+        embeddings = self._embed_with_retry([chunk["content"] for chunk in batch])
+        self.upsert(
+            ids=ids,
+            documents=[chunk["content"] for chunk in batch],
+            embeddings=embeddings,
+            metadatas=[
+                {
+                    "source_url": chunk.get("source_url", ""),
+                    "title": chunk.get("title", ""),
+                    "chunk_id": chunk.get("chunk_id", ""),
+                    "content_hash": id_,
+                    "embedding_model": self.model_name,
+                }
+                for chunk, id_ in zip(batch, ids)
+            ],
+        )
+        self._mark_done(job.id, ids)
+
+    def _plan(self, job: IngestionJob, chunks: List[Dict[str, Any]], state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Diffs a batch of read chunks against the index. `state` carries over
+        the batches of the job: ids seen and done, sources looked up, and per
+        source the indexed ids not met yet, stale unless met later.
+        :return: The chunks to embed.
+        """
+        stale = state["stale"]
+        if self.get_indexed:
+            # chunks without a source are never diffed
+            source_urls = {chunk["source_url"] for chunk in chunks if chunk.get("source_url")}
+            new_urls = sorted(source_urls - state["fetched"])
+            if new_urls:
+                state["fetched"].update(new_urls)
+                for id_, metadata in self.get_indexed(new_urls).items():
+                    metadata = metadata or {}
+                    stale.setdefault(metadata.get("source_url", ""), {})[id_] = metadata.get("embedding_model")
+
+        pending = []
+        for chunk in chunks:
+            id_ = chunk_hash(chunk)
+            if id_ in state["seen"]:
+                job.skipped += 1
+                continue
+            state["seen"].add(id_)
+            model = stale.get(chunk.get("source_url", ""), {}).pop(id_, None)
+            if id_ in state["done"] or model == self.model_name:
+                # same content embedded by the same model, or upserted before a restart
+                job.unchanged += 1
+            else:
+                pending.append(chunk)
+        return pending
+
+    def _run(self, job: IngestionJob, source: Callable[[], Iterator[Dict[str, Any]]]):
+        job.status, job.started = JOB_RUNNING, time.time()
+        self._write_job(job)
+        state = {"done": self._read_done(job.id), "seen": set(), "fetched": set(), "stale": {}}
+        failed_sources = set()
+        in_flight: Dict[Any, List[Dict[str, Any]]] = {}
+
+        def collect(futures):
+            for future in futures:
+                batch = in_flight.pop(future)
+                try:
+                    future.result()
+                    job.added += len(batch)
+                except Exception as e:
+                    job.failed += len(batch)
+                    job.error = str(e)
+                    failed_sources.update(chunk.get("source_url", "") for chunk in batch)
+                    print(f"[Ingestion] batch of {len(batch)} chunks failed: {e}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest") as executor:
+                def submit(batch):
+                    if len(in_flight) >= self.max_in_flight:
+                        # wait for the pool instead of reading ahead
+                        collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                    in_flight[executor.submit(self._process, job, batch)] = batch
+
+                read, pending = 0, []
+                try:
+                    for chunks in batched(source(), self.batch_size):
+                        read += len(chunks)
+                        job.total = max(job.total, read)
+                        pending.extend(self._plan(job, chunks, state))
+                        while len(pending) >= self.batch_size:
+                            submit(pending[:self.batch_size])
+                            pending = pending[self.batch_size:]
+                    if pending:
+                        submit(pending)
+                finally:
+                    collect(wait(in_flight).done)
+
+            # old versions of a source are kept until its new chunks are all in
+            removed = [
+                id_ for source_url, ids in state["stale"].items() if source_url not in failed_sources for id_ in ids
+            ]
+            if removed and self.delete:
+                self.delete(removed)
+                job.removed = len(removed)
+            status = JOB_FAILED if job.failed else JOB_DONE
+        except Exception as e:
+            # e.g. a malformed upload, nothing is deleted
+            status, job.error = JOB_FAILED, str(e)
+            print(f"[Ingestion] job {job.id} failed: {e}")
+        # the upload is gone by the time the job shows as finished
+        if job.input_path and os.path.exists(job.input_path):
+            os.remove(job.input_path)
+        job.status, job.finished = status, time.time()
+        self._write_job(job)
+        self._release(job.id)
+        with self.lock:
+            self.chunks_added += job.added
+            self.chunks_unchanged += job.unchanged
+            self.chunks_removed += job.removed
+        stats = job.to_dict()
+        print(
+            f"[Ingestion] job {job.id} {job.status}: {job.added} added, {job.unchanged} unchanged, "
+            f"{job.removed} removed, {job.failed} failed, {stats['chunks_per_second']:.1f} chunks/s"
+        )
+        if self.on_complete:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                print(f"[Ingestion] on_complete error: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            jobs = [job.to_dict() for job in self.jobs.values()]
+            return {
+                "jobs": len(jobs),
+                "running": sum(job["status"] == JOB_RUNNING for job in jobs),
+                "chunks_added": self.chunks_added,
+                "chunks_unchanged": self.chunks_unchanged,
+                "chunks_removed": self.chunks_removed,
+                "embed_calls": self.embed_calls,
+                "embed_retries": self.embed_retries,
+                "last_job": jobs[-1] if jobs else None,
+            }
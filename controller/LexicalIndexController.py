@@ -0,0 +1,126 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Terms of a text for the lexical index: case folded, Vietnamese and
+    German diacritics removed ("Học phí" and "hoc phi" match, so do
+    "Prüfung" and "prufung").
+    """
+    text = unicodedata.normalize("NFD", text.casefold()).replace("đ", "d")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _WORD.findall(text)
+
+
+class LexicalIndexController:
+    """
+    In-process BM25 inverted index over the chunks of the vector store, so
+    exact terms (exam dates, "TestAS Core", university names, prices) are
+    found even when dense search misses them.
+
+    The index is kept up to date by the chunk upserts and deletes of this
+    process, and rebuilt from the collection with `build` (at the first query,
+    then periodically, for the chunks ingested by other workers).
+    """
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.built_at: Optional[float] = None  # monotonic time of the last `build`
+        self._reset()
+
+    def _reset(self):
+        self.documents: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self.term_counts: Dict[str, Counter] = {}
+        self.lengths: Dict[str, int] = {}
+        self.postings: Dict[str, set] = defaultdict(set)
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _add(self, id_: str, document: str, metadata: Dict[str, Any]):
+        self._delete(id_)
+        terms = Counter(tokenize(document))
+        self.documents[id_] = (document, metadata)
+        self.term_counts[id_] = terms
+        self.lengths[id_] = sum(terms.values())
+        self.total_length += self.lengths[id_]
+        for term in terms:
+            self.postings[term].add(id_)
+
+    def _delete(self, id_: str):
+        terms = self.term_counts.pop(id_, None)
+        if terms is None:
+            return
+        del self.documents[id_]
+        self.total_length -= self.lengths.pop(id_)
+        for term in terms:
+            self.postings[term].discard(id_)
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def add(self, ids: List[str], documents: List[str], metadatas: Optional[List[Dict[str, Any]]] = None):
+        """
+        Indexes chunks, replacing the ones with the same ids.
+        """
+        metadatas = metadatas if metadatas else [{}] * len(ids)
+        with self.lock:
+            for id_, document, metadata in zip(ids, documents, metadatas):
+                self._add(id_, document or "", metadata or {})
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            for id_ in ids:
+                self._delete(id_)
+
+    def build(self, ids: List[str], documents: List[str], metadatas: Optional[List[Dict[str, Any]]] = None):
+        """
+        Replaces the whole index with the given chunks.
+        """
+        index = LexicalIndexController(self.k1, self.b)
+        index.add(ids, documents, metadatas)
+        with self.lock:
+            self.documents, self.term_counts, self.lengths = index.documents, index.term_counts, index.lengths
+            self.postings, self.total_length = index.postings, index.total_length
+            self.built_at = time.monotonic()
+
+    def search(self, query: str, n_results: int = 10) -> List[Tuple[str, float]]:
+        """
+        :return: Up to `n_results` (id, BM25 score) pairs, best first.
+        """
+        terms = set(tokenize(query))
+        scores: Dict[str, float] = defaultdict(float)
+        with self.lock:
+            n_documents = len(self.documents)
+            if not n_documents:
+                return []
+            average_length = self.total_length / n_documents
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_documents - len(posting) + 0.5) / (len(posting) + 0.5))
+                for id_ in posting:
+                    tf = self.term_counts[id_][term]
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[id_] / average_length)
+                    scores[id_] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:n_results]
+
+    def get(self, id_: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        :return: The (document, metadata) of an indexed chunk.
+        """
+        with self.lock:
+            return self.documents.get(id_)
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from google import genai
+
+from gemini_prompt import MODEL_ID
+
+PROMPT_CACHE_DISPLAY_NAME = "chatbot-system-prompt"
+PROMPT_CACHE_REFRESH_MARGIN = 300  # in second, refresh a cache this long before it expires
+PROMPT_CACHE_RETRY_AFTER = 600  # in second, after a failed create
+
+
+class _CacheHandle:
+    __slots__ = ("name", "expires", "instruction")
+
+    def __init__(self, name: str, expires: float, instruction: str):
+        self.name = name
+        self.expires = expires
+        self.instruction = instruction  # digest of the cached system instruction
+
+
+class PromptCacheController:
+    """
+    Keeps the system instruction (and tool declarations) in a server-side
+    Gemini context cache, so a turn sends a `cached_content` handle instead of
+    the full prompt and its tokens are billed at the cached rate.
+
+    - One cache per (model, system instruction, tools), created on first use;
+      a changed instruction from `/config` gets a new cache, the caches of
+      the old one are deleted.
+    - The TTL is extended shortly before it runs out.
+    - If a cache cannot be created (e.g. the prompt is under the model's
+      minimum cache size), turns go uncached and creation is retried later.
+    - `record_usage` adds up prompt and cached tokens of every turn.
+    """
+    def __init__(
+        self,
+        client: genai.Client | Any,
+        ttl: float,
+        model: str = MODEL_ID,
+        refresh_margin: float = PROMPT_CACHE_REFRESH_MARGIN,
+        retry_after: float = PROMPT_CACHE_RETRY_AFTER,
+    ):
+        """
+        :param ttl: Lifetime of a cache in seconds, 0 disables caching.
+        """
+        self.client = client
+        self.ttl = ttl
+        self.model = model
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.handles: Dict[str, _CacheHandle] = {}
+        self.failed_until: Dict[str, float] = {}
+        self.pending: Dict[str, threading.Event] = {}  # keys being created or refreshed
+        self.generation = 0  # bumped by `invalidate`
+        self.lock = threading.Lock()
+
+        # metrics
+        self.created = 0
+        self.refreshed = 0
+        self.errors = 0
+        self.turns = 0
+        self.cached_turns = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _key(self, system_instruction: str, tools: Optional[List[Any]]) -> str:
+        payload = json.dumps([self.model, system_instruction, tools], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf8")).hexdigest()
+
+    @staticmethod
+    def _digest(system_instruction: str) -> str:
+        return hashlib.sha256(system_instruction.encode("utf8")).hexdigest()
+
+    def _delete(self, name: str):
+        try:
+            self.client.caches.delete(name=name)
+        except Exception as e:
+            print(f"[PromptCache] delete {name} failed: {e}")
+
+    def _create(self, key: str, system_instruction: str, tools: Optional[List[Any]]) -> Optional[_CacheHandle]:
+        config = {
+            "system_instruction": system_instruction,
+            "ttl": f"{int(self.ttl)}s",
+            "display_name": PROMPT_CACHE_DISPLAY_NAME,
+        }
+        if tools:
+            config["tools"] = tools
+        try:
+            cache = self.client.caches.create(model=self.model, config=config)
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+                self.failed_until[key] = time.monotonic() + self.retry_after
+            print(f"[PromptCache] create failed, sending the prompt uncached: {e}")
+            return None
+        with self.lock:
+            self.created += 1
+        print(f"[PromptCache] created {cache.name}")
+        return _CacheHandle(cache.name, time.monotonic() + self.ttl, self._digest(system_instruction))
+
+    def _refresh(self, handle: _CacheHandle) -> bool:
+        try:
+            self.client.caches.update(name=handle.name, config={"ttl": f"{int(self.ttl)}s"})
+        except Exception as e:
+            print(f"[PromptCache] refresh of {handle.name} failed: {e}")
+            return False
+        with self.lock:
+            handle.expires = time.monotonic() + self.ttl
+            self.refreshed += 1
+        return True
+
+    def get_cache_name(self, system_instruction: str, tools: Optional[List[Any]] = None) -> Optional[str]:
+        """
+        The state is checked under the lock, the Gemini calls are made outside
+        of it by one thread per key; the others keep using a still live cache,
+        or wait for the outcome.
+
+        :return: The name of a live cache holding the instruction and tools,
+            None if it could not be created.
+        """
+        key = self._key(system_instruction, tools)
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                handle = self.handles.get(key)
+                if handle is not None and now < handle.expires - self.refresh_margin:
+                    return handle.name
+                if handle is None and now < self.failed_until.get(key, 0):
+                    return None
+                pending = self.pending.get(key)
+                if pending is None:
+                    pending = self.pending[key] = threading.Event()
+                    generation = self.generation
+                    break
+                if handle is not None and now < handle.expires:
+                    return handle.name  # being refreshed
+            pending.wait()
+
+        try:
+            if handle is not None and now < handle.expires and self._refresh(handle):
+                return handle.name
+
+            handle = self._create(key, system_instruction, tools)
+            if handle is None:
+                return None
+            with self.lock:
+                invalidated = generation != self.generation
+                if invalidated:
+                    # the cache may hold an instruction replaced meanwhile
+                    stale = [(key, handle)]
+                else:
+                    # caches of an older instruction are not needed anymore
+                    stale = [(k, h) for k, h in self.handles.items() if k != key and h.instruction != handle.instruction]
+                    for stale_key, _ in stale:
+                        del self.handles[stale_key]
+                    replaced = self.handles.get(key)
+                    if replaced is not None:
+                        # expired or failed to refresh, may still be stored until its TTL
+                        stale.append((key, replaced))
+                    self.handles[key] = handle
+                    self.failed_until.pop(key, None)
+            for _, old_handle in stale:
+                self._delete(old_handle.name)
+            return None if invalidated else handle.name
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.set()
+
+    def apply(self, config: Dict[str, Any], tools: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """
+        Returns a copy of a `GenerateContentConfig` dict where the system
+        instruction and tools are replaced by a `cached_content` handle, or
+        kept inline if caching is off or failed.
+        """
+        config = dict(config)
+        if tools:
+            config["tools"] = tools
+        system_instruction = config.get("system_instruction")
+        if not self.enabled or not system_instruction:
+            return config
+
+        name = self.get_cache_name(system_instruction, tools)
+        if name:
+            config.pop("system_instruction", None)
+            config.pop("tools", None)
+            config["cached_content"] = name
+        return config
+
+    def record_usage(self, response: Any):
+        """
+        Accounts the prompt and cached input tokens of a Gemini response.
+        """
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_token_count or 0
+        cached_tokens = usage.cached_content_token_count or 0
+        with self.lock:
+            self.turns += 1
+            self.cached_turns += int(cached_tokens > 0)
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+        print(f"[PromptCache] turn input tokens: {prompt_tokens}, cached: {cached_tokens}")
+
+    def invalidate(self):
+        """
+        Deletes every cache, the next turn creates a new one.
+        """
+        with self.lock:
+            handles = list(self.handles.values())
+            self.handles = {}
+            self.failed_until.clear()
+            self.generation += 1
+        for handle in handles:
+            self._delete(handle.name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "caches": [handle.name for handle in self.handles.values()],
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "errors": self.errors,
+                "turns": self.turns,
+                "cached_turns": self.cached_turns,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "avg_cached_tokens_per_turn": self.cached_tokens / (self.turns or 1),
+                "cached_token_ratio": self.cached_tokens / (self.prompt_tokens or 1),
+            }
@@ -0,0 +1,217 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from controller.EmbeddingCacheController import normalize_query
+from controller.StateBackend import StateBackend
+
+RESPONSE_CACHE_SIZE = 1000
+MAX_FAQ_LENGTH = 200  # in characters
+FOLLOW_UP_WINDOW = 1800  # seconds after a turn in which a message may be a follow-up of it
+GENERATION_COUNTER = "response_cache_generation"
+
+# words that make a short message a standalone question
+_QUESTION_MARKERS = re.compile(
+    r"\?|\b(gì|sao|nào|bao nhiêu|bao lâu|khi nào|ở đâu|như thế nào|thế nào|có phải|"
+    r"what|when|where|how|why|which|who)\b",
+    re.IGNORECASE,
+)
+# phone numbers, emails, ids: personal turns are never shared between users
+_PERSONAL_DATA = re.compile(r"\d{6,}|\S+@\S+")
+# words referring to an earlier turn ("còn phí thì sao?", "cái đó bao nhiêu?"),
+# the answer depends on it
+_REFERENCES = re.compile(
+    r"^\s*(còn|thế còn|vậy còn|what about|and)\b|"
+    r"\b(đó|này|kia|ấy|nó|it|that|this|these|those|they|them)\b",
+    re.IGNORECASE,
+)
+
+
+class _CachedAnswer:
+    __slots__ = ("question", "answer", "created")
+
+    def __init__(self, question: str, answer: Any, created: float):
+        self.question = question
+        self.answer = answer
+        self.created = created
+
+
+class ResponseCacheController:
+    """
+    Semantic cache of answers to FAQ-style questions: a message whose
+    embedding is close enough (cosine similarity >= `threshold`) to a question
+    answered less than `ttl` seconds ago gets that answer without a Gemini call.
+
+    Only standalone, short questions without personal data are cached, see
+    `is_cacheable`. Every answer is dropped by `invalidate`, to be called when
+    the knowledge base or the system instruction change; answers computed
+    before an invalidation are not stored (see `generation`).
+
+    Answers are cached per worker process. The generation is kept in the
+    state backend when it is shared, so an invalidation in one worker drops
+    the answers of every worker at their next lookup.
+    """
+    def __init__(
+        self,
+        embed: Callable[[str], List[float]],
+        threshold: float,
+        ttl: float,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        follow_up_window: float = FOLLOW_UP_WINDOW,
+        state_backend: Optional[StateBackend] = None,
+    ):
+        """
+        :param embed: Returns the embedding of a text.
+        :param threshold: Minimum cosine similarity of a hit.
+        :param ttl: Seconds an answer is served, 0 disables the cache.
+        :param follow_up_window: Seconds after a user's last turn during which
+            their messages are not looked up, they may refer to that turn.
+        :param state_backend: Holds the generation shared by the workers.
+        """
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.follow_up_window = follow_up_window
+        self.state_backend = state_backend if state_backend is not None and state_backend.is_shared else None
+        self.entries: OrderedDict[str, _CachedAnswer] = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+        # normalized question vectors, rebuilt lazily after a change
+        self._keys: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._vectors: Dict[str, np.ndarray] = {}
+
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def is_cacheable(
+        self,
+        message: str,
+        reply_context: str | None = None,
+        last_turn_at: float | None = None,
+    ) -> bool:
+        """
+        Whether a turn is a stateless FAQ question: no reply context, no turn
+        of the user shortly before, short, phrased as a question, no personal
+        data and no reference to an earlier turn.
+
+        :param last_turn_at: Epoch time of the user's last turn, if any.
+        """
+        cacheable = (
+            self.enabled
+            and not reply_context
+            and (last_turn_at is None or time.time() - last_turn_at >= self.follow_up_window)
+            and 0 < len(message) <= MAX_FAQ_LENGTH
+            and bool(_QUESTION_MARKERS.search(message))
+            and not _PERSONAL_DATA.search(message)
+            and not _REFERENCES.search(message)
+        )
+        if not cacheable:
+            with self.lock:
+                self.skipped += 1
+        return cacheable
+
+    def _clear(self):
+        self.entries.clear()
+        self._vectors.clear()
+        self._matrix = None
+
+    def _sync_generation(self) -> int:
+        # an invalidation by another worker drops the answers of this one too
+        generation = self.state_backend.get_counter(GENERATION_COUNTER) if self.state_backend else None
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                self._clear()
+                self.generation = generation
+            return self.generation
+
+    def _vector(self, message: str) -> np.ndarray:
+        vector = np.asarray(self.embed(message), dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def _expire(self, now: float):
+        # oldest answers are first
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if now - entry.created < self.ttl:
+                break
+            self.entries.popitem(last=False)
+            self._vectors.pop(key, None)
+            self._matrix = None
+
+    def lookup(self, message: str) -> Tuple[Optional[Any], int]:
+        """
+        :return: `(answer, generation)`, answer being None on a miss. Pass the
+            generation back to `store` with the freshly computed answer.
+        """
+        generation = self._sync_generation()
+        vector = self._vector(message)
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if self.entries and self._matrix is None:
+                self._keys = list(self.entries.keys())
+                self._matrix = np.vstack([self._vectors[key] for key in self._keys])
+            if self._matrix is not None:
+                scores = self._matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry = self.entries[self._keys[best]]
+                    self.hits += 1
+                    print(f"[ResponseCache] hit ({scores[best]:.3f}) '{message[:50]}' ~ '{entry.question[:50]}'")
+                    return entry.answer, generation
+            self.misses += 1
+            return None, generation
+
+    def store(self, message: str, answer: Any, generation: int):
+        """
+        Caches the answer to a question, unless the cache was invalidated
+        since the matching `lookup`.
+        """
+        key = normalize_query(message)
+        vector = self._vector(message)
+        self._sync_generation()
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = _CachedAnswer(message, answer, time.time())
+            self._vectors[key] = vector
+            while len(self.entries) > self.max_entries:
+                old_key, _ = self.entries.popitem(last=False)
+                self._vectors.pop(old_key, None)
+            self._matrix = None
+            self.stores += 1
+
+    def invalidate(self, reason: str = ""):
+        generation = self.state_backend.increment_counter(GENERATION_COUNTER) if self.state_backend else None
+        with self.lock:
+            self._clear()
+            self.generation = generation if generation is not None else self.generation + 1
+            self.invalidations += 1
+        print(f"[ResponseCache] invalidated: {reason}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / ((self.hits + self.misses) or 1),
+            }
@@ -1,118 +1,260 @@
+import glob
+import json
+import os
+import sys
+import threading
+import time
 import uuid
-from collections import OrderedDict
-from datetime import datetime, timedelta
-from typing import Any, List, Optional, TypedDict
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, TypedDict
 
 from google import genai
 from google.genai import types as genai_types
 from google.genai.chats import Chat
 
+from controller.StateBackend import InMemoryStateBackend, StateBackend
 from gemini_prompt import MODEL_ID
 
-SESSION_CAPACITY = 100
+SESSION_CAPACITY = 20000
 SESSION_TIME_THRESHOLD = 86400  # in second
 SUSPENSION_TIME_THRESHOLD = 86400  # in second / change to 86400 for production
+MAX_SESSION_TURNS = 40  # (role, text) turns kept per session
+
+
+class SessionRecord:
+    """
+    Compact, serializable chat session: the user id, the last use time (epoch
+    seconds) and a bounded list of `(role, text)` turns. A Gemini `Chat` is
+    only built from it when a message is answered.
+    """
+    __slots__ = ("user_id", "last_date", "turns")
+
+    def __init__(
+        self,
+        user_id,
+        last_date: float | None = None,
+        turns: List[Tuple[str, str]] | None = None,
+        max_turns: int = MAX_SESSION_TURNS,
+    ):
+        self.user_id = user_id
+        self.last_date = last_date if last_date is not None else time.time()
+        self.turns: Deque[Tuple[str, str]] = deque(maxlen=max_turns)
+        for role, text in turns or ():
+            self.add_turn(role, text)
+
+    def add_turn(self, role: str, text: str):
+        self.turns.append((sys.intern(role), text))
+
+    def set_history(self, history: List[genai_types.Content]):
+        """
+        Replaces the turns with the text parts of a Gemini chat history, function
+        calls and other non-text parts are dropped.
+        """
+        self.turns.clear()
+        for content in history or ():
+            text = "".join(part.text for part in (content.parts or []) if part.text)
+            if text:
+                self.add_turn(content.role, text)
+
+    def to_history(
+        self, fit: Optional[Callable[[List[Tuple[str, str]]], List[Tuple[str, str]]]] = None
+    ) -> List[genai_types.Content]:
+        """
+        :param fit: Trims the turns before they are sent, e.g. to a token budget.
+        """
+        turns = list(self.turns)
+        if fit:
+            turns = fit(turns)
+        # history must start with a `user` turn, older turns may have been dropped
+        while turns and turns[0][0] != "user":
+            turns.pop(0)
+        return [
+            genai_types.Content(role=role, parts=[genai_types.Part(text=text)])
+            for role, text in turns
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "last_date": self.last_date,
+            "history": [list(turn) for turn in self.turns],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], max_turns: int = MAX_SESSION_TURNS) -> "SessionRecord":
+        return cls(data["user_id"], data["last_date"], data.get("history"), max_turns)
 
-class SuspenInfo(TypedDict):
-    suspended_time: datetime | None
 
 class ChatEntryDict(TypedDict):
     chat: Any | Chat
     last_date: datetime
+    record: SessionRecord
 
 
 class SessionController:
+    """
+    LRU + TTL store of chat sessions.
+
+    `sessions` holds compact `SessionRecord`s in least- to most-recently used
+    order: a session is moved to the end whenever it is used, and since
+    `last_date` only ever moves to "now" the front of the dict is always the
+    oldest session. Capacity and idle-time eviction therefore only ever look
+    at the front, O(1) amortized per request.
+
+    Suspensions live in the `StateBackend`, and so do session records when the
+    backend is shared, so every worker sees the same owner takeovers and can
+    continue a conversation another worker started.
+    """
     def __init__(
         self,
         client: genai.Client | Any,
         session_capacity: int = SESSION_CAPACITY,
         session_time_threshold: int = SESSION_TIME_THRESHOLD,
         default_gemini_config: Optional[genai_types.GenerateContentConfigOrDict] = None,
+        on_evict: Optional[Callable[[Any, SessionRecord, str], None]] = None,
+        expiry_interval: float = 0,
+        state_backend: StateBackend | None = None,
+        max_turns: int = MAX_SESSION_TURNS,
+        fit_history: Optional[Callable[[List[Tuple[str, str]]], List[Tuple[str, str]]]] = None,
     ):
         """
         Initializes a new SessionController instance.
+
+        :param on_evict: Optional callback `(user_id, record, reason)` called when a
+            session is evicted by capacity or idle time.
+        :param expiry_interval: If > 0, idle sessions are also expired by a background
+            thread every `expiry_interval` seconds, not only when a session is used.
+        :param state_backend: Where suspensions and session records are shared,
+            process-local by default.
+        :param max_turns: Number of `(role, text)` turns kept per session.
+        :param fit_history: Trims the turns of a session before a chat is built
+            from them (`ContextBudgetController.fit_history`). The answered chat
+            is saved back trimmed.
         """
-        self.sessions: OrderedDict[type, ChatEntryDict] = OrderedDict()
-        self.suspended_sessions: OrderedDict[type, SuspenInfo] = OrderedDict()
+        self.sessions: OrderedDict[type, SessionRecord] = OrderedDict()
+        self.state_backend = state_backend if state_backend else InMemoryStateBackend()
         self.client = client
         self.session_capacity = session_capacity
         self.session_time_threshold = session_time_threshold
         self.default_gemini_config = default_gemini_config
+        self.on_evict = on_evict
+        self.max_turns = max_turns
+        self.fit_history = fit_history
+        self.lock = threading.RLock()
 
         self.debug_id = uuid.uuid4()
         print("[SessionController] __init__ called, debug_id =", self.debug_id, "time =", datetime.now())
 
+        self._expiry_stop = threading.Event()
+        if expiry_interval > 0:
+            threading.Thread(
+                target=self._expiry_loop, args=(expiry_interval,), name="session-expiry", daemon=True
+            ).start()
+
     def hard_reset(self):
         print("[SessionController] hard_reset called, debug_id =", self.debug_id, "time =", datetime.now())
-        self.sessions = OrderedDict()
-        self.suspended_sessions = OrderedDict()
-
-    def _sort_chat_sessions_by_date(self):
-        # print("[Session Controller] sort chat sessions by date")
-        # sort newest to oldest
-        self.sessions = OrderedDict(
-            sorted(
-                self.sessions.items(),
-                key=lambda item: item[1]["last_date"],
-                reverse=True,  # True: newest to oldest
-            )
-        )
-
-    def _sort_and_clean_chat_sessions(self, current_time: datetime | None = None):
-        # print("[Session Controller] ssort_and_clean_chat_sessions")
-        current_time = current_time if current_time else datetime.now()
-
-        self._sort_chat_sessions_by_date()
-
-        deleted_sessions = {}
-        # delete by capacity
-        if len(self.sessions) > self.session_capacity:
-            n_session = len(self.sessions) - self.session_capacity
-            for _ in range(n_session):
-                user_id, _ = self.sessions.popitem(last=True)
-                deleted_sessions[user_id] = "Deleted by capacity"
-
-        # delete by time
-        # print("[Session Controller] get delete", self.sessions)
-        id_to_delete = set()
-        for sender_id in reversed(self.sessions):
-            chat_session_date = self.sessions[sender_id]["last_date"]
-            if current_time - chat_session_date >= timedelta(
-                seconds=self.session_time_threshold
-            ):
-                id_to_delete.add(sender_id)
-                deleted_sessions[sender_id] = "Deleted by date"
-            else:
-                # dict is ordered and sorted, break when there is no more session
-                # past the time threshold.
-                break
-        # print("[Session Controller] delete chat sessions by time", id_to_delete)
-        for sender_id in id_to_delete:
-            self.delete_session(sender_id)
+        with self.lock:
+            self.sessions = OrderedDict()
+        self.state_backend.clear_sessions()
+
+    def _expiry_loop(self, interval: float):
+        while not self._expiry_stop.wait(interval):
+            self._evict_sessions()
+
+    def _evict_sessions(self, current_time: float | None = None) -> int:
+        """
+        Evicts least recently used sessions past the capacity, then sessions idle
+        for longer than the time threshold.
+        :param current_time: Epoch seconds, defaults to now.
+        :return: The number of evicted sessions.
+        """
+        current_time = current_time if current_time else time.time()
+        evicted = []
+        with self.lock:
+            # delete by capacity
+            while len(self.sessions) > self.session_capacity:
+                user_id, record = self.sessions.popitem(last=False)
+                evicted.append((user_id, record, "capacity"))
+
+            # delete by time, the oldest session is always first
+            while self.sessions:
+                user_id, record = next(iter(self.sessions.items()))
+                if current_time - record.last_date < self.session_time_threshold:
+                    break
+                self.sessions.popitem(last=False)
+                evicted.append((user_id, record, "expired"))
 
-        print(f"[Session Controller] Sorted & Deleted: {deleted_sessions}")
+        if self.state_backend.is_shared:
+            for user_id, _, reason in evicted:
+                if reason == "expired":
+                    # unless another worker used it since
+                    self.state_backend.delete_session_record(
+                        user_id, older_than=current_time - self.session_time_threshold
+                    )
+
+        if evicted:
+            print(f"[Session Controller] Evicted {len(evicted)} sessions")
+        if self.on_evict:
+            for user_id, record, reason in evicted:
+                try:
+                    self.on_evict(user_id, record, reason)
+                except Exception as e:
+                    print(f"[Session Controller] on_evict error for {user_id}: {e}")
+        return len(evicted)
+
+    def _materialize(
+        self,
+        record: SessionRecord,
+        config: Optional[genai_types.GenerateContentConfigOrDict] = None,
+        use_async: bool = False,
+    ) -> ChatEntryDict:
+        """
+        Builds a Gemini `Chat` from the record's turns, an `AsyncChat` if `use_async`.
+        """
+        config = config if config else self.default_gemini_config
+        chats = self.client.aio.chats if use_async else self.client.chats
+        return {
+            "chat": chats.create(
+                model=MODEL_ID,
+                config=config,
+                history=record.to_history(self.fit_history) or None,
+            ),
+            "last_date": datetime.fromtimestamp(record.last_date),
+            "record": record,
+        }
+
+    def _store_record(self, record: SessionRecord):
+        with self.lock:
+            self.sessions[record.user_id] = record
+            self.sessions.move_to_end(record.user_id)
+        self._evict_sessions()
+
+    def _get_shared_record(self, user_id) -> SessionRecord | None:
+        """
+        Returns the user's record from a shared state backend, if it has not expired.
+        """
+        if not self.state_backend.is_shared:
+            return None
+        data = self.state_backend.get_session_record(user_id)
+        if not data or time.time() - data["last_date"] >= self.session_time_threshold:
+            return None
+        return SessionRecord.from_dict(data, self.max_turns)
 
     def create_session(
         self,
         user_id,
         history: List[genai_types.Content] = None,
         config: Optional[genai_types.GenerateContentConfigOrDict] = None,
-        tools: List[genai_types.Tool] = None,
+        use_async: bool = False,
     ):
         if history:
             print(f"[Session Controller] Adding chat history for {user_id}")
 
-        config = config if config else self.default_gemini_config
-        self.sessions[user_id] = {
-            "chat": self.client.chats.create(
-                model=MODEL_ID,
-                config=config,
-                history=history,
-                tools=tools,
-            ),
-            "last_date": datetime.now(),
-        }
-        return self.sessions[user_id]
+        record = SessionRecord(user_id, max_turns=self.max_turns)
+        record.set_history(history)
+        self._store_record(record)
+        return self._materialize(record, config, use_async)
 
     def is_chat_suspended(self, id):
         """
@@ -120,61 +262,127 @@ class SessionController:
         :param id: The ID of the user.
         :return: True if the chat session is suspended, False otherwise.
         """
-        is_suspended = id in self.suspended_sessions
+        suspended_until = self.state_backend.get_suspension(id)
         print(f"[Session Controller] Attempting Suspend user {id} - {type(id)}")
-        print(f"[Session Controller] Chat sessions: {list(self.sessions.keys())}")
-        print(f"[Session Controller] Suspended users: {list(self.suspended_sessions.keys())}")
+        print(f"[Session Controller] Chat sessions: {len(self.sessions)}, suspended users: {self.state_backend.count_suspensions()}")
 
-        if (is_suspended):
-            suspended_time = self.suspended_sessions[id]["suspended_time"]
-            print("[Session Controller] Chat session suspended for user:", id, "until", suspended_time, "current time", datetime.now())
-            if suspended_time > datetime.now():
+        if (suspended_until is not None):
+            print("[Session Controller] Chat session suspended for user:", id, "until", datetime.fromtimestamp(suspended_until), "current time", datetime.now())
+            if suspended_until > time.time():
                 return True
             else:
                 # unsuspend
-                self.suspended_sessions.pop(id)
+                self.state_backend.delete_suspension(id)
         else:
             print(f"[Session Controller] {id} not suspended - {type(id)}")
 
         return False
 
+    def save_session(self, user_id, chat: Chat | Any):
+        """
+        Stores the text turns of an answered chat back into the user's record,
+        and into the state backend when it is shared.
+        :param user_id: The ID of the user.
+        :param chat: The chat returned by `get_session`.
+        :return: None
+        """
+        with self.lock:
+            record = self.sessions.get(user_id)
+        if record is None:
+            return
+
+        record.set_history(chat.get_history())
+        record.last_date = time.time()
+        if self.state_backend.is_shared:
+            self.state_backend.put_session_record(user_id, record.to_dict())
+
+    def add_turns(
+        self,
+        user_id,
+        turns: List[Tuple[str, str]],
+        history: List[genai_types.Content] = None,
+    ):
+        """
+        Appends turns answered without a Gemini chat (e.g. from the response
+        cache) to the user's record, creating it from `history` if needed.
+        :param turns: `(role, text)` pairs, oldest first.
+        :return: None
+        """
+        with self.lock:
+            record = self.sessions.get(user_id)
+        shared_record = self._get_shared_record(user_id)
+        if shared_record is not None and (record is None or shared_record.last_date > record.last_date):
+            record = shared_record
+        if record is None:
+            record = SessionRecord(user_id, max_turns=self.max_turns)
+            record.set_history(history)
+
+        for role, text in turns:
+            record.add_turn(role, text)
+        record.last_date = time.time()
+        self._store_record(record)
+        if self.state_backend.is_shared:
+            self.state_backend.put_session_record(user_id, record.to_dict())
+
+    def get_last_turn_time(self, user_id) -> float | None:
+        """
+        :return: Epoch time of the user's last turn, in this worker or in a
+            shared state backend, None if the user has no turn in a live session.
+        """
+        with self.lock:
+            record = self.sessions.get(user_id)
+        shared_record = self._get_shared_record(user_id)
+        if shared_record is not None and (record is None or shared_record.last_date > record.last_date):
+            record = shared_record
+        return record.last_date if record is not None and record.turns else None
+
     def is_session_exist(self, user_id):
         """
-        Checks if a session exists for a user.
+        Checks if a session exists for a user, in this worker or in a shared state backend.
         :param user_id: The ID of the user.
         :return: True if the session exists, False otherwise.
         """
-        return user_id in self.sessions
+        return user_id in self.sessions or self._get_shared_record(user_id) is not None
 
     def get_session(
         self,
         user_id,
         history: List[genai_types.Content] = None,
         config: Optional[genai_types.GenerateContentConfigOrDict] = None,
-        tools: List[genai_types.Tool] = None
+        use_async: bool = False,
     ):
         """
         Retrieves the chat session for a user. If the user doesn't have a chat session, create a new one.
         :param user_id: The ID of the user.
         :param history: The chat history
-        :return: The session data or None if no session exists.
+        :param use_async: Build the chat on `client.aio`, for the ASGI entry point.
+        :return: The session data, with a `Chat` built from the session record.
         """
-        if self.is_session_exist(user_id):
-            print(f"[Session Controller] get session for {user_id}")
-            session = self.sessions.get(user_id)
-        else:
-            print(f"[Session Controller] create new session for {user_id}")
-            session = self.create_session(user_id, history, config, tools)
+        current_time = time.time()
+        with self.lock:
+            record = self.sessions.get(user_id)
 
-        # update chat session time to now
-        current_time = datetime.now()
-        session["last_date"] = current_time
+        shared_record = self._get_shared_record(user_id)
+        if shared_record is not None and (record is None or shared_record.last_date > record.last_date):
+            # continued by another worker
+            print(f"[Session Controller] load shared session for {user_id}")
+            record = shared_record
+            self._store_record(record)
 
-        # delete chat session if past certain threshold, user who triggers this is
-        # one lucky bastard.
-        self._sort_and_clean_chat_sessions(current_time)
+        if record is None:
+            print(f"[Session Controller] create new session for {user_id}")
+            return self.create_session(user_id, history, config, use_async)
 
-        return session
+        print(f"[Session Controller] get session for {user_id}")
+        with self.lock:
+            # update chat session time to now, mark as most recently used
+            record.last_date = current_time
+            if user_id in self.sessions:
+                self.sessions.move_to_end(user_id)
+        # drop expired sessions, only the oldest ones are looked at
+        self._evict_sessions(current_time)
+
+        return self._materialize(record, config, use_async)
 
     def delete_session(self, user_id):
         """
@@ -182,8 +390,88 @@ class SessionController:
         :param user_id: The ID of the user.
         :return: None
         """
-        if user_id in self.sessions:
-            self.sessions.pop(user_id)
+        with self.lock:
+            self.sessions.pop(user_id, None)
+        if self.state_backend.is_shared:
+            self.state_backend.delete_session_record(user_id)
+
+    def snapshot(self, path: str) -> int:
+        """
+        Writes every live session record of this worker as JSON lines to its own
+        file, `path` suffixed with the pid, so workers exiting together do not
+        overwrite each other. Files of workers older than the session lifetime
+        only hold expired records and are removed.
+        :return: The number of records written.
+        """
+        expire_before = time.time() - self.session_time_threshold
+        with self.lock:
+            records = [record.to_dict() for record in self.sessions.values() if record.last_date > expire_before]
+
+        worker_path = f"{path}.{os.getpid()}"
+        tmp_path = f"{worker_path}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as fhandle:
+            for data in sorted(records, key=lambda data: data["last_date"]):
+                fhandle.write(json.dumps(data, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, worker_path)
+
+        for snapshot_path in self._snapshot_paths(path):
+            try:
+                if snapshot_path != worker_path and os.path.getmtime(snapshot_path) < expire_before:
+                    os.remove(snapshot_path)
+            except FileNotFoundError:
+                pass  # removed by another worker
+        print(f"[Session Controller] Snapshot {len(records)} sessions to {worker_path}")
+        return len(records)
+
+    def load_snapshot(self, path: str) -> int:
+        """
+        Restores the non-expired session records written by `snapshot`, merged
+        over the files of all workers, the newest record of a user wins.
+        :return: The number of records loaded.
+        """
+        records: Dict[str, Dict[str, Any]] = {}
+        for snapshot_path in self._snapshot_paths(path):
+            for data in self._read_snapshot(snapshot_path):
+                if data["user_id"] not in records or records[data["user_id"]]["last_date"] < data["last_date"]:
+                    records[data["user_id"]] = data
+
+        expire_before = time.time() - self.session_time_threshold
+        count = 0
+        # oldest first, so the LRU order is preserved
+        for data in sorted(records.values(), key=lambda data: data["last_date"]):
+            if data["last_date"] > expire_before:
+                record = SessionRecord.from_dict(data, self.max_turns)
+                with self.lock:
+                    self.sessions[record.user_id] = record
+                    self.sessions.move_to_end(record.user_id)
+                count += 1
+        self._evict_sessions()
+        print(f"[Session Controller] Loaded {count} sessions from {path}")
+        return count
+
+    @staticmethod
+    def _snapshot_paths(path: str) -> List[str]:
+        """
+        :return: `path` itself if it exists and the per-worker files written by `snapshot`.
+        """
+        paths = [path] if os.path.exists(path) else []
+        paths += [
+            worker_path for worker_path in glob.glob(f"{glob.escape(path)}.*")
+            if worker_path[len(path) + 1:].isdigit()
+        ]
+        return paths
+
+    @staticmethod
+    def _read_snapshot(path: str) -> List[Dict[str, Any]]:
+        records = []
+        try:
+            with open(path, "r", encoding="utf8") as fhandle:
+                for line in fhandle:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except FileNotFoundError:
+            pass  # removed by another worker
+        return records
 
     def suspend_session(self, user_id):
         """
@@ -192,12 +480,10 @@ class SessionController:
         :return: None
         """
         print("[Sesssion Controller] Suspending session for user:", user_id)
-        self.suspended_sessions[user_id] = {
-            "suspended_time": datetime.now() + timedelta(seconds=SUSPENSION_TIME_THRESHOLD)
-        }
+        self.state_backend.set_suspension(user_id, time.time() + SUSPENSION_TIME_THRESHOLD)
 
     def resume_session(self, user_id):
-        if (user_id not in self.suspended_sessions):
+        if (self.state_backend.get_suspension(user_id) is None):
             print("[Session Controller] No suspended session for user:", user_id)
             return
-        self.suspended_sessions.pop(user_id)
+        self.state_backend.delete_suspension(user_id)
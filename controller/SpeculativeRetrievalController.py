@@ -0,0 +1,262 @@
+import asyncio
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from controller.EmbeddingCacheController import normalize_query
+
+SPECULATION_WORKERS = 4
+PRE_INJECT_MIN_KEYWORDS = 2  # distinct topic keywords of a question answered with pre-injected context
+
+# topics of the knowledge base, a message mentioning one is likely answered with retrieval;
+# "đức", "điểm" and "trường" alone are also names and everyday words ("anh Đức",
+# "địa điểm", "trường hợp"), only their topic phrases count
+_TOPIC_KEYWORDS = re.compile(
+    r"\b(testas|test as|đại học|trường đại học|chọn trường|ngành|học phí|lệ phí|phí thi|lịch thi|"
+    r"ngày thi|kỳ thi|đăng ký|hạn chót|deadline|điều kiện|yêu cầu|hồ sơ|cấu trúc|đề thi|module|"
+    r"điểm thi|điểm số|điểm chuẩn|bao nhiêu điểm|du học đức|du học|nước đức|visa|studienkolleg|"
+    r"uni-assist|university|exam|fee|score)\b",
+    re.IGNORECASE,
+)
+_QUESTION_MARKERS = re.compile(
+    r"\?|\b(gì|sao|nào|bao nhiêu|bao lâu|khi nào|ở đâu|như thế nào|thế nào|có phải|có cần|"
+    r"what|when|where|how|why|which)\b",
+    re.IGNORECASE,
+)
+
+SPECULATE = "speculate"
+PRE_INJECT = "pre_inject"
+
+
+class Speculation:
+    """
+    A retrieval started for the user's message before the model asked for it.
+    `result` stands in for the retrieval tool of the turn.
+    """
+    def __init__(self, controller: "SpeculativeRetrievalController", message: str):
+        self.controller = controller
+        self.message = message
+        self.future: Optional[Future] = None
+        self.task: Optional[asyncio.Task] = None
+        self.duration = 0.0  # of the retrieval, once done
+        self.settled = False  # used, or counted as wasted
+
+    def _matches(self, query: Optional[str]) -> bool:
+        return not query or normalize_query(query) == normalize_query(self.message)
+
+    def result(self, query: str = None) -> Any:
+        """
+        Documents of the speculative retrieval, waited for if still running,
+        when the model's query is the user's message. A rewritten query, or
+        a further call in the same turn, retrieves normally.
+        """
+        if self.settled or not self._matches(query):
+            self.finish()
+            return self.controller.retrieve(query or self.message)
+        self.settled = True
+        wait_start = time.monotonic()
+        result = self.future.result()
+        self.controller._record_use(self, time.monotonic() - wait_start)
+        return result
+
+    async def aresult(self, query: str = None) -> Any:
+        """
+        Async version of `result`.
+        """
+        if self.settled or not self._matches(query):
+            self.finish()
+            return await self.controller.aretrieve_query(query or self.message)
+        self.settled = True
+        wait_start = time.monotonic()
+        result = await self.task
+        self.controller._record_use(self, time.monotonic() - wait_start)
+        return result
+
+    def finish(self):
+        """
+        Ends the turn, a retrieval the model did not ask for is counted as wasted.
+        """
+        if self.settled:
+            return
+        self.settled = True
+        if self.future is not None:
+            self.future.cancel()
+        if self.task is not None:
+            self.task.cancel()
+        self.controller._record_waste()
+
+
+class SpeculativeRetrievalController:
+    """
+    Overlaps retrieval with the first model call of a turn:
+
+    - a message that looks factual (mentions a topic of the knowledge base)
+      starts its retrieval as the model call is sent; if the model calls the
+      retrieval tool, the documents are often already there (`SPECULATE`);
+    - a question mentioning several topics gets the documents injected into
+      the message and is answered in a single model call without the tool
+      hop (`PRE_INJECT`);
+    - anything else goes through the tool loop unchanged.
+
+    The retrieval runs on the user's message, it answers the tool call only
+    if the model's query is that message (once normalized).
+    `get_stats` reports how often a speculation was used or wasted.
+    """
+    def __init__(
+        self,
+        retrieve: Callable[[str], Any],
+        aretrieve: Optional[Callable[[str], Awaitable[Any]]] = None,
+        retrieve_many: Optional[Callable[[List[str]], Any]] = None,
+        aretrieve_many: Optional[Callable[[List[str]], Awaitable[Any]]] = None,
+        enabled: bool = True,
+        pre_inject: bool = True,
+        pre_inject_min_keywords: int = PRE_INJECT_MIN_KEYWORDS,
+        max_workers: int = SPECULATION_WORKERS,
+    ):
+        """
+        :param retrieve: Retrieval tool handler, called with the message as query.
+        :param aretrieve: Coroutine version, for `astart`.
+        :param retrieve_many: Retrieval of several queries at once, used for
+            a `PRE_INJECT` message made of several questions (merged messages).
+        :param aretrieve_many: Coroutine version of `retrieve_many`.
+        """
+        self.retrieve = retrieve
+        self.aretrieve = aretrieve
+        self.retrieve_many = retrieve_many
+        self.aretrieve_many = aretrieve_many
+        self.enabled = enabled
+        self.pre_inject = pre_inject
+        self.pre_inject_min_keywords = pre_inject_min_keywords
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculate")
+        self.lock = threading.Lock()
+
+        # metrics
+        self.speculated = 0
+        self.used = 0
+        self.wasted = 0
+        self.pre_injected = 0
+        self.skipped = 0
+        self.ready_on_use = 0  # the documents were there when the model asked
+        self.wait_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def classify(self, message: str) -> Optional[str]:
+        """
+        :return: `PRE_INJECT`, `SPECULATE`, or None for a message that does
+            not look factual.
+        """
+        if not self.enabled:
+            return None
+        keywords = {match.lower() for match in _TOPIC_KEYWORDS.findall(normalize_query(message))}
+        if not keywords:
+            with self.lock:
+                self.skipped += 1
+            return None
+        if (
+            self.pre_inject
+            and len(keywords) >= self.pre_inject_min_keywords
+            and _QUESTION_MARKERS.search(message)
+        ):
+            return PRE_INJECT
+        return SPECULATE
+
+    @staticmethod
+    def questions(message: str) -> List[str]:
+        """
+        The lines of a (merged) message that mention a topic of the knowledge base.
+        """
+        return [
+            line.strip() for line in message.splitlines()
+            if _TOPIC_KEYWORDS.search(normalize_query(line))
+        ]
+
+    def retrieve_now(self, message: str) -> Any:
+        """
+        Retrieval of a `PRE_INJECT` message, one query per question when the
+        message merges several.
+        """
+        with self.lock:
+            self.pre_injected += 1
+        questions = self.questions(message)
+        if self.retrieve_many is not None and len(questions) > 1:
+            return self.retrieve_many(questions)
+        return self.retrieve(message)
+
+    async def aretrieve_now(self, message: str) -> Any:
+        with self.lock:
+            self.pre_injected += 1
+        questions = self.questions(message)
+        if self.aretrieve_many is not None and len(questions) > 1:
+            return await self.aretrieve_many(questions)
+        if self.retrieve_many is not None and len(questions) > 1:
+            return await asyncio.to_thread(self.retrieve_many, questions)
+        return await self.aretrieve_query(message)
+
+    async def aretrieve_query(self, query: str) -> Any:
+        if self.aretrieve is None:
+            return await asyncio.to_thread(self.retrieve, query)
+        return await self.aretrieve(query)
+
+    def _timed_retrieve(self, speculation: Speculation) -> Any:
+        start = time.monotonic()
+        try:
+            return self.retrieve(speculation.message)
+        finally:
+            speculation.duration = time.monotonic() - start
+
+    async def _atimed_retrieve(self, speculation: Speculation) -> Any:
+        start = time.monotonic()
+        try:
+            return await self.aretrieve_query(speculation.message)
+        finally:
+            speculation.duration = time.monotonic() - start
+
+    def start(self, message: str) -> Speculation:
+        """
+        Starts the retrieval of a `SPECULATE` message in the background.
+        """
+        speculation = Speculation(self, message)
+        speculation.future = self.executor.submit(self._timed_retrieve, speculation)
+        with self.lock:
+            self.speculated += 1
+        return speculation
+
+    def astart(self, message: str) -> Speculation:
+        """
+        Async version of `start`, the retrieval runs as a task of the running loop.
+        """
+        speculation = Speculation(self, message)
+        speculation.task = asyncio.get_running_loop().create_task(self._atimed_retrieve(speculation))
+        with self.lock:
+            self.speculated += 1
+        return speculation
+
+    def _record_use(self, speculation: Speculation, waited: float):
+        # the part of the retrieval that ran during the model call
+        with self.lock:
+            self.used += 1
+            self.ready_on_use += int(waited < 0.001)
+            self.wait_seconds += waited
+            self.saved_seconds += max(0.0, speculation.duration - waited)
+        print(f"[Speculation] used, waited {waited * 1000:.0f}ms for the retrieval")
+
+    def _record_waste(self):
+        with self.lock:
+            self.wasted += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "speculated": self.speculated,
+                "used": self.used,
+                "wasted": self.wasted,
+                "pre_injected": self.pre_injected,
+                "skipped": self.skipped,
+                "use_rate": self.used / (self.speculated or 1),
+                "ready_on_use": self.ready_on_use,
+                "avg_wait_ms": self.wait_seconds / (self.used or 1) * 1000,
+                "avg_saved_ms": self.saved_seconds / (self.used or 1) * 1000,
+            }
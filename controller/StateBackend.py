@@ -0,0 +1,347 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+STATE_BACKEND_TYPE = {
+    "memory": "memory",
+    "sqlite": "sqlite",
+}
+
+
+class StateBackend(ABC):
+    """
+    Storage for the state that must be consistent across gunicorn workers:
+    chat session records, owner-takeover suspensions, debounce buffers and
+    counters (e.g. cache generations).
+
+    Times are wall-clock epoch seconds (`time.time()`) so they can be compared
+    between processes.
+    """
+    # whether other processes see the same state
+    is_shared = False
+
+    # === suspensions
+    @abstractmethod
+    def set_suspension(self, user_id: str, until: float):
+        ...
+
+    @abstractmethod
+    def get_suspension(self, user_id: str) -> Optional[float]:
+        ...
+
+    @abstractmethod
+    def delete_suspension(self, user_id: str):
+        ...
+
+    @abstractmethod
+    def count_suspensions(self) -> int:
+        ...
+
+    # === debounce buffers
+    @abstractmethod
+    def append_message(self, user_id: str, message: Dict[str, Any], deadline: float):
+        """
+        Appends a message to the user's buffer and pushes its deadline to `deadline`.
+        """
+
+    @abstractmethod
+    def pop_messages_if_due(self, user_id: str, now: float) -> Tuple[Optional[List[Dict[str, Any]]], Optional[float]]:
+        """
+        Atomically pops the user's buffer if its deadline has passed.
+        :return: `(messages, None)` if popped (empty list if there was no buffer),
+            `(None, deadline)` if the buffer is not due yet.
+        """
+
+    @abstractmethod
+    def count_buffers(self) -> Tuple[int, int]:
+        """
+        :return: Number of pending buffers and of buffered messages.
+        """
+
+    # === chat session records
+    @abstractmethod
+    def get_session_record(self, user_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put_session_record(self, user_id: str, record: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def delete_session_record(self, user_id: str, older_than: Optional[float] = None):
+        """
+        Deletes the user's session record, only if it was last updated before
+        `older_than` when given.
+        """
+
+    @abstractmethod
+    def clear_sessions(self):
+        """
+        Deletes every session record and suspension, debounce buffers are kept.
+        """
+
+    # === counters
+    @abstractmethod
+    def get_counter(self, name: str) -> int:
+        """
+        :return: The counter's value, 0 if it was never incremented.
+        """
+
+    @abstractmethod
+    def increment_counter(self, name: str) -> int:
+        """
+        :return: The counter's new value.
+        """
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    Process-local backend, only consistent with a single worker.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.suspensions: Dict[str, float] = {}
+        self.buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self.deadlines: Dict[str, float] = {}
+        self.session_records: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self.counters: Dict[str, int] = {}
+
+    def set_suspension(self, user_id, until):
+        with self.lock:
+            self.suspensions[user_id] = until
+
+    def get_suspension(self, user_id):
+        with self.lock:
+            return self.suspensions.get(user_id)
+
+    def delete_suspension(self, user_id):
+        with self.lock:
+            self.suspensions.pop(user_id, None)
+
+    def count_suspensions(self):
+        with self.lock:
+            return len(self.suspensions)
+
+    def append_message(self, user_id, message, deadline):
+        with self.lock:
+            self.buffers.setdefault(user_id, []).append(message)
+            self.deadlines[user_id] = max(deadline, self.deadlines.get(user_id, deadline))
+
+    def pop_messages_if_due(self, user_id, now):
+        with self.lock:
+            deadline = self.deadlines.get(user_id)
+            if deadline is not None and deadline > now:
+                return None, deadline
+            self.deadlines.pop(user_id, None)
+            return self.buffers.pop(user_id, []), None
+
+    def count_buffers(self):
+        with self.lock:
+            return len(self.buffers), sum(len(messages) for messages in self.buffers.values())
+
+    def get_session_record(self, user_id):
+        with self.lock:
+            entry = self.session_records.get(user_id)
+            return entry[1] if entry else None
+
+    def put_session_record(self, user_id, record):
+        with self.lock:
+            self.session_records[user_id] = (time.time(), record)
+
+    def delete_session_record(self, user_id, older_than=None):
+        with self.lock:
+            entry = self.session_records.get(user_id)
+            if entry and (older_than is None or entry[0] < older_than):
+                self.session_records.pop(user_id)
+
+    def clear_sessions(self):
+        with self.lock:
+            self.suspensions.clear()
+            self.session_records.clear()
+
+    def get_counter(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def increment_counter(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+            return self.counters[name]
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Backend shared by every worker (and process) on a host through one SQLite
+    database in WAL mode. Each thread uses its own connection.
+    """
+    is_shared = True
+
+    def __init__(self, path: str = "state.db", timeout: float = 10.0):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS suspensions (
+                    user_id TEXT PRIMARY KEY,
+                    until REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS debounce_messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    message TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS debounce_messages_user ON debounce_messages (user_id, seq);
+                CREATE TABLE IF NOT EXISTS debounce_deadlines (
+                    user_id TEXT PRIMARY KEY,
+                    deadline REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS session_records (
+                    user_id TEXT PRIMARY KEY,
+                    updated REAL NOT NULL,
+                    record TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        return self._connect().execute(sql, params)
+
+    def set_suspension(self, user_id, until):
+        self._execute(
+            "INSERT INTO suspensions (user_id, until) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET until = excluded.until",
+            (user_id, until),
+        )
+
+    def get_suspension(self, user_id):
+        row = self._execute("SELECT until FROM suspensions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete_suspension(self, user_id):
+        self._execute("DELETE FROM suspensions WHERE user_id = ?", (user_id,))
+
+    def count_suspensions(self):
+        return self._execute("SELECT COUNT(*) FROM suspensions").fetchone()[0]
+
+    def append_message(self, user_id, message, deadline):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO debounce_messages (user_id, message) VALUES (?, ?)",
+                (user_id, json.dumps(message, ensure_ascii=False)),
+            )
+            conn.execute(
+                "INSERT INTO debounce_deadlines (user_id, deadline) VALUES (?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET deadline = MAX(deadline, excluded.deadline)",
+                (user_id, deadline),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop_messages_if_due(self, user_id, now):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT deadline FROM debounce_deadlines WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row and row[0] > now:
+                conn.execute("COMMIT")
+                return None, row[0]
+            rows = conn.execute(
+                "SELECT message FROM debounce_messages WHERE user_id = ? ORDER BY seq", (user_id,)
+            ).fetchall()
+            conn.execute("DELETE FROM debounce_messages WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM debounce_deadlines WHERE user_id = ?", (user_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [json.loads(message) for (message,) in rows], None
+
+    def count_buffers(self):
+        row = self._execute(
+            "SELECT COUNT(DISTINCT user_id), COUNT(*) FROM debounce_messages"
+        ).fetchone()
+        return row[0], row[1]
+
+    def get_session_record(self, user_id):
+        row = self._execute("SELECT record FROM session_records WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_session_record(self, user_id, record):
+        self._execute(
+            "INSERT INTO session_records (user_id, updated, record) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET updated = excluded.updated, record = excluded.record",
+            (user_id, time.time(), json.dumps(record, ensure_ascii=False)),
+        )
+
+    def delete_session_record(self, user_id, older_than=None):
+        if older_than is None:
+            self._execute("DELETE FROM session_records WHERE user_id = ?", (user_id,))
+        else:
+            self._execute(
+                "DELETE FROM session_records WHERE user_id = ? AND updated < ?", (user_id, older_than)
+            )
+
+    def clear_sessions(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM suspensions")
+        conn.execute("DELETE FROM session_records")
+
+    def get_counter(self, name):
+        row = self._execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def increment_counter(self, name):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                (name,),
+            )
+            value = conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+
+def get_state_backend(backend_type: str | None = None, path: str | None = None) -> StateBackend:
+    """
+    Builds the backend selected by `STATE_BACKEND` (`memory` or `sqlite`) and
+    `STATE_DB_PATH` unless given explicitly.
+    """
+    backend_type = backend_type or os.getenv("STATE_BACKEND", STATE_BACKEND_TYPE["memory"])
+    if backend_type == STATE_BACKEND_TYPE["sqlite"]:
+        path = path or os.getenv("STATE_DB_PATH", "state.db")
+        print(f"[StateBackend] Using shared SQLite state at {path}")
+        return SQLiteStateBackend(path)
+    if backend_type != STATE_BACKEND_TYPE["memory"]:
+        print(f"[StateBackend] Unknown backend '{backend_type}', falling back to memory")
+    return InMemoryStateBackend()
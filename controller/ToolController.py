@@ -0,0 +1,306 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from google.genai import types as genai_types
+
+MAX_TOOL_HOPS = 1  # model turns answered with tool results before the final answer
+TOOL_WORKERS = 4
+# Gemini 2.0 does not support function calling together with a JSON response
+_JSON_FIELDS = ("response_mime_type", "response_schema")
+
+
+class ToolController:
+    """
+    Function-calling loop of a chat turn:
+
+    1. the message is sent with the tools declared (`tool_config`);
+    2. if the model calls tools, they are run, concurrently when there are
+       several calls, and their results go back to the same chat as
+       `FunctionResponse` parts;
+    3. after `max_hops` rounds of tool results the model must answer
+       (`answer_config`, tools off, JSON reply).
+
+    A model answering the tool hop directly replies in plain text (no JSON
+    output with tools declared), that text is the reply: asking again for
+    JSON would cost a second model call, and a streamed reply would be sent
+    twice.
+
+    A retrieval answer therefore costs two model calls and one retrieval.
+    Several calls of a function with a batch handler in one model turn are
+    answered by a single batch call (e.g. one embedding request and one
+    vector search for all retrieval queries).
+    The latency of every hop and tool is recorded, see `get_stats`.
+    """
+    def __init__(
+        self,
+        declarations: List[Dict[str, Any]],
+        handlers: Dict[str, Callable[..., Any]],
+        async_handlers: Optional[Dict[str, Callable[..., Awaitable[Any]]]] = None,
+        batch_handlers: Optional[Dict[str, Callable[[List[Dict[str, Any]]], List[Any]]]] = None,
+        async_batch_handlers: Optional[Dict[str, Callable[[List[Dict[str, Any]]], Awaitable[List[Any]]]]] = None,
+        max_hops: int = MAX_TOOL_HOPS,
+        max_workers: int = TOOL_WORKERS,
+    ):
+        """
+        :param declarations: The `tools` of a `GenerateContentConfig`.
+        :param handlers: Function name to callable, called with the call's arguments.
+        :param async_handlers: Coroutine versions used by `arun`, the sync
+            handler is run in a thread otherwise.
+        :param batch_handlers: Function name to callable answering several
+            calls of a turn at once, called with the list of their arguments
+            and returning one result per call.
+        :param async_batch_handlers: Coroutine versions used by `arun`.
+        """
+        self.tools = declarations
+        self.handlers = handlers
+        self.async_handlers = async_handlers or {}
+        self.batch_handlers = batch_handlers or {}
+        self.async_batch_handlers = async_batch_handlers or {}
+        self.max_hops = max_hops
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self.lock = threading.Lock()
+
+        # metrics
+        self.turns = 0
+        self.tool_turns = 0
+        self.hop_calls: Dict[int, int] = {}
+        self.hop_seconds: Dict[int, float] = {}
+        self.tool_calls: Dict[str, int] = {}
+        self.tool_seconds: Dict[str, float] = {}
+        self.tool_errors = 0
+        self.direct_answers = 0
+
+    @staticmethod
+    def without_json(config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        :return: A copy of a config dict without the JSON response settings.
+        """
+        return {key: value for key, value in config.items() if key not in _JSON_FIELDS}
+
+    def _record_hop(self, hop: int, seconds: float):
+        with self.lock:
+            self.hop_calls[hop] = self.hop_calls.get(hop, 0) + 1
+            self.hop_seconds[hop] = self.hop_seconds.get(hop, 0.0) + seconds
+        print(f"[Tools] hop {hop} model call took {seconds * 1000:.0f}ms")
+
+    def _record_tool(self, name: str, seconds: float, failed: bool):
+        with self.lock:
+            self.tool_calls[name] = self.tool_calls.get(name, 0) + 1
+            self.tool_seconds[name] = self.tool_seconds.get(name, 0.0) + seconds
+            self.tool_errors += int(failed)
+
+    def _record_turn(self, hops: int, direct_answer: bool = False):
+        with self.lock:
+            self.turns += 1
+            self.tool_turns += int(hops > 0)
+            self.direct_answers += int(direct_answer)
+
+    @staticmethod
+    def _to_part(name: str, result: Any) -> genai_types.Part:
+        if not isinstance(result, dict):
+            result = {"result": result}
+        return genai_types.Part.from_function_response(name=name, response=result)
+
+    def _call(self, function_call, overrides: Optional[Dict[str, Callable[..., Any]]] = None) -> genai_types.Part:
+        name, args = function_call.name, dict(function_call.args or {})
+        start = time.monotonic()
+        failed = False
+        try:
+            handler = (overrides or {}).get(name) or self.handlers.get(name)
+            if handler is None:
+                raise KeyError(f"unknown function {name}")
+            result = handler(**args)
+        except Exception as e:
+            print(f"[Tools] {name} failed: {e}")
+            failed, result = True, {"error": str(e)}
+        self._record_tool(name, time.monotonic() - start, failed)
+        return self._to_part(name, result)
+
+    async def _acall(
+        self,
+        function_call,
+        overrides: Optional[Dict[str, Callable[..., Awaitable[Any]]]] = None,
+    ) -> genai_types.Part:
+        name, args = function_call.name, dict(function_call.args or {})
+        handler = (overrides or {}).get(name) or self.async_handlers.get(name)
+        if handler is None:
+            return await asyncio.to_thread(self._call, function_call)
+        start = time.monotonic()
+        failed = False
+        try:
+            result = await handler(**args)
+        except Exception as e:
+            print(f"[Tools] {name} failed: {e}")
+            failed, result = True, {"error": str(e)}
+        self._record_tool(name, time.monotonic() - start, failed)
+        return self._to_part(name, result)
+
+    @staticmethod
+    def _group(function_calls: List[Any], batched: Any, overrides: Optional[Dict[str, Any]]) -> List[List[int]]:
+        # indexes of the calls answered together: the calls of a batched
+        # function (unless overridden for the turn), any other call alone
+        groups, batches = [], {}
+        for i, call in enumerate(function_calls):
+            if call.name in batched and call.name not in (overrides or {}):
+                if call.name not in batches:
+                    batches[call.name] = []
+                    groups.append(batches[call.name])
+                batches[call.name].append(i)
+            else:
+                groups.append([i])
+        return groups
+
+    def _record_batch(self, name: str, size: int, seconds: float, failed: bool):
+        for _ in range(size):
+            self._record_tool(name, seconds, failed)
+        print(f"[Tools] {size} {name} calls answered in one batch")
+
+    def _call_batch(self, function_calls: List[Any]) -> List[genai_types.Part]:
+        name = function_calls[0].name
+        start = time.monotonic()
+        failed = False
+        try:
+            results = self.batch_handlers[name]([dict(call.args or {}) for call in function_calls])
+        except Exception as e:
+            print(f"[Tools] {name} failed: {e}")
+            failed, results = True, [{"error": str(e)}] * len(function_calls)
+        self._record_batch(name, len(function_calls), time.monotonic() - start, failed)
+        return [self._to_part(name, result) for result in results]
+
+    async def _acall_batch(self, function_calls: List[Any]) -> List[genai_types.Part]:
+        name = function_calls[0].name
+        handler = self.async_batch_handlers.get(name)
+        if handler is None:
+            return await asyncio.to_thread(self._call_batch, function_calls)
+        start = time.monotonic()
+        failed = False
+        try:
+            results = await handler([dict(call.args or {}) for call in function_calls])
+        except Exception as e:
+            print(f"[Tools] {name} failed: {e}")
+            failed, results = True, [{"error": str(e)}] * len(function_calls)
+        self._record_batch(name, len(function_calls), time.monotonic() - start, failed)
+        return [self._to_part(name, result) for result in results]
+
+    def execute(
+        self,
+        function_calls: List[Any],
+        overrides: Optional[Dict[str, Callable[..., Any]]] = None,
+    ) -> List[genai_types.Part]:
+        """
+        Runs the calls of one model turn, concurrently if there are several.
+        :param overrides: Handlers of this turn only, replacing the registered ones.
+        :return: One `FunctionResponse` part per call, in order.
+        """
+        def run_group(group: List[int]) -> List[genai_types.Part]:
+            if len(group) > 1:
+                return self._call_batch([function_calls[i] for i in group])
+            return [self._call(function_calls[group[0]], overrides)]
+
+        groups = self._group(function_calls, self.batch_handlers, overrides)
+        if len(groups) == 1:
+            return run_group(groups[0])
+        parts = [None] * len(function_calls)
+        for group, group_parts in zip(groups, self.executor.map(run_group, groups)):
+            for i, part in zip(group, group_parts):
+                parts[i] = part
+        return parts
+
+    async def aexecute(
+        self,
+        function_calls: List[Any],
+        overrides: Optional[Dict[str, Callable[..., Awaitable[Any]]]] = None,
+    ) -> List[genai_types.Part]:
+        """
+        Async version of `execute`.
+        """
+        async def run_group(group: List[int]) -> List[genai_types.Part]:
+            if len(group) > 1:
+                return await self._acall_batch([function_calls[i] for i in group])
+            return [await self._acall(function_calls[group[0]], overrides)]
+
+        groups = self._group(function_calls, {**self.batch_handlers, **self.async_batch_handlers}, overrides)
+        parts = [None] * len(function_calls)
+        for group, group_parts in zip(groups, await asyncio.gather(*(run_group(group) for group in groups))):
+            for i, part in zip(group, group_parts):
+                parts[i] = part
+        return parts
+
+    def run(
+        self,
+        send: Callable[[Any, Any], Any],
+        message: Any,
+        tool_config: Any,
+        answer_config: Any,
+        overrides: Optional[Dict[str, Callable[..., Any]]] = None,
+    ) -> Any:
+        """
+        Answers a message, running the tools the model calls.
+
+        :param send: Sends a message (or parts) to the chat with a config and
+            returns the model response, e.g. `lambda m, c: chat.send_message(m, config=c)`.
+        :param tool_config: Config of the hops where the model may call tools,
+            `answer_config` itself for a turn without tools.
+        :param answer_config: Config of the final hop, without tools.
+        :param overrides: Handlers of this turn only, see `execute`.
+        :return: The last model response.
+        """
+        hop = 0
+        start = time.monotonic()
+        response = send(message, tool_config)
+        self._record_hop(hop, time.monotonic() - start)
+        while response is not None and response.function_calls and hop < self.max_hops:
+            hop += 1
+            parts = self.execute(response.function_calls, overrides)
+            config = tool_config if hop < self.max_hops else answer_config
+            start = time.monotonic()
+            response = send(parts, config)
+            self._record_hop(hop, time.monotonic() - start)
+        # answered on a hop with tools declared, in plain text
+        self._record_turn(hop, direct_answer=not hop and tool_config is not answer_config)
+        return response
+
+    async def arun(
+        self,
+        send: Callable[[Any, Any], Awaitable[Any]],
+        message: Any,
+        tool_config: Any,
+        answer_config: Any,
+        overrides: Optional[Dict[str, Callable[..., Awaitable[Any]]]] = None,
+    ) -> Any:
+        """
+        Async version of `run`, `send` is a coroutine function.
+        """
+        hop = 0
+        start = time.monotonic()
+        response = await send(message, tool_config)
+        self._record_hop(hop, time.monotonic() - start)
+        while response is not None and response.function_calls and hop < self.max_hops:
+            hop += 1
+            parts = await self.aexecute(response.function_calls, overrides)
+            config = tool_config if hop < self.max_hops else answer_config
+            start = time.monotonic()
+            response = await send(parts, config)
+            self._record_hop(hop, time.monotonic() - start)
+        # answered on a hop with tools declared, in plain text
+        self._record_turn(hop, direct_answer=not hop and tool_config is not answer_config)
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "turns": self.turns,
+                "tool_turns": self.tool_turns,
+                "avg_hop_latency_ms": {
+                    hop: self.hop_seconds[hop] / self.hop_calls[hop] * 1000 for hop in sorted(self.hop_calls)
+                },
+                "tool_calls": dict(self.tool_calls),
+                "avg_tool_latency_ms": {
+                    name: self.tool_seconds[name] / self.tool_calls[name] * 1000 for name in self.tool_calls
+                },
+                "tool_errors": self.tool_errors,
+                "direct_answers": self.direct_answers,
+            }
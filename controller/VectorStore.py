@@ -0,0 +1,388 @@
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+VECTOR_BACKEND_TYPE = {
+    "cloud": "cloud",  # Chroma CloudClient
+    "persistent": "persistent",  # Chroma PersistentClient on disk
+    "local": "local",  # in-process NumPy index
+}
+
+COMPACT_RATIO = 0.5  # share of dead rows in the local index files that triggers a rewrite
+
+CHROMA_TENANT = "cd268c1a-064e-41e7-9286-35350f1ab529"
+CHROMA_DATABASE = "KNI"
+
+
+def _matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    The subset of Chroma `where` filters used here: `{"key": value}`,
+    `{"key": {"$eq" | "$ne" | "$in" | "$nin": ...}}` and `$and`.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$nin" and value in operand:
+                return False
+    return True
+
+
+class LocalVectorStore:
+    """
+    In-process vector index with the subset of the Chroma `Collection` API
+    used by `ContextController` (`add`, `query`, `get`, `delete`, `count`),
+    results shaped like Chroma's.
+
+    Vectors are L2-normalized float32 rows of one matrix, a batch of queries
+    is scored with a single matrix product (cosine similarity).
+
+    On disk (under `path/collection_name`) writes are appended: vectors as
+    raw float32 rows to `vectors-<generation>.f32` (memory-mapped on load),
+    documents, metadata and deletes as lines of `records.jsonl`, so an upsert
+    writes its own rows only. Both are rewritten with the live rows alone
+    (a new generation) once dead rows make up `compact_ratio` of them.
+    Processes sharing the directory (e.g. gunicorn workers) write under an
+    exclusive file lock, and replay the lines appended by the others before
+    each write and each read.
+    """
+    def __init__(self, path: str, collection_name: str, compact_ratio: float = COMPACT_RATIO):
+        self.directory = os.path.join(path, collection_name)
+        self.name = collection_name
+        self.compact_ratio = compact_ratio
+        self.lock = threading.Lock()
+        self._reset()
+        with self.lock, self._file_lock(fcntl.LOCK_SH):
+            self._sync()
+        if self.ids:
+            print(f"[LocalVectorStore] Loaded {len(self.ids)} vectors from {self.directory}")
+
+    def _reset(self, generation: Optional[str] = None, dim: int = 0):
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.rows: List[int] = []  # row of each vector in the vectors file
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.generation = generation
+        self.dim = dim
+        self.file_rows = 0  # rows of the vectors file, dead ones included
+        self.log_offset = 0  # bytes of `records.jsonl` replayed
+        self.log_signature = None
+
+    @property
+    def _log_path(self) -> str:
+        return os.path.join(self.directory, "records.jsonl")
+
+    def _vectors_path(self, generation: Optional[str] = None) -> str:
+        return os.path.join(self.directory, f"vectors-{generation or self.generation}.f32")
+
+    def _read_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._log_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    @contextlib.contextmanager
+    def _file_lock(self, operation: int):
+        # shared by the processes using the directory, exclusive for writes
+        if operation == fcntl.LOCK_SH and not os.path.isdir(self.directory):
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as fhandle:
+            fcntl.flock(fhandle, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(fhandle, fcntl.LOCK_UN)
+
+    def _sync(self):
+        """
+        Replays the lines appended to the records since the last sync, by any
+        process, or all of them after a rewrite. Called under both locks.
+        """
+        signature = self._read_signature()
+        if signature == self.log_signature:
+            return
+        if signature is None:
+            self._reset()
+            return
+        with open(self._log_path, "rb") as fhandle:
+            header = json.loads(fhandle.readline())
+            if header["generation"] != self.generation or signature[1] < self.log_offset:
+                self._reset(header["generation"], header["dim"])
+                self.log_offset = fhandle.tell()
+            fhandle.seek(self.log_offset)
+            data = fhandle.read()
+        # a line cut short by a crashed writer is left out, the next write overwrites it
+        data = data[:data.rfind(b"\n") + 1]
+        self.log_offset += len(data)
+        self.log_signature = signature
+        self._apply([json.loads(line) for line in data.splitlines() if line.strip()])
+
+    def _apply(self, entries: List[Dict[str, Any]]):
+        # id -> (row, document, metadata), a replaced id moves to the end as in `add`
+        live = {
+            id_: (row, document, metadata)
+            for id_, row, document, metadata in zip(self.ids, self.rows, self.documents, self.metadatas)
+        }
+        for entry in entries:
+            for item in entry.get("add", ()):
+                live.pop(item["id"], None)
+                live[item["id"]] = (item["row"], item["document"], item["metadata"])
+            for id_ in entry.get("delete", ()):
+                live.pop(id_, None)
+
+        self.ids = list(live)
+        self.rows = [row for row, _, _ in live.values()]
+        self.documents = [document for _, document, _ in live.values()]
+        self.metadatas = [metadata for _, _, metadata in live.values()]
+        path = self._vectors_path()
+        self.file_rows = os.path.getsize(path) // (self.dim * 4) if self.dim and os.path.exists(path) else 0
+        if not self.rows:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            return
+        matrix = np.memmap(path, dtype=np.float32, mode="r", shape=(self.file_rows, self.dim))
+        rows = np.asarray(self.rows, dtype=np.int64)
+        # the file itself while no row is dead, a copy of the live rows otherwise
+        self.vectors = matrix[:len(rows)] if np.array_equal(rows, np.arange(len(rows))) else matrix[rows]
+
+    def _append(self, entry: Dict[str, Any], vectors: Optional[np.ndarray] = None):
+        """
+        Appends a records line, and the vectors of its added items. Called
+        synced, under both locks: what a crashed writer left after the last
+        complete line is overwritten.
+        """
+        if vectors is not None:
+            row_bytes = self.dim * 4
+            with open(self._vectors_path(), "r+b") as fhandle:
+                first_row = fhandle.seek(0, os.SEEK_END) // row_bytes
+                fhandle.truncate(first_row * row_bytes)
+                fhandle.seek(first_row * row_bytes)
+                fhandle.write(vectors.tobytes())
+            for i, item in enumerate(entry["add"]):
+                item["row"] = first_row + i
+        with open(self._log_path, "r+b") as fhandle:
+            fhandle.truncate(self.log_offset)
+            fhandle.seek(self.log_offset)
+            fhandle.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf8"))
+        self._sync()
+
+    def _rewrite(self, dim: int):
+        """
+        Writes the live rows to new files, the records last so that readers
+        see either generation whole. Called synced, under both locks.
+        """
+        generation = uuid.uuid4().hex
+        vectors = np.asarray(self.vectors, dtype=np.float32) if self.ids else np.zeros((0, dim), np.float32)
+        with open(self._vectors_path(generation), "wb") as fhandle:
+            fhandle.write(vectors.tobytes())
+        tmp_path = self._log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf8") as fhandle:
+            fhandle.write(json.dumps({"generation": generation, "dim": dim}) + "\n")
+            if self.ids:
+                items = [
+                    {"id": id_, "row": row, "document": document, "metadata": metadata}
+                    for row, (id_, document, metadata) in enumerate(zip(self.ids, self.documents, self.metadatas))
+                ]
+                fhandle.write(json.dumps({"add": items}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._log_path)
+        # vectors of older generations, or of a rewrite that crashed
+        for name in os.listdir(self.directory):
+            if name.startswith("vectors-") and name != os.path.basename(self._vectors_path(generation)):
+                os.remove(os.path.join(self.directory, name))
+        self._sync()
+
+    def _compact(self):
+        dead = self.file_rows - len(self.ids)
+        if dead and dead >= self.compact_ratio * self.file_rows:
+            print(f"[LocalVectorStore] Rewriting {len(self.ids)} vectors without {dead} dead rows")
+            self._rewrite(self.dim)
+
+    def _refresh(self):
+        # picks up the writes of other processes, called under `self.lock`
+        if self._read_signature() != self.log_signature:
+            with self._file_lock(fcntl.LOCK_SH):
+                self._sync()
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def count(self) -> int:
+        with self.lock:
+            self._refresh()
+            return len(self.ids)
+
+    def add(
+        self,
+        ids: List[str],
+        embeddings: List[List[float]],
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """
+        Adds (or replaces, for existing ids) vectors with their document and metadata.
+        """
+        if len(ids) != len(embeddings):
+            raise ValueError(f"Got {len(ids)} ids for {len(embeddings)} embeddings")
+        if not ids:
+            return
+        documents = documents if documents else [""] * len(ids)
+        metadatas = metadatas if metadatas else [{}] * len(ids)
+        new_vectors = self._normalize(embeddings)
+
+        dim = new_vectors.shape[1]
+        items = [
+            {"id": id_, "document": document, "metadata": dict(metadata or {})}
+            for id_, document, metadata in zip(ids, documents, metadatas)
+        ]
+
+        with self.lock, self._file_lock(fcntl.LOCK_EX):
+            self._sync()
+            if self.ids and dim != self.dim:
+                raise ValueError(f"Embedding dimension {dim} != index dimension {self.dim}")
+            if self.generation is None or dim != self.dim:
+                self._rewrite(dim)
+            self._append({"add": items}, new_vectors)
+            self._compact()
+
+    # `add` already replaces existing ids, as Chroma's `upsert` does
+    upsert = add
+
+    def query(
+        self,
+        query_embeddings,
+        n_results: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, List[List[Any]]]:
+        """
+        Top `n_results` by cosine similarity for each query embedding.
+        `distances` are cosine distances (1 - similarity), as in a Chroma
+        collection with `hnsw:space = cosine`.
+        """
+        queries = self._normalize(query_embeddings)
+        with self.lock:
+            self._refresh()
+            vectors, ids, documents, metadatas = self.vectors, self.ids, self.documents, self.metadatas
+
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if not ids:
+            for key in results:
+                results[key] = [[] for _ in range(len(queries))]
+            return results
+
+        candidates = None
+        if where:
+            candidates = np.array([i for i, metadata in enumerate(metadatas) if _matches(metadata, where)], dtype=np.int64)
+            vectors = np.asarray(vectors)[candidates]
+        # (queries x rows) similarities in one product
+        scores = queries @ np.asarray(vectors).T
+        k = min(n_results, scores.shape[1])
+        for row in scores:
+            if k == 0:
+                top = np.array([], dtype=np.int64)
+            else:
+                top = np.argpartition(-row, k - 1)[:k]
+                top = top[np.argsort(-row[top])]
+            rows = candidates[top] if candidates is not None else top
+            results["ids"].append([ids[i] for i in rows])
+            results["documents"].append([documents[i] for i in rows])
+            results["metadatas"].append([metadatas[i] for i in rows])
+            results["distances"].append([float(1.0 - row[j]) for j in top])
+        return results
+
+    def _select(self, ids: Optional[List[str]], where: Optional[Dict[str, Any]]) -> List[int]:
+        wanted = set(ids) if ids is not None else None
+        return [
+            i for i, id_ in enumerate(self.ids)
+            if (wanted is None or id_ in wanted) and _matches(self.metadatas[i], where)
+        ]
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> Dict[str, List[Any]]:
+        with self.lock:
+            self._refresh()
+            rows = self._select(ids, where)
+            rows = rows[offset:offset + limit if limit is not None else None]
+            results = {
+                "ids": [self.ids[i] for i in rows],
+                "documents": [self.documents[i] for i in rows],
+                "metadatas": [self.metadatas[i] for i in rows],
+            }
+            if include and "embeddings" in include:
+                results["embeddings"] = [np.asarray(self.vectors[i]).tolist() for i in rows]
+            return results
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None):
+        if ids is None and not where:
+            # like Chroma, never wipe the collection by accident
+            return
+        with self.lock, self._file_lock(fcntl.LOCK_EX):
+            self._sync()
+            removed = [self.ids[i] for i in self._select(ids, where)]
+            if not removed:
+                return
+            self._append({"delete": removed})
+            self._compact()
+
+def get_vector_store(backend_type: str | None = None, path: str = "chroma_db", collection_name: str = "facebook_posts"):
+    """
+    Builds the collection selected by `VECTOR_BACKEND` (`cloud`, `persistent`
+    or `local`) unless given explicitly. If Chroma Cloud cannot be reached the
+    local index at `path` is used, so retrieval keeps working.
+    """
+    backend_type = backend_type or os.getenv("VECTOR_BACKEND", VECTOR_BACKEND_TYPE["cloud"])
+    if backend_type == VECTOR_BACKEND_TYPE["local"]:
+        print(f"[VectorStore] Using local index at {path}")
+        return LocalVectorStore(path, collection_name)
+
+    if backend_type == VECTOR_BACKEND_TYPE["persistent"]:
+        import chromadb
+        print(f"[VectorStore] Using Chroma at {path}")
+        return chromadb.PersistentClient(path=path).get_or_create_collection(name=collection_name)
+
+    if backend_type != VECTOR_BACKEND_TYPE["cloud"]:
+        print(f"[VectorStore] Unknown backend '{backend_type}', using Chroma Cloud")
+    try:
+        import chromadb
+        client = chromadb.CloudClient(
+            api_key=os.getenv("CHROMA_API_KEY"),
+            tenant=os.getenv("CHROMA_TENANT", CHROMA_TENANT),
+            database=os.getenv("CHROMA_DATABASE", CHROMA_DATABASE),
+        )
+        return client.get_or_create_collection(name=collection_name)
+    except Exception as e:
+        print(f"[VectorStore] Chroma Cloud unavailable ({e}), falling back to the local index at {path}")
+        return LocalVectorStore(path, collection_name)
@@ -36,6 +36,12 @@ DEFAULT_RESPONSE = (
     " được hỗ trợ tốt nhất nhé! 😳"
 )
 
+# follows the part of a streamed reply already sent when the stream fails
+STREAM_ERROR_RESPONSE = (
+    "Xin lỗi, mình bị gián đoạn giữa chừng. Bạn vui lòng gửi lại câu hỏi hoặc"
+    " liên hệ KNI qua số +84 091-839-1099 nhé! 😳"
+)
+
 GREETING_RESPONSE = (
     "Chào bạn 👋 Mình là trợ lý ảo của KNI Institute, rất vui được hỗ trợ bạn."
     " Mình có thể giúp bạn tìm hiểu về TestAS, các khóa học luyện thi, hoặc tư vấn"
@@ -49,6 +55,20 @@ GREETING_RESPONSE = (
     "Nếu bạn có góp ý gì cho mình, hãy dùng lệnh /feedback <tin nhắn> nhé. Cảm ơn bạn 🥰"
 )
 
+# frequent questions, pre-embedded at startup
+EXAMPLE_QUESTIONS = [
+    "TestAS là gì?",
+    "Luyện thi TestAS ở KNI có gì khác biệt?",
+    "Du học Đức cần chuẩn bị những gì?",
+    "Khi nào có lịch thi TestAS?",
+    "Lệ phí thi TestAS là bao nhiêu?",
+    "Học phí khóa luyện thi TestAS là bao nhiêu?",
+    "Bài thi TestAS gồm những phần nào?",
+    "Bao nhiêu điểm TestAS thì đủ để du học Đức?",
+    "Thi TestAS để vào VGU cần bao nhiêu điểm?",
+    "Đăng ký thi TestAS như thế nào?",
+]
+
 class BotMessage(BaseModel):
     message: str
     image_send_threshold: float
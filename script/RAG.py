@@ -1,6 +1,12 @@
+import hashlib
 import json
+import re
+
+import numpy as np
 from google import genai
 
+from utils.tokens import estimate_tokens
+
 FAQ_PATH = '/Users/rzy/Desktop/ChatBot/facebook-chatbot/testAS/testas_data_en.json'
 
 def load_data(path):
@@ -11,63 +17,154 @@ def load_data(path):
     print(f"Loaded {len(data)} documents from the website.")
     return data
 
-def text_splitting(text: str, chunk_size: int = 1000, chunk_overlap: int = 200) -> list[str]:
+CHUNK_TOKENS = 256  # target chunk size, text-embedding-004 takes up to 2048 tokens
+CHUNK_OVERLAP_TOKENS = 32  # trailing sentences of a chunk repeated at the start of the next one
+
+# a dot after these is not the end of a sentence (lowercased, without the last dot)
+_ABBREVIATIONS = {
+    # English
+    "e.g", "i.e", "etc", "vs", "mr", "mrs", "ms", "dr", "prof", "no", "approx", "incl", "st",
+    # German
+    "z.b", "bzw", "ca", "d.h", "u.a", "usw", "vgl", "ggf", "inkl", "nr", "s", "str", "evtl", "sog",
+    # Vietnamese
+    "tp", "v.v", "ths", "ts", "pgs", "gs", "q",
+}
+# end of sentence punctuation, with closing quotes or brackets, before a space; or a line break
+_BOUNDARY = re.compile(r"[.!?…]+[\"'”’»)\]]*(?=\s)|\n")
+_PREVIOUS_WORD = re.compile(r"(\S+)$")
+_NEXT_CHAR = re.compile(r"\s*(\S)")
+_NOT_WORD = re.compile(r"[\W_]+")
+
+
+def _is_sentence_end(text: str, match: re.Match) -> bool:
+    if match.group() == "\n" or text[match.start()] != ".":
+        return True
+    previous = _PREVIOUS_WORD.search(text, max(0, match.start() - 32), match.start())
+    word = previous.group(1).lower() if previous else ""
+    # abbreviations, initials and numbered items ("1. Juli", "2. Module")
+    if word in _ABBREVIATIONS or (len(word) == 1 and word.isalpha()) or (word.isdigit() and len(word) <= 2):
+        return False
+    following = _NEXT_CHAR.match(text, match.end())
+    return not (following and following.group(1).islower())
+
+def split_sentences(text: str) -> list[tuple[str, str]]:
     """
-    Splits a text into overlapping chunks.
+    Splits a text into sentences (English, German and Vietnamese punctuation).
 
-    Args:
-        text: The input text to be split.
-        chunk_size: The maximum size of each chunk (in characters).
-        chunk_overlap: The number of characters to overlap between chunks.
+    :return: (separator, sentence) pairs, the separator is "\n" for a
+        sentence starting a new line and " " otherwise.
+    """
+    sentences, start, separator = [], 0, " "
+    for match in _BOUNDARY.finditer(text):
+        if not _is_sentence_end(text, match):
+            continue
+        sentence = " ".join(text[start:match.end()].split())
+        if sentence:
+            sentences.append((separator, sentence))
+            separator = " "
+        if match.group() == "\n":
+            separator = "\n"
+        start = match.end()
+    sentence = " ".join(text[start:].split())
+    if sentence:
+        sentences.append((separator, sentence))
+    return sentences
+
+def _split_long_sentence(separator: str, sentence: str, chunk_tokens: int) -> list[tuple[str, str, int]]:
+    # a sentence over the chunk size is cut between words
+    pieces, words, tokens = [], [], 0
+    for word in sentence.split(" "):
+        word_tokens = estimate_tokens(word)
+        if words and tokens + word_tokens > chunk_tokens:
+            pieces.append((separator, " ".join(words), tokens))
+            words, tokens, separator = [], 0, " "
+        words.append(word)
+        tokens += word_tokens
+    pieces.append((separator, " ".join(words), tokens))
+    return pieces
 
-    Returns:
-        A list of text chunks.
+def text_splitting(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[str]:
+    """
+    Splits a text into chunks of whole sentences of about `chunk_tokens`
+    tokens each. Consecutive chunks share their boundary sentences, up to
+    `overlap_tokens` tokens.
+
+    :param text: The input text to be split.
+    :param chunk_tokens: The maximum (estimated) tokens of a chunk.
+    :param overlap_tokens: The maximum tokens repeated from the previous chunk.
+    :return: A list of text chunks.
     """
     if not isinstance(text, str):
         return []
 
-    # 1. First, split the text by paragraphs
-    paragraphs = text.split('\n\n')
-    
-    all_chunks = []
-    
-    for paragraph in paragraphs:
-        if len(paragraph) <= chunk_size:
-            # If the paragraph is small enough, add it as a single chunk
-            if paragraph.strip(): # Ensure we don't add empty strings
-                all_chunks.append(paragraph.strip())
+    pieces = []
+    for separator, sentence in split_sentences(text):
+        tokens = estimate_tokens(sentence)
+        if tokens > chunk_tokens:
+            pieces.extend(_split_long_sentence(separator, sentence, chunk_tokens))
         else:
-            # If the paragraph is too long, split it with a sliding window
-            start_index = 0
-            while start_index < len(paragraph):
-                end_index = start_index + chunk_size
-                chunk = paragraph[start_index:end_index]
-                all_chunks.append(chunk.strip())
-                
-                # Move the start index for the next chunk
-                start_index += (chunk_size - chunk_overlap)
-                
-    return all_chunks
+            pieces.append((separator, sentence, tokens))
+    if not pieces:
+        return []
 
-def text_chunking(data):
-    all_chunks = []
+    # token offsets of the sentences, chunk ends and overlaps are looked up on them
+    tokens = np.fromiter((piece[2] for piece in pieces), dtype=np.int64, count=len(pieces))
+    ends = np.cumsum(tokens)
+    starts = ends - tokens
+    # first sentence past the budget of a chunk starting at each sentence
+    chunk_ends = np.maximum(np.searchsorted(ends, starts + chunk_tokens, side="right"), np.arange(1, len(pieces) + 1))
+    # first sentence of the overlap of a chunk ending before each sentence
+    overlap_starts = np.searchsorted(starts, ends - overlap_tokens, side="left")
+
+    all_chunks, i = [], 0
+    while True:
+        j = int(chunk_ends[i])
+        all_chunks.append(pieces[i][1] + "".join(separator + sentence for separator, sentence, _ in pieces[i + 1:j]))
+        if j >= len(pieces):
+            return all_chunks
+        k = int(overlap_starts[j - 1])
+        i = k if i < k < j else j
 
+def _dedupe_key(text: str) -> bytes:
+    # near-identical: differing only in case, punctuation or spacing
+    return hashlib.blake2b(_NOT_WORD.sub(" ", text.lower()).strip().encode(), digest_size=16).digest()
+
+def iter_chunks(data, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS, dedupe: bool = True):
+    """
+    Yields the chunks of documents one at a time, `data` may be any iterable
+    (e.g. documents streamed from an upload by `utils.json_stream`).
+
+    :param dedupe: Drop paragraphs already seen on another page (menus,
+        footers, cookie banners), compared ignoring case, punctuation and spacing.
+    """
+    seen = set()
     # 3. Process each document and create chunks
     for doc in data:
         # We only process docs that have meaningful content
         if 'body' in doc and doc['body']:
+            body = doc['body']
+            if dedupe:
+                paragraphs = []
+                for paragraph in body.split('\n\n'):
+                    key = _dedupe_key(paragraph)
+                    if key not in seen:
+                        seen.add(key)
+                        paragraphs.append(paragraph)
+                body = '\n\n'.join(paragraphs)
             # Split the document's body text
-            chunks = text_splitting(doc['body'])
+            chunks = text_splitting(body, chunk_tokens, overlap_tokens)
 
             # Add metadata to each chunk
             for i, chunk_text in enumerate(chunks):
-                all_chunks.append({
+                yield {
                     'source_url': doc['url'],
                     'title': doc['title'],
                     'content': chunk_text,
                     'chunk_id': f"{doc['url']}-{i}" # A unique ID for each chunk
-                })
+                }
 
+def text_chunking(data):
+    all_chunks = list(iter_chunks(data))
     print(f"Created {len(all_chunks)} chunks from {len(data)} documents.")
     return all_chunks
 
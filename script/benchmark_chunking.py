@@ -0,0 +1,49 @@
+"""
+Benchmark of the sentence chunker against the former fixed-size character
+windows (1000 characters, 200 overlap) on the scraped corpus: chunks per
+second, chunks per document and estimated tokens to embed.
+
+    python -m script.benchmark_chunking [path/to/testas_data.json]
+"""
+import contextlib
+import io
+import sys
+import time
+
+from script.RAG import FAQ_PATH, estimate_tokens, iter_chunks, load_data
+
+NUM_RUNS = 5
+
+
+def fixed_window_chunks(data, chunk_size: int = 1000, chunk_overlap: int = 200):
+    # the previous splitter, for comparison
+    for doc in data:
+        if doc.get('body'):
+            for paragraph in doc['body'].split('\n\n'):
+                if len(paragraph) <= chunk_size:
+                    if paragraph.strip():
+                        yield {'content': paragraph.strip()}
+                    continue
+                for start in range(0, len(paragraph), chunk_size - chunk_overlap):
+                    yield {'content': paragraph[start:start + chunk_size].strip()}
+
+
+def benchmark(name: str, chunker, data, runs: int = NUM_RUNS):
+    start = time.perf_counter()
+    for _ in range(runs):
+        chunks = list(chunker(data))
+    elapsed = (time.perf_counter() - start) / runs
+    tokens = sum(estimate_tokens(chunk['content']) for chunk in chunks)
+    print(
+        f"{name:<18} {len(chunks):>7} chunks  {len(chunks) / elapsed:>10.0f} chunks/s  "
+        f"{len(chunks) / max(len(data), 1):6.2f} chunks/doc  {tokens:>9} tokens to embed"
+    )
+
+
+if __name__ == "__main__":
+    with contextlib.redirect_stdout(io.StringIO()):
+        data = load_data(sys.argv[1] if len(sys.argv) > 1 else FAQ_PATH)
+    print(f"{len(data)} documents")
+    benchmark("fixed window", fixed_window_chunks, data)
+    benchmark("sentences", lambda docs: iter_chunks(docs, dedupe=False), data)
+    benchmark("sentences+dedupe", iter_chunks, data)
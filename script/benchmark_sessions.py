@@ -0,0 +1,38 @@
+"""
+Micro-benchmark of `SessionController.get_session` cost per call with a growing
+number of live sessions.
+
+    python -m script.benchmark_sessions
+"""
+import contextlib
+import io
+import random
+import time
+from unittest.mock import MagicMock
+
+from controller.SessionController import SessionController
+
+SESSION_COUNTS = [100, 10_000, 100_000]
+NUM_CALLS = 10_000
+
+
+def benchmark(n_sessions: int, n_calls: int = NUM_CALLS) -> float:
+    client = MagicMock()
+    controller = SessionController(client, session_capacity=n_sessions)
+    user_ids = [f"user{i}" for i in range(n_sessions)]
+    for user_id in user_ids:
+        controller.get_session(user_id)
+
+    lookups = [random.choice(user_ids) for _ in range(n_calls)]
+    start = time.perf_counter()
+    for user_id in lookups:
+        controller.get_session(user_id)
+    return (time.perf_counter() - start) / n_calls
+
+
+if __name__ == "__main__":
+    for n_sessions in SESSION_COUNTS:
+        # the controller logs every call, keep it out of the measurement output
+        with contextlib.redirect_stdout(io.StringIO()):
+            cost = benchmark(n_sessions)
+        print(f"{n_sessions:>7} sessions: {cost * 1e6:8.2f} us / get_session")
@@ -0,0 +1,70 @@
+"""
+Offline evaluation of retrieval on a labelled question set: recall@k and
+p50/p95 query latency of dense, hybrid (dense + BM25) and hybrid + MMR
+retrieval against the configured collection.
+
+    python -m script.eval_retrieval questions.json [k ...]
+
+`questions.json` is a list of {"question": ..., "relevant": [...]}, a
+relevant entry being a chunk id or a source URL. Recall@k is the share of
+the relevant entries found in the top k chunks, averaged over questions.
+The questions are embedded once before timing, latencies are those of the
+collection queries and ranking.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from constant import COLLECTION_NAME
+from controller.ContextController import ContextController
+from controller.LexicalIndexController import LexicalIndexController
+
+DEFAULT_KS = [1, 3, 5]
+MMR_DIVERSITY = 0.3
+
+
+def recall(chunks, relevant) -> float:
+    found = {chunk["id"] for chunk in chunks} | {chunk["metadata"].get("source_url") for chunk in chunks}
+    return len(found & set(relevant)) / len(relevant)
+
+
+def evaluate(controller: ContextController, questions, ks):
+    recalls = {k: [] for k in ks}
+    latencies = []
+    for item in questions:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            chunks = controller.query_chunks(item["question"], n_results=max(ks))
+        latencies.append(time.perf_counter() - start)
+        for k in ks:
+            recalls[k].append(recall(chunks[:k], item["relevant"]))
+    return {k: float(np.mean(values)) for k, values in recalls.items()}, np.percentile(latencies, [50, 95]) * 1000
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1], "r") as f:
+        questions = [item for item in json.load(f) if item.get("relevant")]
+    ks = [int(k) for k in sys.argv[2:]] or DEFAULT_KS
+
+    controller = ContextController(path=os.getenv("CHROMA_DB_PATH", "chroma_db"), collection_name=COLLECTION_NAME)
+    controller.embed_queries([item["question"] for item in questions])
+    lexical_index = LexicalIndexController()
+    modes = {
+        "dense": (None, 0.0),
+        "hybrid": (lexical_index, 0.0),
+        "hybrid+mmr": (lexical_index, MMR_DIVERSITY),
+    }
+    print(f"{len(questions)} questions, {controller.get_collection_count()} chunks")
+    for name, (index, diversity) in modes.items():
+        controller.lexical_index, controller.mmr_diversity = index, diversity
+        if index is not None and index.built_at is None:
+            # not part of the query latency
+            controller._refresh_lexical_index()
+        recalls, (p50, p95) = evaluate(controller, questions, ks)
+        scores = "  ".join(f"recall@{k} {value:.3f}" for k, value in recalls.items())
+        print(f"{name:<11} {scores}  p50 {p50:7.1f}ms  p95 {p95:7.1f}ms")
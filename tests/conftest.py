@@ -0,0 +1,113 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import pytest
+
+
+class FakeGraph:
+    """
+    Minimal stand-in for the Graph API conversation endpoints, served over
+    real HTTP on localhost.
+    """
+    def __init__(self):
+        self.url = ""
+        self.conversations = []  # [{"id": ..., "participants": {"data": [{"id": ...}]}}]
+        self.messages = {}  # conversation id -> [{"id", "message", "from"}], newest first
+        self.page_size = None  # overrides the `limit` asked by the client
+        self.supports_user_id_filter = True
+        self.requests = []  # (path, query) of every request
+        self.queued_responses = []  # (status, body, headers) served before anything else
+        self.batches = []  # operations of every batch request
+        self.labels = {}  # conversation or user id -> [label ids]
+
+    def add_conversation(self, conversation_id, *participant_ids):
+        self.conversations.append({
+            "id": conversation_id,
+            "participants": {"data": [{"id": pid} for pid in participant_ids]},
+        })
+
+    def handle(self, path, query):
+        self.requests.append((path, query))
+        if self.queued_responses:
+            return self.queued_responses.pop(0)
+        if path.endswith("/me/conversations"):
+            conversations = self.conversations
+            user_id = query.get("user_id")
+            if user_id and self.supports_user_id_filter:
+                conversations = [
+                    c for c in conversations
+                    if any(p["id"] == user_id for p in c["participants"]["data"])
+                ]
+            limit = self.page_size or int(query.get("limit", 25))
+            after = int(query.get("after", 0))
+            body = {"data": conversations[after:after + limit]}
+            if after + limit < len(conversations):
+                next_query = {**query, "after": after + limit}
+                body["paging"] = {"next": f"{self.url}{path}?{urlencode(next_query)}"}
+            return 200, body, {}
+        if path.endswith("/custom_labels"):
+            owner_id = path.rstrip("/").split("/")[-2]
+            return 200, {"data": [{"id": label} for label in self.labels.get(owner_id, [])]}, {}
+        if path.endswith("/messages") and "/me/" not in path:
+            conversation_id = path.rstrip("/").split("/")[-2]
+            limit = int(query.get("limit", 25))
+            return 200, {"data": self.messages.get(conversation_id, [])[:limit]}, {}
+        if path.endswith("/me/messages"):
+            return 200, {"recipient_id": "user", "message_id": "m_sent"}, {}
+        message_id = path.rstrip("/").split("/")[-1]
+        if message_id.startswith("m_"):
+            # "/{message_id}?fields=message"
+            return 200, {"id": message_id, "message": f"text of {message_id}"}, {}
+        return 404, {"error": {"message": f"Unknown path {path}"}}, {}
+
+    def handle_batch(self, prefix, operations):
+        self.batches.append(operations)
+        results = []
+        for operation in operations:
+            parsed = urlparse(operation["relative_url"])
+            query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            status, body, _ = self.handle(f"{prefix}/{parsed.path}", query)
+            results.append({"code": status, "headers": [], "body": json.dumps(body)})
+        return 200, results, {}
+
+
+@pytest.fixture
+def fake_graph():
+    graph = FakeGraph()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parsed = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+            if self.command == "POST":
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if "batch" in payload:
+                    status, body, headers = graph.handle_batch(parsed.path.rstrip("/"), payload["batch"])
+                else:
+                    status, body, headers = graph.handle(parsed.path, query)
+            else:
+                status, body, headers = graph.handle(parsed.path, query)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_POST = do_GET
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    graph.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield graph
+    server.shutdown()
+    server.server_close()
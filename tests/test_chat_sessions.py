@@ -1,10 +1,9 @@
 import pytest
-from collections import OrderedDict
 from unittest.mock import MagicMock
-from datetime import datetime, timedelta
 import time
+import os
 
-from SessionController import SessionController  # replace with actual path
+from controller.SessionController import SessionController, SessionRecord
 
 @pytest.fixture
 def mock_client():
@@ -25,6 +24,7 @@ def test_create_and_get_session(mock_client):
     assert user_id in controller.sessions
     assert "chat" in session
     assert "last_date" in session
+    assert session["record"] is controller.sessions[user_id]
 
 def test_session_reuse_updates_time(mock_client):
     controller = SessionController(mock_client)
@@ -41,49 +41,31 @@ def test_session_reuse_updates_time(mock_client):
     print(first_time)
     print(second_time)
 
-    assert first_session is second_session
+    assert first_session["record"] is second_session["record"]
     assert second_time > first_time
 
 def test_capacity_cleanup(mock_client):
     controller = SessionController(mock_client, session_capacity=3)
-    now = datetime.now()
+    now = time.time()
 
-    for i in range(5):
-        controller.sessions[f"user{i}"] = {
-            "chat": MagicMock(),
-            "last_date": now - timedelta(seconds=i * 10)
-        }
+    # sessions are kept oldest first
+    for i in reversed(range(5)):
+        controller.sessions[f"user{i}"] = SessionRecord(f"user{i}", now - i * 10)
 
-    controller._sort_and_clean_chat_sessions(now)
+    controller._evict_sessions(now)
 
     assert len(controller.sessions) == 3
+    assert list(controller.sessions) == ["user2", "user1", "user0"]
 
 def test_time_threshold_cleanup(mock_client):
     controller = SessionController(mock_client, session_capacity=10, session_time_threshold=30)
-    now = datetime.now()
-
-    controller.sessions["user1"] = {
-        "chat": MagicMock(),
-        "last_date": now - timedelta(seconds=10)
-    }
-    controller.sessions["user2"] = {
-        "chat": MagicMock(),
-        "last_date": now - timedelta(seconds=30)
-    }
-    controller.sessions["user3"] = {
-        "chat": MagicMock(),
-        "last_date": now - timedelta(seconds=60)
-    }
-    controller.sessions["user4"] = {
-        "chat": MagicMock(),
-        "last_date": now - timedelta(seconds=25)
-    }
-    controller.sessions["user5"] = {
-        "chat": MagicMock(),
-        "last_date": now - timedelta(seconds=120)
-    }
-
-    controller._sort_and_clean_chat_sessions(now)
+    now = time.time()
+
+    # sessions are kept oldest first
+    for user_id, age in [("user5", 120), ("user3", 60), ("user2", 30), ("user4", 25), ("user1", 10)]:
+        controller.sessions[user_id] = SessionRecord(user_id, now - age)
+
+    controller._evict_sessions(now)
 
     assert "user2" not in controller.sessions
     assert "user3" not in controller.sessions
@@ -92,6 +74,22 @@ def test_time_threshold_cleanup(mock_client):
     assert "user1" in controller.sessions
     assert "user4" in controller.sessions
 
+def test_get_session_moves_to_end_and_evicts_lru(mock_client):
+    evicted = []
+    controller = SessionController(
+        mock_client,
+        session_capacity=2,
+        on_evict=lambda user_id, session, reason: evicted.append((user_id, reason)),
+    )
+
+    controller.get_session("user1")
+    controller.get_session("user2")
+    controller.get_session("user1")  # user2 is now the least recently used
+    controller.get_session("user3")
+
+    assert list(controller.sessions) == ["user1", "user3"]
+    assert evicted == [("user2", "capacity")]
+
 def test_delete_session(mock_client):
     controller = SessionController(mock_client)
     user_id = "user3"
@@ -100,3 +98,61 @@ def test_delete_session(mock_client):
 
     controller.delete_session(user_id)
     assert user_id not in controller.sessions
+
+def _content(role, text):
+    content = MagicMock()
+    content.role = role
+    content.parts = [MagicMock(text=text)]
+    return content
+
+def test_save_session_keeps_bounded_text_turns(mock_client):
+    controller = SessionController(mock_client, max_turns=2)
+    session = controller.get_session("user1")
+    session["chat"].get_history.return_value = [
+        _content("user", "TestAS là gì?"),
+        _content("model", "TestAS là ..."),
+        _content("user", "Lệ phí bao nhiêu?"),
+    ]
+
+    controller.save_session("user1", session["chat"])
+
+    assert list(controller.sessions["user1"].turns) == [("model", "TestAS là ..."), ("user", "Lệ phí bao nhiêu?")]
+    # history handed to Gemini must start with a user turn
+    assert [content.role for content in controller.sessions["user1"].to_history()] == ["user"]
+
+def test_snapshot_roundtrip(mock_client, tmp_path):
+    path = str(tmp_path / "sessions.jsonl")
+    controller = SessionController(mock_client)
+    controller.sessions["user1"] = SessionRecord("user1", time.time() - 10, [("user", "hi"), ("model", "hello")])
+    controller.sessions["user2"] = SessionRecord("user2", time.time())
+
+    assert controller.snapshot(path) == 2
+
+    restored = SessionController(mock_client)
+    assert restored.load_snapshot(path) == 2
+    assert list(restored.sessions) == ["user1", "user2"]
+    assert list(restored.sessions["user1"].turns) == [("user", "hi"), ("model", "hello")]
+
+def test_snapshots_of_workers_are_merged(mock_client, tmp_path, monkeypatch):
+    path = str(tmp_path / "sessions.jsonl")
+    now = time.time()
+    for pid, last_date, text in [(101, now - 20, "old"), (102, now - 10, "new")]:
+        monkeypatch.setattr(os, "getpid", lambda pid=pid: pid)
+        controller = SessionController(mock_client)
+        controller.sessions["user1"] = SessionRecord("user1", last_date, [("user", text)])
+        controller.sessions[f"user{pid}"] = SessionRecord(f"user{pid}", last_date)
+        controller.snapshot(path)
+
+    assert sorted(os.listdir(tmp_path)) == ["sessions.jsonl.101", "sessions.jsonl.102"]
+    restored = SessionController(mock_client)
+    assert restored.load_snapshot(path) == 3
+    assert list(restored.sessions["user1"].turns) == [("user", "new")]
+
+def test_add_turns_without_chat(mock_client):
+    controller = SessionController(mock_client)
+    controller.add_turns("user7", [("user", "TestAS là gì?"), ("model", '{"message": "..."}')])
+    controller.add_turns("user7", [("user", "Lệ phí?"), ("model", '{"message": "!"}')])
+
+    record = controller.sessions["user7"]
+    assert [role for role, _ in record.turns] == ["user", "model", "user", "model"]
+    assert record.turns[2] == ("user", "Lệ phí?")
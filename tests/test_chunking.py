@@ -0,0 +1,49 @@
+from script.RAG import estimate_tokens, iter_chunks, split_sentences, text_splitting
+
+TEXT = (
+    "Der TestAS ist ein Studierfähigkeitstest, z.B. für Bewerber aus Vietnam. "
+    "Die Gebühr beträgt ca. 50 Euro! Die Prüfung findet am 1. Juli statt.\n\n"
+    "Kỳ thi TestAS là gì? Bạn cần đăng ký tại TP. Hồ Chí Minh.\n"
+    "The exam takes approx. 4 hours. Is it hard?"
+)
+
+
+def test_sentences_split_on_punctuation_not_abbreviations():
+    assert [sentence for _, sentence in split_sentences(TEXT)] == [
+        "Der TestAS ist ein Studierfähigkeitstest, z.B. für Bewerber aus Vietnam.",
+        "Die Gebühr beträgt ca. 50 Euro!",
+        "Die Prüfung findet am 1. Juli statt.",
+        "Kỳ thi TestAS là gì?",
+        "Bạn cần đăng ký tại TP. Hồ Chí Minh.",
+        "The exam takes approx. 4 hours.",
+        "Is it hard?",
+    ]
+
+def test_chunks_are_whole_sentences_within_the_budget():
+    sentences = [sentence for _, sentence in split_sentences(TEXT)]
+    chunks = text_splitting(TEXT, chunk_tokens=30, overlap_tokens=10)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert estimate_tokens(chunk) <= 30
+        assert chunk.split()[-1] in {sentence.split()[-1] for sentence in sentences}
+    # consecutive chunks share the boundary sentence
+    assert any(chunk.endswith("Kỳ thi TestAS là gì?") for chunk in chunks)
+    assert any(chunk.startswith("Kỳ thi TestAS là gì?") for chunk in chunks)
+    assert text_splitting(TEXT) == [TEXT.replace("\n\n", "\n")]
+
+def test_long_sentences_are_cut_between_words():
+    chunks = text_splitting("word " * 500, chunk_tokens=100)
+    assert len(chunks) == 5
+    assert all(set(chunk.split()) == {"word"} for chunk in chunks)
+    assert text_splitting("") == text_splitting(None) == []
+
+def test_boilerplate_chunks_are_indexed_once():
+    docs = [
+        {"url": "a", "title": "A", "body": "Menu, Home.\n\nTestAS fees."},
+        {"url": "b", "title": "B", "body": "menu home\n\nTestAS dates."},
+    ]
+    chunks = list(iter_chunks(docs, chunk_tokens=5, overlap_tokens=0))
+    assert [(chunk["chunk_id"], chunk["content"]) for chunk in chunks] == [
+        ("a-0", "Menu, Home."), ("a-1", "TestAS fees."), ("b-0", "TestAS dates."),
+    ]
+    assert len(list(iter_chunks(docs, chunk_tokens=5, overlap_tokens=0, dedupe=False))) == 4
@@ -0,0 +1,65 @@
+from unittest.mock import MagicMock
+
+from controller.ContextBudgetController import ContextBudgetController, truncate_tokens
+from controller.SessionController import SessionController
+from utils.tokens import estimate_tokens
+
+DOCUMENT = "TestAS ist ein Studierfähigkeitstest für internationale Bewerber. " * 10
+
+
+def conversation(n):
+    turns = []
+    for i in range(n):
+        turns.append(("user", f'Context: """{DOCUMENT}"""\n\nCâu hỏi số {i} về TestAS?'))
+        turns.append(("model", f'{{"message": "Trả lời câu hỏi số {i}"}}'))
+    return turns
+
+def test_history_tokens_stay_flat_over_a_long_conversation():
+    budget = ContextBudgetController(history_tokens=300, summary_tokens=60, recent_turns=2)
+    sent = []
+    turns = []
+    for i in range(30):
+        turns = budget.fit_history(turns + conversation(1)[:1])
+        turns.append(("model", f"answer {i}"))
+        sent.append(sum(estimate_tokens(text) for _, text in turns))
+    assert max(sent[10:]) <= 300 + 10
+    assert turns[0][0] == "user"
+    # the latest questions are summarized, the last turns still carry their context
+    assert turns[0][1].startswith('Context: """Earlier questions of the user: ')
+    assert "Câu hỏi số 0" in turns[0][1]
+    assert DOCUMENT in turns[-2][1]
+    assert budget.get_stats()["turns_dropped"] > 0
+
+def test_short_history_is_unchanged_except_old_context():
+    budget = ContextBudgetController(history_tokens=2000, recent_turns=2)
+    turns = conversation(3)
+    fitted = budget.fit_history(turns)
+    assert [role for role, _ in fitted] == [role for role, _ in turns]
+    assert fitted[0][1] == "Câu hỏi số 0 về TestAS?"
+    assert fitted[-2] == turns[-2]
+    owner_only = [("user", 'Context: """owner: xin chào"""'), ("model", "hi"), ("user", "q"), ("model", "a")]
+    assert budget.fit_history(owner_only)[0] == owner_only[0]
+    assert ContextBudgetController(history_tokens=0).fit_history(turns) == turns
+
+def test_documents_are_kept_best_first_within_the_budget():
+    budget = ContextBudgetController(context_tokens=300)
+    documents = [DOCUMENT, DOCUMENT + "2", DOCUMENT + "3"]
+    fitted = budget.fit_documents(documents)
+    assert fitted[0] == DOCUMENT
+    assert len(fitted) == 2 and fitted[1].endswith("…")
+    assert sum(estimate_tokens(document) for document in fitted) <= 301
+    assert len(budget.fit_documents(documents, share=0.5)) == 1
+    assert budget.get_stats()["documents_truncated"] == 2
+    assert truncate_tokens("a b c", 10) == "a b c"
+
+def test_sessions_are_sent_trimmed():
+    client = MagicMock()
+    budget = ContextBudgetController(history_tokens=100, summary_tokens=30, recent_turns=2)
+    controller = SessionController(client, fit_history=budget.fit_history)
+    controller.add_turns("user1", conversation(10))
+    controller.get_session("user1")
+
+    history = client.chats.create.call_args.kwargs["history"]
+    assert history[0].role == "user"
+    assert sum(estimate_tokens(content.parts[0].text) for content in history) <= 100
+    assert len(controller.sessions["user1"].turns) == 20
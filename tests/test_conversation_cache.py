@@ -0,0 +1,15 @@
+from controller.ConversationCacheController import ConversationCacheController
+
+
+def test_history_is_only_used_once_seeded():
+    cache = ConversationCacheController(history_size=2)
+    cache.record_message("user", "user", "hi")
+    cache.record_message("user", "page", "hello")
+    # full, but fed by webhooks only
+    assert cache.get_history("user") is None
+
+    cache.seed_history("user", [("user", "hi"), ("page", "hello")])
+    cache.record_message("user", "user", "fee?")
+    assert cache.get_history("user") == [("page", "hello"), ("user", "fee?")]
+    stats = cache.get_stats()
+    assert stats["history_hits"] == 1 and stats["history_misses"] == 1
@@ -0,0 +1,53 @@
+import threading
+import time
+
+from controller.DebounceMessageController import DebounceMessageController
+from utils.scheduler import TimerScheduler
+
+
+def test_messages_are_merged_into_one_callback():
+    controller = DebounceMessageController(wait_seconds=0.1)
+    calls = []
+    done = threading.Event()
+
+    def callback(user_id, messages):
+        calls.append((user_id, [m["text"] for m in messages]))
+        done.set()
+
+    for text in ["hi", "how much", "is TestAS?"]:
+        controller.add_message("user1", {"text": text, "reply_to": None}, callback)
+        time.sleep(0.02)
+
+    assert done.wait(1)
+    time.sleep(0.15)
+    assert calls == [("user1", ["hi", "how much", "is TestAS?"])]
+    assert controller.get_stats()["pending_buffers"] == 0
+
+def test_add_message_does_not_spawn_threads():
+    controller = DebounceMessageController(wait_seconds=5)
+    before = threading.active_count()
+
+    for i in range(200):
+        controller.add_message(f"user{i}", {"text": "hello", "reply_to": None}, lambda uid, msgs: None)
+
+    assert threading.active_count() == before
+    assert controller.get_stats()["pending_buffers"] == 200
+
+def test_scheduler_rearm_and_cancel():
+    scheduler = TimerScheduler(max_workers=1)
+    fired = []
+    done = threading.Event()
+
+    def callback(key):
+        fired.append(key)
+        done.set()
+
+    scheduler.schedule("a", 10, callback, "a")
+    scheduler.schedule("a", 0.05, callback, "a")  # re-arm earlier
+    scheduler.schedule("b", 0.01, callback, "b")
+    assert scheduler.cancel("b")
+
+    assert done.wait(1)
+    assert fired == ["a"]
+    assert scheduler.pending_count() == 0
+    assert scheduler.get_stats()["fired"] == 1
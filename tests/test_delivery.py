@@ -0,0 +1,37 @@
+import threading
+import time
+
+from controller.DeliveryController import DeliveryController
+
+
+def test_sends_keep_order_per_recipient():
+    controller = DeliveryController(max_workers=4)
+    sent = []
+    done = threading.Event()
+
+    def send(psid, payload):
+        sent.append((psid, payload))
+        if len(sent) == 2:
+            done.set()
+
+    controller.schedule_send("user1", 0.1, send, "user1", "text")
+    controller.schedule_send("user1", 0.0, send, "user1", "image")  # must not overtake the text
+
+    assert controller.pending_count("user1") == 2
+    assert done.wait(1)
+    assert sent == [("user1", "text"), ("user1", "image")]
+    assert controller.get_stats()["pending_sends"] == 0
+
+def test_cancel_drops_pending_sends():
+    controller = DeliveryController()
+    sent = []
+
+    controller.schedule_send("user1", 0.05, sent.append, "text")
+    controller.schedule_send("user1", 0.05, sent.append, "image")
+    controller.schedule_send("user2", 0.05, sent.append, "other")
+
+    assert controller.cancel("user1") == 2
+    time.sleep(0.2)
+
+    assert sent == ["other"]
+    assert controller.get_stats()["cancelled"] == 2
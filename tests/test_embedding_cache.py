@@ -0,0 +1,57 @@
+from controller.EmbeddingCacheController import EmbeddingCacheController, normalize_query
+
+MODEL = "models/text-embedding-004"
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 0.5] for text in texts]
+
+
+def test_normalized_questions_share_an_entry():
+    assert normalize_query("  TestAS   là gì ? ") == normalize_query("testas là gì")
+
+    cache = EmbeddingCacheController()
+    cache.put("TestAS là gì?", MODEL, [1.0, 2.0])
+    assert cache.get("testas LÀ GÌ", MODEL) == [1.0, 2.0]
+    assert cache.get("testas là gì", "another-model") is None
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 1
+
+def test_lru_eviction():
+    cache = EmbeddingCacheController(max_entries=2)
+    cache.put("a", MODEL, [1.0])
+    cache.put("b", MODEL, [2.0])
+    cache.get("a", MODEL)
+    cache.put("c", MODEL, [3.0])
+
+    assert cache.get("b", MODEL) is None
+    assert cache.get("a", MODEL) == [1.0]
+    assert cache.get("c", MODEL) == [3.0]
+
+def test_get_many_embeds_misses_in_one_call():
+    embed = FakeEmbedder()
+    cache = EmbeddingCacheController()
+    cache.put("cached", MODEL, [9.0, 9.0])
+
+    vectors = cache.get_many(["cached", "new one", "New one?", "other"], MODEL, embed)
+    assert embed.calls == [["new one", "other"]]
+    assert vectors == [[9.0, 9.0], [7.0, 0.5], [7.0, 0.5], [5.0, 0.5]]
+
+    cache.get_many(["new one", "other"], MODEL, embed)
+    assert len(embed.calls) == 1
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "embeddings.db")
+    EmbeddingCacheController(path=path).put("lịch thi TestAS", MODEL, [0.25, -1.5])
+
+    cache = EmbeddingCacheController(path=path)
+    assert cache.get("Lịch thi TestAS?", MODEL) == [0.25, -1.5]
+    assert cache.get_stats()["disk_hits"] == 1
+    # promoted to memory
+    cache.get("lịch thi testas", MODEL)
+    assert cache.get_stats()["hits"] == 1
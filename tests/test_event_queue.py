@@ -0,0 +1,88 @@
+import threading
+import time
+
+from controller.EventQueueController import EventQueueController
+
+
+def test_events_are_processed_by_workers():
+    controller = EventQueueController(max_size=10, num_workers=2)
+    seen = []
+    lock = threading.Lock()
+
+    def handler(value):
+        with lock:
+            seen.append(value)
+
+    for i in range(5):
+        assert controller.submit(handler, i)
+    controller.join()
+
+    assert sorted(seen) == [0, 1, 2, 3, 4]
+    stats = controller.get_stats()
+    assert stats["processed"] == 5
+    assert stats["queue_depth"] == 0
+
+def test_full_queue_drops_event():
+    controller = EventQueueController(max_size=1, num_workers=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocking_handler():
+        started.set()
+        release.wait()
+
+    assert controller.submit(blocking_handler)
+    started.wait(1)
+    assert controller.submit(blocking_handler)  # fills the queue
+    assert not controller.submit(blocking_handler)
+    release.set()
+    controller.join()
+
+    assert controller.get_stats()["dropped"] == 1
+
+def test_handler_errors_are_counted():
+    controller = EventQueueController(max_size=10, num_workers=1)
+
+    def failing_handler():
+        raise ValueError("boom")
+
+    controller.submit(failing_handler)
+    controller.join()
+
+    assert controller.get_stats()["failed"] == 1
+
+def test_events_of_a_key_are_handled_in_order():
+    # room for both keys even when they share a worker
+    controller = EventQueueController(max_size=200, num_workers=4)
+    seen = {"a": [], "b": []}
+
+    def handler(key, value):
+        time.sleep(0.001 * (value % 3))
+        seen[key].append(value)
+
+    for i in range(20):
+        assert controller.submit(handler, "a", i, key="a")
+        assert controller.submit(handler, "b", i, key="b")
+    controller.join()
+
+    assert seen == {"a": list(range(20)), "b": list(range(20))}
+
+def test_jobs_are_queued_all_or_none():
+    controller = EventQueueController(max_size=2, num_workers=1)
+    release = threading.Event()
+    started = threading.Event()
+    seen = []
+
+    def blocking_handler():
+        started.set()
+        release.wait()
+
+    assert controller.submit(blocking_handler)
+    started.wait(1)
+    assert not controller.submit_all([(seen.append, (i,), "user") for i in range(3)])
+    assert controller.submit_all([(seen.append, (i,), "user") for i in range(2)])
+    release.set()
+    controller.join()
+
+    assert seen == [0, 1]
+    assert controller.get_stats()["dropped"] == 3
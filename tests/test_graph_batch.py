@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from api import meta as meta_api
+from api.graph_batch import GraphBatchCoalescer
+from api.http_client import GraphHttpClient
+
+
+@pytest.fixture
+def coalescer(fake_graph, monkeypatch):
+    coalescer = GraphBatchCoalescer(window=0.05, max_batch=50, client=GraphHttpClient(max_retries=0))
+    monkeypatch.setattr(meta_api, "graph_batch", coalescer)
+    monkeypatch.setattr(meta_api, "GRAPH_BATCH_WINDOW", 0.05)
+    monkeypatch.setitem(meta_api.FACEBOOK_URL, "base", f"{fake_graph.url}/fb")
+    monkeypatch.setattr(meta_api, "PAGE_ACCESS_TOKEN", "page-token")
+    return coalescer
+
+def test_concurrent_reads_share_one_batch(fake_graph, coalescer):
+    fake_graph.labels["user1"] = ["label_1"]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        messages = pool.map(meta_api.get_message_by_id, ["m_1", "m_2", "m_3"])
+        labels = pool.submit(meta_api.get_labels_of_conversation, "user1")
+        messages = list(messages)
+
+    assert messages == ["text of m_1", "text of m_2", "text of m_3"]
+    assert labels.result() == ["label_1"]
+    assert len(fake_graph.batches) == 1
+    assert len(fake_graph.batches[0]) == 4
+    assert coalescer.get_stats()["round_trips_saved"] == 3
+
+def test_full_batch_is_flushed_immediately(fake_graph):
+    coalescer = GraphBatchCoalescer(window=10, max_batch=2, client=GraphHttpClient(max_retries=0))
+    base_url = f"{fake_graph.url}/fb"
+
+    first = coalescer.submit(base_url, "token", "GET", "m_1?fields=message")
+    second = coalescer.submit(base_url, "token", "GET", "m_2?fields=message")
+
+    assert first.result(timeout=1) == (200, {"id": "m_1", "message": "text of m_1"})
+    assert second.result(timeout=1)[1]["message"] == "text of m_2"
+
+def test_concurrent_submits_never_exceed_the_batch_limit(fake_graph):
+    coalescer = GraphBatchCoalescer(window=0.05, max_batch=50, client=GraphHttpClient(max_retries=0))
+    base_url = f"{fake_graph.url}/fb"
+    cancel = coalescer.scheduler.cancel
+
+    def slow_cancel(key):
+        # widens the gap between a full group and its flush
+        time.sleep(0.01)
+        return cancel(key)
+
+    coalescer.scheduler.cancel = slow_cancel
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = list(pool.map(
+            lambda i: coalescer.submit(base_url, "token", "GET", f"m_{i}?fields=message"), range(500)
+        ))
+    results = [future.result(timeout=5) for future in futures]
+
+    assert all(code == 200 for code, _ in results)
+    assert max(len(batch) for batch in fake_graph.batches) <= 50
+    assert sum(len(batch) for batch in fake_graph.batches) == 500
+
+def test_instagram_calls_are_not_batched(fake_graph, coalescer, monkeypatch):
+    monkeypatch.setitem(meta_api.INSTA_URL, "base", f"{fake_graph.url}/ig")
+    monkeypatch.setitem(meta_api.INSTA_URL, "typing", f"{fake_graph.url}/fb/me/messages")
+    instagram = meta_api.MESSAGE_OBJECT_TYPE["instagram"]
+
+    assert meta_api.get_message_by_id("m_1", instagram) == "text of m_1"
+    meta_api.send_typing_indicator("user1", instagram)
+
+    assert fake_graph.batches == []
+    assert [path for path, _ in fake_graph.requests] == ["/ig/m_1", "/fb/me/messages"]
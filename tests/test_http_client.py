@@ -0,0 +1,70 @@
+import json
+
+from api.http_client import GraphHttpClient
+
+
+def _client():
+    return GraphHttpClient(max_retries=2, backoff_factor=0.01, max_backoff=1)
+
+def test_get_is_retried_on_server_error(fake_graph):
+    fake_graph.queued_responses = [(500, {"error": {"message": "oops"}}, {})]
+    fake_graph.add_conversation("t_1", "page", "user1")
+
+    response = _client().get(f"{fake_graph.url}/v22.0/me/conversations")
+
+    assert response.ok
+    assert len(fake_graph.requests) == 2
+
+def test_post_is_not_retried_on_server_error(fake_graph):
+    fake_graph.queued_responses = [(500, {"error": {"message": "oops"}}, {})]
+
+    response = _client().post(f"{fake_graph.url}/v22.0/me/messages", json={})
+
+    assert response.status_code == 500
+    assert len(fake_graph.requests) == 1
+
+def test_post_is_not_retried_after_server_error_with_retry_after(fake_graph):
+    fake_graph.queued_responses = [(503, {"error": {"message": "unavailable"}}, {"Retry-After": "0"})]
+
+    response = _client().post(f"{fake_graph.url}/v22.0/me/messages", json={})
+
+    assert response.status_code == 503
+    assert len(fake_graph.requests) == 1
+
+def test_retry_after_is_only_honored_when_throttled(fake_graph):
+    client = _client()
+    fake_graph.queued_responses = [(503, {"error": {"message": "unavailable"}}, {"Retry-After": "3600"})]
+
+    # a server error of a GET is retried with backoff, whatever Retry-After says
+    assert client.get(f"{fake_graph.url}/v22.0/me/conversations").ok
+    assert len(fake_graph.requests) == 2
+
+def test_throttled_post_is_retried(fake_graph):
+    usage = json.dumps({"123": [{"type": "messenger", "estimated_time_to_regain_access": 0}]})
+    fake_graph.queued_responses = [
+        (400, {"error": {"code": 613, "message": "Calls to this api have exceeded the rate limit."}},
+         {"X-Business-Use-Case-Usage": usage}),
+    ]
+
+    response = _client().post(f"{fake_graph.url}/v22.0/me/conversations", json={})
+
+    assert response.ok
+    assert len(fake_graph.requests) == 2
+
+def test_long_throttle_is_not_waited_for(fake_graph):
+    fake_graph.queued_responses = [(429, {"error": {"code": 4}}, {"Retry-After": "3600"})]
+
+    response = _client().get(f"{fake_graph.url}/v22.0/me/conversations")
+
+    assert response.status_code == 429
+    assert len(fake_graph.requests) == 1
+
+def test_stats_are_kept_per_endpoint(fake_graph):
+    client = _client()
+    fake_graph.messages["t_1"] = []
+    client.get(f"{fake_graph.url}/v22.0/t_1/messages")
+    client.get(f"{fake_graph.url}/v22.0/t_2/messages")
+
+    stats = client.get_stats()
+    assert stats["GET /{id}/messages"]["calls"] == 2
+    assert stats["GET /{id}/messages"]["errors"] == 0
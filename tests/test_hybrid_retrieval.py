@@ -0,0 +1,100 @@
+import pytest
+
+from controller import ContextController as context_module
+from controller.ContextController import ContextController
+from controller.LexicalIndexController import LexicalIndexController, tokenize
+from utils.ranking import maximal_marginal_relevance, reciprocal_rank_fusion
+
+DOCUMENTS = {
+    "fee": "Die Gebühr für den TestAS beträgt 105 Euro.",
+    "core": "TestAS Core là phần thi bắt buộc cho mọi thí sinh.",
+    "date": "The next TestAS exam date is 14 March 2025.",
+    "visa": "Students need a visa to study in Germany.",
+    "visa2": "A student visa is needed to study in Germany.",
+}
+
+
+def test_tokens_ignore_case_and_diacritics():
+    assert tokenize("Học phí TestAS, Prüfung!") == ["hoc", "phi", "testas", "prufung"]
+    assert tokenize("Đăng ký") == ["dang", "ky"]
+
+def test_bm25_ranks_exact_terms():
+    index = LexicalIndexController()
+    index.add(list(DOCUMENTS), list(DOCUMENTS.values()))
+    assert index.search("testas core", 1)[0][0] == "core"
+    assert index.search("14 march", 1)[0][0] == "date"
+    assert index.search("hoc phi") == []
+
+    index.delete(["core"])
+    assert "core" not in [id_ for id_, _ in index.search("testas core")]
+    index.add(["core"], ["TestAS Core v2"])
+    assert index.search("core", 1)[0][0] == "core"
+    index.build(["visa"], [DOCUMENTS["visa"]])
+    assert len(index) == 1 and index.built_at is not None
+
+def test_fusion_and_diversification():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]])
+    assert [id_ for id_, _ in fused] == ["c", "a", "b", "d"]
+
+    embeddings = [[1.0, 0.0], [0.99, 0.1], [0.0, 1.0]]
+    assert maximal_marginal_relevance([1.0, 0.9, 0.5], embeddings, 2, diversity=0.0) == [0, 1]
+    assert maximal_marginal_relevance([1.0, 0.9, 0.5], embeddings, 2, diversity=0.5) == [0, 2]
+
+
+@pytest.fixture
+def make_controller(tmp_path, monkeypatch):
+    monkeypatch.setattr(context_module.genai, "Client", lambda **kwargs: None)
+
+    def embed(texts):
+        # only "visa" documents and questions are close in this embedding
+        return [[1.0, 0.1 * i] if "visa" in text.lower() else [0.0, 1.0 + 0.1 * i] for i, text in enumerate(texts)]
+
+    def make(**kwargs):
+        controller = ContextController(path=str(tmp_path), collection_name="docs", backend="local", **kwargs)
+        controller._embed = embed
+        return controller
+    return make
+
+def test_hybrid_query_finds_exact_terms_missed_by_vectors(make_controller):
+    writer = make_controller(lexical_index=LexicalIndexController())
+    writer.add_documents(list(DOCUMENTS.values()), [{"source_url": id_} for id_ in DOCUMENTS])
+
+    dense = make_controller(n_candidates=2)
+    assert "TestAS Core" not in " ".join(dense.query_similarity("visa TestAS Core", n_results=2))
+
+    # another worker builds its lexical index from the collection
+    hybrid = make_controller(lexical_index=LexicalIndexController(), n_candidates=2)
+    chunks = hybrid.query_chunks("visa TestAS Core", n_results=3)
+    assert len(chunks) == 3
+    assert "core" in [chunk["metadata"]["source_url"] for chunk in chunks]
+    assert len(hybrid.query_similarity("visa", n_results=1)) == 1
+
+def test_mmr_skips_near_duplicate_chunks(make_controller):
+    controller = make_controller()
+    controller.add_documents(list(DOCUMENTS.values()), [{"source_url": id_} for id_ in DOCUMENTS])
+
+    similar = [chunk["metadata"]["source_url"] for chunk in controller.query_chunks("visa Germany", 2)]
+    assert sorted(similar) == ["visa", "visa2"]
+    controller.mmr_diversity = 0.7
+    diverse = [chunk["metadata"]["source_url"] for chunk in controller.query_chunks("visa Germany", 2)]
+    assert diverse[0] in ("visa", "visa2") and diverse[1] not in ("visa", "visa2")
+
+def test_query_many_embeds_and_searches_once(make_controller):
+    controller = make_controller(lexical_index=LexicalIndexController())
+    controller.add_documents(list(DOCUMENTS.values()), [{"source_url": id_} for id_ in DOCUMENTS])
+    embedded, searches = [], []
+    embed, query = controller._embed, controller.collection.query
+    controller._embed = lambda texts: embedded.append(texts) or embed(texts)
+    controller.collection.query = lambda **kwargs: searches.append(kwargs) or query(**kwargs)
+
+    chunks = controller.query_many(["student visa", "TestAS Core", "visa Germany"], n_results=2)
+    assert embedded == [["student visa", "TestAS Core", "visa Germany"]]
+    assert len(searches) == 1 and len(searches[0]["query_embeddings"]) == 3
+
+    ids = [chunk["id"] for chunk in chunks]
+    assert len(ids) == len(set(ids))
+    by_source = {chunk["metadata"]["source_url"]: chunk["queries"] for chunk in chunks}
+    assert by_source["core"][0] == 1
+    # found by both visa questions, listed once
+    assert {0, 2} <= set(by_source["visa"])
+    assert controller.query_many([]) == []
@@ -0,0 +1,199 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+
+from controller.IngestionController import JOB_DONE, JOB_FAILED, IngestionController, IngestionJob, chunk_hash
+from script.RAG import iter_chunks
+
+
+def make_chunks(n, url="https://testas.de/a"):
+    return [{"source_url": url, "title": "t", "content": f"chunk {i}", "chunk_id": f"{url}-{i}"} for i in range(n)]
+
+class FakeStore:
+    def __init__(self):
+        self.records = {}
+        self.lock = threading.Lock()
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        with self.lock:
+            for id_, document, embedding, metadata in zip(ids, documents, embeddings, metadatas):
+                self.records[id_] = (document, embedding, metadata)
+
+def embed(texts):
+    return [[float(len(text))] for text in texts]
+
+def wait(controller, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = controller.get_job(job_id)
+        if job["status"] in (JOB_DONE, JOB_FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_chunk_ids_are_stable_content_hashes():
+    a, b = make_chunks(2)
+    assert chunk_hash(a) == chunk_hash(dict(a, title="other")) != chunk_hash(b)
+
+def test_job_upserts_every_chunk_with_concurrent_batches(tmp_path):
+    store, in_flight, peak = FakeStore(), [0], [0]
+    lock = threading.Lock()
+
+    def slow_embed(texts):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        return embed(texts)
+
+    completed = []
+    controller = IngestionController(
+        slow_embed, store.upsert, str(tmp_path), batch_size=10, max_workers=3, on_complete=completed.append
+    )
+    chunks = make_chunks(95)
+    job = wait(controller, controller.submit(chunks + chunks[:5]))
+
+    assert job["status"] == JOB_DONE
+    assert (job["added"], job["skipped"], job["failed"]) == (95, 5, 0)
+    assert job["chunks_per_second"] > 0
+    assert len(store.records) == 95
+    document, embedding, metadata = store.records[chunk_hash(chunks[3])]
+    assert document == "chunk 3" and embedding == [7.0]
+    assert metadata["chunk_id"] == chunks[3]["chunk_id"]
+    assert metadata["content_hash"] == chunk_hash(chunks[3])
+    assert peak[0] == 3
+    deadline = time.monotonic() + 2
+    while not completed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [j.id for j in completed] == [job["job_id"]]
+
+def test_failed_embeddings_are_retried_and_batches_stay_aligned():
+    store, calls = FakeStore(), {}
+
+    def flaky_embed(texts):
+        calls[texts[0]] = calls.get(texts[0], 0) + 1
+        if texts[0] == "chunk 0" and calls[texts[0]] == 1:
+            raise RuntimeError("429")
+        if texts[0] == "chunk 4":
+            raise RuntimeError("400")
+        return embed(texts)
+
+    controller = IngestionController(flaky_embed, store.upsert, batch_size=2, max_retries=1, backoff=0)
+    job = wait(controller, controller.submit(make_chunks(6)))
+
+    assert job["status"] == JOB_FAILED
+    assert (job["added"], job["failed"]) == (4, 2)
+    assert calls["chunk 0"] == 2
+    assert calls["chunk 4"] == 2
+    assert {document for document, _, _ in store.records.values()} == {"chunk 0", "chunk 1", "chunk 2", "chunk 3"}
+    assert controller.get_stats()["embed_retries"] == 2
+
+def test_unfinished_job_resumes_from_its_checkpoint(tmp_path):
+    chunks = make_chunks(6)
+    # a job interrupted after its first batch
+    crashed = IngestionController(embed, FakeStore().upsert, str(tmp_path), batch_size=2)
+    job = IngestionJob("job1", len(chunks))
+    job.status = "running"
+    crashed._write_job(job, chunks)
+    crashed._mark_done("job1", [chunk_hash(chunk) for chunk in chunks[:2]])
+
+    store = FakeStore()
+    restarted = IngestionController(embed, store.upsert, str(tmp_path), batch_size=2)
+    assert restarted.resume() == ["job1"]
+    job = wait(restarted, "job1")
+
+    assert (job["status"], job["unchanged"], job["added"]) == (JOB_DONE, 2, 4)
+    assert len(store.records) == 4
+    # finished jobs are not resumed again
+    assert IngestionController(embed, store.upsert, str(tmp_path)).resume() == []
+
+def test_progress_is_readable_from_another_worker(tmp_path):
+    controller = IngestionController(embed, FakeStore().upsert, str(tmp_path), batch_size=2)
+    job_id = controller.submit(make_chunks(5))
+    wait(controller, job_id)
+
+    other_worker = IngestionController(embed, FakeStore().upsert, str(tmp_path))
+    job = other_worker.get_job(job_id)
+    assert (job["status"], job["added"], job["total"]) == (JOB_DONE, 5, 5)
+    assert other_worker.get_job("missing") is None
+
+def test_reindexing_embeds_only_the_diff(tmp_path):
+    from controller.VectorStore import LocalVectorStore
+
+    store = LocalVectorStore(str(tmp_path / "index"), "docs")
+    embedded = []
+
+    def counting_embed(texts):
+        embedded.extend(texts)
+        return [[1.0, float(len(text))] for text in texts]
+
+    def get_indexed(source_urls):
+        results = store.get(where={"source_url": {"$in": source_urls}}, include=["metadatas"])
+        return dict(zip(results["ids"], results["metadatas"]))
+
+    def make_controller(model_name="model-a"):
+        return IngestionController(
+            counting_embed, store.upsert, model_name=model_name,
+            get_indexed=get_indexed, delete=lambda ids: store.delete(ids=ids),
+        )
+
+    page_a, page_b, page_c = make_chunks(3, "a"), make_chunks(2, "b"), make_chunks(2, "c")
+    controller = make_controller()
+    job = wait(controller, controller.submit(page_a + page_b + page_c))
+    assert (job["added"], job["unchanged"], job["removed"]) == (7, 0, 0)
+
+    # page a: chunk 1 changed, chunk 2 gone; page b unchanged; page c not re-uploaded
+    embedded.clear()
+    recrawl = [page_a[0], dict(page_a[1], content="chunk 1 v2")] + page_b
+    job = wait(controller, controller.submit(recrawl))
+    assert (job["added"], job["unchanged"], job["removed"]) == (1, 3, 2)
+    assert embedded == ["chunk 1 v2"]
+    assert sorted(store.get(where={"source_url": "a"})["documents"]) == ["chunk 0", "chunk 1 v2"]
+    assert store.count() == 6
+
+    # the same upload again costs nothing, a new embedding model re-embeds
+    embedded.clear()
+    assert wait(controller, controller.submit(recrawl))["unchanged"] == 4
+    assert embedded == []
+    other_model = make_controller("model-b")
+    assert wait(other_model, other_model.submit(recrawl))["added"] == 4
+
+def test_uploads_are_streamed_in_bounded_batches(tmp_path):
+    documents = [{"url": f"https://testas.de/{i}", "title": "t", "body": f"page {i}"} for i in range(100)]
+    read, release = [], threading.Event()
+
+    def chunker(docs):
+        for chunk in iter_chunks(docs):
+            read.append(chunk)
+            yield chunk
+
+    def blocked_embed(texts):
+        release.wait(5)
+        return embed(texts)
+
+    store = FakeStore()
+    controller = IngestionController(
+        blocked_embed, store.upsert, str(tmp_path), chunker=chunker, batch_size=2, max_workers=1
+    )
+    job_id = controller.submit_documents(io.BytesIO(json.dumps(documents).encode()))
+    time.sleep(0.2)
+    # 2 batches in flight, at most one more read and planned
+    assert len(read) <= 8
+    release.set()
+
+    job = wait(controller, job_id)
+    assert (job["status"], job["total"], job["added"]) == (JOB_DONE, 100, 100)
+    assert len(store.records) == 100
+    assert not (tmp_path / f"{job_id}.documents").exists()
+
+def test_upload_that_is_not_an_array_is_rejected(tmp_path):
+    controller = IngestionController(embed, FakeStore().upsert, str(tmp_path))
+    with pytest.raises(ValueError):
+        controller.submit_documents(io.BytesIO(b'{"url": "x"}'))
+    assert list(tmp_path.iterdir()) == []
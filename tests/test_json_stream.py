@@ -0,0 +1,42 @@
+import io
+import json
+
+import pytest
+
+from utils.json_stream import batched, iter_json_array
+
+ITEMS = [
+    {"url": "https://testas.de", "title": "TestAS", "body": "Kỳ thi TestAS 😊 " * 40},
+    123,
+    -2.25e-5,
+    "text",
+    [1, [2]],
+    None,
+    True,
+    {"nested": {"list": []}},
+    7,
+]
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 4096])
+def test_items_are_read_across_arbitrary_reads(read_size):
+    raw = json.dumps(ITEMS, ensure_ascii=False)
+    assert list(iter_json_array(io.StringIO(raw), read_size)) == ITEMS
+    # binary upload with a BOM, characters cut between reads
+    assert list(iter_json_array(io.BytesIO(raw.encode("utf-8-sig")), read_size)) == ITEMS
+
+def test_items_are_yielded_lazily():
+    items = iter_json_array(io.StringIO('[{"a": 1}, {"b": 2}, oops]'), 4)
+    assert next(items) == {"a": 1}
+    assert next(items) == {"b": 2}
+    with pytest.raises(ValueError):
+        next(items)
+
+@pytest.mark.parametrize("raw", ['{"a": 1}', "", "[1 2]", "[1,", "[1,]", "[1.x]"])
+def test_malformed_arrays_raise(raw):
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO(raw), 2))
+
+def test_empty_array_and_batches():
+    assert list(iter_json_array(io.StringIO(" [ ]\n"))) == []
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from api import meta as meta_api
+from api import meta_async
+
+
+@pytest.fixture
+def graph(fake_graph, monkeypatch):
+    monkeypatch.setitem(meta_api.FACEBOOK_URL, "base", f"{fake_graph.url}/fb")
+    monkeypatch.setitem(meta_api.FACEBOOK_URL, "conversation_message", f"{fake_graph.url}/fb/me/conversations")
+    monkeypatch.setitem(meta_api.FACEBOOK_URL, "message", f"{fake_graph.url}/fb/me/messages")
+    monkeypatch.setattr(meta_api, "PAGE_ACCESS_TOKEN", "page-token")
+    monkeypatch.setattr(meta_async.graph_client, "backoff_factor", 0)
+    return fake_graph
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await meta_async.close_client()
+    return asyncio.run(main())
+
+def test_lookup_follows_pages(graph):
+    graph.supports_user_id_filter = False
+    graph.page_size = 10
+    for i in range(30):
+        graph.add_conversation(f"t_{i}", "page", f"user{i}")
+
+    assert run(meta_async.get_conversation_id_by_user_id("user15")) == "t_15"
+    assert len(graph.requests) == 2
+
+def test_label_and_history_run_concurrently(graph):
+    graph.labels["user1"] = ["label_a"]
+    graph.messages["t_1"] = [
+        {"id": "m2", "message": "second", "from": {"id": "page"}},
+        {"id": "m1", "message": "first", "from": {"id": "user1"}},
+    ]
+
+    async def both():
+        return await asyncio.gather(
+            meta_async.get_labels_of_conversation("user1"),
+            meta_async.get_conversation_messages("t_1"),
+        )
+
+    labels, messages = run(both())
+    assert labels == ["label_a"]
+    assert messages == [("user1", "first"), ("page", "second")]
+
+def test_get_is_retried_on_server_error(graph):
+    graph.queued_responses.append((500, {"error": {"message": "boom"}}, {}))
+
+    assert run(meta_async.get_message_by_id("m_1")) == "text of m_1"
+    assert len(graph.requests) == 2
+
+def test_send_is_not_retried_on_server_error(graph):
+    graph.queued_responses.append((500, {"error": {"message": "boom"}}, {}))
+
+    run(meta_async.send_meta_message("user1", "hello"))
+    assert len(graph.requests) == 1
+
+def test_send_is_not_retried_after_server_error_with_retry_after(graph):
+    graph.queued_responses.append((503, {"error": {"message": "unavailable"}}, {"Retry-After": "0"}))
+
+    run(meta_async.send_meta_message("user1", "hello"))
+    assert len(graph.requests) == 1
+
+def test_throttled_send_is_retried(graph):
+    graph.queued_responses.append((429, {"error": {"code": 4}}, {"Retry-After": "0"}))
+
+    run(meta_async.send_meta_message("user1", "hello"))
+    assert len(graph.requests) == 2
+
+def test_instagram_typing_uses_the_typing_endpoint(graph, monkeypatch):
+    monkeypatch.setitem(meta_api.INSTA_URL, "message", f"{graph.url}/ig/me/messages")
+    monkeypatch.setitem(meta_api.INSTA_URL, "typing", f"{graph.url}/fb/me/messages")
+
+    run(meta_async.send_typing_indicator("user1", meta_api.MESSAGE_OBJECT_TYPE["instagram"]))
+    assert [path for path, _ in graph.requests] == ["/fb/me/messages"]
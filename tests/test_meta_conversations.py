@@ -0,0 +1,63 @@
+import pytest
+
+from api import meta as meta_api
+
+
+@pytest.fixture
+def graph(fake_graph, monkeypatch):
+    monkeypatch.setitem(meta_api.FACEBOOK_URL, "base", f"{fake_graph.url}/fb")
+    monkeypatch.setitem(meta_api.FACEBOOK_URL, "conversation_message", f"{fake_graph.url}/fb/me/conversations")
+    monkeypatch.setitem(meta_api.INSTA_URL, "base", f"{fake_graph.url}/ig")
+    monkeypatch.setitem(meta_api.INSTA_URL, "conversation_message", f"{fake_graph.url}/ig/me/conversations")
+    monkeypatch.setattr(meta_api, "PAGE_ACCESS_TOKEN", "page-token")
+    monkeypatch.setattr(meta_api, "INSTA_ACCESS_TOKEN", "insta-token")
+    return fake_graph
+
+def test_lookup_uses_user_id_filter(graph):
+    for i in range(300):
+        graph.add_conversation(f"t_{i}", "page", f"user{i}")
+
+    assert meta_api.get_conversation_id_by_user_id("user250") == "t_250"
+    assert len(graph.requests) == 1
+    path, query = graph.requests[0]
+    assert query["user_id"] == "user250"
+    assert query["fields"] == "participants"
+
+def test_lookup_follows_pages_and_stops_early(graph):
+    graph.supports_user_id_filter = False
+    graph.page_size = 10
+    for i in range(100):
+        graph.add_conversation(f"t_{i}", "page", f"user{i}")
+
+    assert meta_api.get_conversation_id_by_user_id("user25") == "t_25"
+    # 3 pages of 10, never the remaining 7
+    assert len(graph.requests) == 3
+
+def test_lookup_missing_user(graph):
+    graph.supports_user_id_filter = False
+    graph.page_size = 10
+    for i in range(25):
+        graph.add_conversation(f"t_{i}", "page", f"user{i}")
+
+    assert meta_api.get_conversation_id_by_user_id("nobody") is None
+    assert len(graph.requests) == 3
+
+def test_instagram_lookup_uses_instagram_endpoint_and_token(graph):
+    graph.add_conversation("ig_1", "insta", "iguser")
+
+    assert meta_api.get_conversation_id_by_user_id("iguser", "instagram") == "ig_1"
+    path, query = graph.requests[0]
+    assert path == "/ig/me/conversations"
+    assert query["access_token"] == "insta-token"
+    assert query["platform"] == "instagram"
+
+def test_conversation_messages_oldest_first(graph):
+    graph.messages["t_1"] = [
+        {"id": "m3", "message": "third", "from": {"id": "page"}},
+        {"id": "m2", "message": "second", "from": {"id": "user1"}},
+        {"id": "m1", "message": "first", "from": {"id": "user1"}},
+    ]
+
+    assert meta_api.get_conversation_messages("t_1", limit=10) == [
+        ("user1", "first"), ("user1", "second"), ("page", "third"),
+    ]
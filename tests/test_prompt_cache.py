@@ -0,0 +1,155 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from controller.PromptCacheController import PromptCacheController
+
+
+class FakeCaches:
+    """
+    Offline stand-in for `client.caches`.
+    """
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.live = {}
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    def create(self, model, config):
+        if self.fail:
+            raise RuntimeError("Cached content is too small")
+        name = f"cachedContents/{len(self.created)}"
+        self.created.append((model, config))
+        self.live[name] = config
+        return SimpleNamespace(name=name)
+
+    def update(self, name, config):
+        if name not in self.live:
+            raise RuntimeError("not found")
+        self.updated.append((name, config))
+
+    def delete(self, name):
+        self.live.pop(name, None)
+        self.deleted.append(name)
+
+
+def make_controller(fail=False, **kwargs):
+    client = SimpleNamespace(caches=FakeCaches(fail))
+    return PromptCacheController(client, ttl=kwargs.pop("ttl", 3600), model="gemini-test", **kwargs), client.caches
+
+def usage(prompt, cached):
+    return SimpleNamespace(usage_metadata=SimpleNamespace(prompt_token_count=prompt, cached_content_token_count=cached))
+
+def test_instruction_and_tools_replaced_by_one_cache():
+    controller, caches = make_controller()
+    config = {"system_instruction": "long prompt", "temperature": 0.0}
+    tools = [{"function_declarations": [{"name": "retrieve"}]}]
+
+    first = controller.apply(config, tools)
+    second = controller.apply(config, tools)
+    assert first == second == {"temperature": 0.0, "cached_content": "cachedContents/0"}
+    assert len(caches.created) == 1
+    model, cache_config = caches.created[0]
+    assert model == "gemini-test"
+    assert cache_config["system_instruction"] == "long prompt"
+    assert cache_config["tools"] == tools
+    assert cache_config["ttl"] == "3600s"
+    # caller's config untouched
+    assert config == {"system_instruction": "long prompt", "temperature": 0.0}
+
+def test_changed_instruction_gets_a_new_cache():
+    controller, caches = make_controller()
+    controller.apply({"system_instruction": "v1"})
+    assert controller.apply({"system_instruction": "v2"})["cached_content"] == "cachedContents/1"
+    assert caches.deleted == ["cachedContents/0"]
+    assert list(caches.live) == ["cachedContents/1"]
+
+def test_ttl_is_refreshed_before_expiry():
+    controller, caches = make_controller(ttl=1, refresh_margin=0.9)
+    controller.apply({"system_instruction": "prompt"})
+    time.sleep(0.2)
+
+    assert controller.apply({"system_instruction": "prompt"})["cached_content"] == "cachedContents/0"
+    assert caches.updated == [("cachedContents/0", {"ttl": "1s"})]
+    assert len(caches.created) == 1
+
+def test_cache_failing_to_refresh_is_deleted_when_replaced():
+    controller, caches = make_controller(ttl=1, refresh_margin=0.9)
+    controller.apply({"system_instruction": "prompt"})
+    time.sleep(0.2)
+
+    def failing_update(name, config):
+        raise RuntimeError("unavailable")
+
+    caches.update = failing_update
+
+    assert controller.apply({"system_instruction": "prompt"})["cached_content"] == "cachedContents/1"
+    assert caches.deleted == ["cachedContents/0"]
+    assert list(caches.live) == ["cachedContents/1"]
+
+def test_failed_create_falls_back_and_backs_off():
+    controller, caches = make_controller(fail=True)
+    config = controller.apply({"system_instruction": "short"}, tools=["tool"])
+    assert config == {"system_instruction": "short", "tools": ["tool"]}
+    controller.apply({"system_instruction": "short"}, tools=["tool"])
+    assert controller.get_stats()["errors"] == 1
+
+def test_disabled_keeps_the_prompt_inline():
+    controller, caches = make_controller(ttl=0)
+    assert controller.apply({"system_instruction": "prompt"}) == {"system_instruction": "prompt"}
+    assert caches.created == []
+
+def test_token_accounting():
+    controller, _ = make_controller()
+    controller.record_usage(usage(5000, 4800))
+    controller.record_usage(usage(300, None))
+    controller.record_usage(SimpleNamespace())
+
+    stats = controller.get_stats()
+    assert stats["turns"] == 2
+    assert stats["cached_turns"] == 1
+    assert stats["cached_tokens"] == 4800
+    assert stats["avg_cached_tokens_per_turn"] == 2400
+    assert stats["cached_token_ratio"] == pytest.approx(4800 / 5300)
+
+def test_tool_and_answer_variants_share_an_instruction():
+    controller, caches = make_controller()
+    config = {"system_instruction": "prompt"}
+    with_tools = controller.apply(config, tools=["tool"])["cached_content"]
+    without_tools = controller.apply(config)["cached_content"]
+
+    assert with_tools != without_tools
+    assert caches.deleted == []
+    assert controller.apply(config, tools=["tool"])["cached_content"] == with_tools
+    controller.apply({"system_instruction": "v2"})
+    assert sorted(caches.deleted) == sorted([with_tools, without_tools])
+
+def test_one_thread_creates_outside_the_lock():
+    controller, caches = make_controller()
+    started, release = threading.Event(), threading.Event()
+    create = caches.create
+
+    def slow_create(model, config):
+        # other threads can take the lock meanwhile
+        assert not controller.lock.locked()
+        started.set()
+        release.wait(1)
+        return create(model, config)
+
+    caches.create = slow_create
+    names = []
+    threads = [threading.Thread(target=lambda: names.append(controller.get_cache_name("prompt"))) for _ in range(4)]
+    threads[0].start()
+    started.wait(1)
+    for thread in threads[1:]:
+        thread.start()
+    assert controller.get_stats()["created"] == 0
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert names == ["cachedContents/0"] * 4
+    assert len(caches.created) == 1
@@ -0,0 +1,81 @@
+import time
+
+from controller.ResponseCacheController import FOLLOW_UP_WINDOW, ResponseCacheController
+from controller.StateBackend import SQLiteStateBackend
+
+VECTORS = {
+    "testas là gì?": [1.0, 0.0, 0.0],
+    "testas là cái gì?": [0.99, 0.05, 0.0],
+    "lệ phí thi bao nhiêu?": [0.0, 1.0, 0.0],
+}
+
+
+def embed(text):
+    return VECTORS[text.lower()]
+
+def make_cache(**kwargs):
+    return ResponseCacheController(embed, threshold=kwargs.pop("threshold", 0.95), ttl=kwargs.pop("ttl", 60), **kwargs)
+
+def test_near_duplicate_question_hits():
+    cache = make_cache()
+    answer, generation = cache.lookup("TestAS là gì?")
+    assert answer is None
+    cache.store("TestAS là gì?", {"message": "TestAS is..."}, generation)
+
+    assert cache.lookup("TestAS là cái gì?")[0] == {"message": "TestAS is..."}
+    assert cache.lookup("Lệ phí thi bao nhiêu?")[0] is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 2, 1)
+
+def test_only_standalone_questions_are_cacheable():
+    cache = make_cache()
+    assert cache.is_cacheable("TestAS là gì?")
+    assert cache.is_cacheable("when is the next exam")
+    assert not cache.is_cacheable("TestAS là gì?", reply_context="earlier bot message")
+    assert not cache.is_cacheable("ok cảm ơn bạn")
+    assert not cache.is_cacheable("số zalo của mình là 0912345678, gọi khi nào?")
+    assert not make_cache(ttl=0).is_cacheable("TestAS là gì?")
+    assert cache.get_stats()["skipped"] == 3
+
+def test_invalidate_drops_answers_and_stale_stores():
+    cache = make_cache()
+    _, generation = cache.lookup("TestAS là gì?")
+    cache.store("TestAS là gì?", {"message": "old"}, generation)
+    _, stale_generation = cache.lookup("Lệ phí thi bao nhiêu?")
+
+    cache.invalidate("knowledge base updated")
+    assert cache.lookup("TestAS là gì?")[0] is None
+    # computed before the invalidation, not stored
+    cache.store("Lệ phí thi bao nhiêu?", {"message": "old fee"}, stale_generation)
+    assert cache.get_stats()["entries"] == 0
+
+def test_answers_expire():
+    cache = make_cache(ttl=0.05)
+    _, generation = cache.lookup("TestAS là gì?")
+    cache.store("TestAS là gì?", {"message": "TestAS is..."}, generation)
+    time.sleep(0.1)
+
+    assert cache.lookup("TestAS là gì?")[0] is None
+    assert cache.get_stats()["entries"] == 0
+
+def test_follow_ups_are_not_cacheable():
+    cache = make_cache()
+    assert not cache.is_cacheable("còn phí thì sao?")
+    assert not cache.is_cacheable("cái đó bao nhiêu?")
+    assert not cache.is_cacheable("how much does it cost?")
+    # a turn of the user shortly before
+    assert not cache.is_cacheable("TestAS là gì?", last_turn_at=time.time() - 60)
+    assert cache.is_cacheable("TestAS là gì?", last_turn_at=time.time() - 2 * FOLLOW_UP_WINDOW)
+
+def test_invalidation_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    first = make_cache(state_backend=SQLiteStateBackend(path))
+    second = make_cache(state_backend=SQLiteStateBackend(path))
+    _, generation = second.lookup("TestAS là gì?")
+    second.store("TestAS là gì?", {"message": "old"}, generation)
+    _, stale_generation = second.lookup("Lệ phí thi bao nhiêu?")
+
+    first.invalidate("knowledge base updated")
+    assert second.lookup("TestAS là gì?")[0] is None
+    second.store("Lệ phí thi bao nhiêu?", {"message": "old fee"}, stale_generation)
+    assert second.get_stats()["entries"] == 0
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+from controller.SpeculativeRetrievalController import PRE_INJECT, SPECULATE, SpeculativeRetrievalController
+from controller.ToolController import ToolController
+
+
+def make_controller(**kwargs):
+    queries = []
+
+    def retrieve(query):
+        queries.append(query)
+        time.sleep(0.05)
+        return {"documents": [f"doc for {query}"]}
+
+    return SpeculativeRetrievalController(retrieve, **kwargs), queries
+
+def test_classifies_messages():
+    controller, _ = make_controller()
+    assert controller.classify("Chào shop") is None
+    assert controller.classify("Cho mình hỏi về TestAS") == SPECULATE
+    assert controller.classify("Học phí TestAS là bao nhiêu?") == PRE_INJECT
+    assert make_controller(pre_inject=False)[0].classify("Học phí TestAS là bao nhiêu?") == SPECULATE
+    assert make_controller(enabled=False)[0].classify("Học phí TestAS là bao nhiêu?") is None
+    assert controller.get_stats()["skipped"] == 1
+
+def test_names_and_everyday_words_are_not_topics():
+    controller, _ = make_controller()
+    for message in ["Mình là anh Đức", "Địa điểm ở đâu vậy?", "Trong trường hợp đó thì sao?", "Môi trường ở đây thế nào?"]:
+        assert controller.classify(message) is None, message
+    assert controller.classify("Du học Đức cần gì?") == SPECULATE
+    assert controller.classify("Điểm thi TestAS bao nhiêu là đủ?") == PRE_INJECT
+
+def test_speculation_answers_the_tool_call():
+    controller, queries = make_controller()
+    speculation = controller.start("Cho mình hỏi về TestAS")
+    time.sleep(0.1)  # model call
+
+    assert speculation.result(query="cho mình hỏi về testas") == {"documents": ["doc for Cho mình hỏi về TestAS"]}
+    # another call of the same turn retrieves its own query
+    assert speculation.result(query="lịch thi")["documents"] == ["doc for lịch thi"]
+    speculation.finish()
+
+    stats = controller.get_stats()
+    assert (stats["speculated"], stats["used"], stats["wasted"], stats["ready_on_use"]) == (1, 1, 0, 1)
+    assert stats["avg_saved_ms"] >= 40
+    assert queries == ["Cho mình hỏi về TestAS", "lịch thi"]
+
+def test_rewritten_query_is_retrieved_and_the_speculation_wasted():
+    controller, queries = make_controller()
+    speculation = controller.start("Cho mình hỏi về TestAS")
+
+    assert speculation.result(query="cấu trúc đề thi TestAS")["documents"] == ["doc for cấu trúc đề thi TestAS"]
+    assert asyncio.run(speculation.aresult(query="lịch thi TestAS"))["documents"] == ["doc for lịch thi TestAS"]
+    speculation.finish()
+
+    stats = controller.get_stats()
+    assert (stats["used"], stats["wasted"]) == (0, 1)
+    assert queries[-2:] == ["cấu trúc đề thi TestAS", "lịch thi TestAS"]
+
+def test_unused_speculation_is_wasted():
+    controller, _ = make_controller()
+    controller.start("Cho mình hỏi về TestAS").finish()
+    stats = controller.get_stats()
+    assert (stats["used"], stats["wasted"], stats["use_rate"]) == (0, 1, 0.0)
+
+def test_tool_loop_uses_the_speculation_override():
+    controller, queries = make_controller()
+    tools = ToolController([], {"retrieve": lambda query: {"documents": ["not speculated"]}})
+    calls = [SimpleNamespace(name="retrieve", args={"query": "TestAS"})]
+    responses = [SimpleNamespace(function_calls=calls), SimpleNamespace(function_calls=None, text="ok")]
+
+    speculation = controller.start("TestAS?")
+    tools.run(lambda message, config: responses.pop(0), "TestAS?", "tools", "answer",
+              overrides={"retrieve": speculation.result})
+    speculation.finish()
+    assert queries == ["TestAS?"]
+    assert controller.get_stats()["used"] == 1
+
+def test_async_speculation_runs_during_the_model_call():
+    started = threading.Event()
+
+    async def aretrieve(query):
+        started.set()
+        await asyncio.sleep(0.05)
+        return {"documents": [query]}
+
+    controller = SpeculativeRetrievalController(lambda query: None, aretrieve)
+
+    async def turn():
+        speculation = controller.astart("TestAS")
+        await asyncio.sleep(0.1)  # model call
+        assert started.is_set()
+        result = await speculation.aresult(query="testas")
+        speculation.finish()
+        wasted = controller.astart("TestAS")
+        await asyncio.sleep(0)
+        wasted.finish()
+        return result
+
+    assert asyncio.run(turn()) == {"documents": ["TestAS"]}
+    stats = controller.get_stats()
+    assert (stats["used"], stats["wasted"], stats["ready_on_use"]) == (1, 1, 1)
+
+def test_merged_questions_are_pre_injected_with_one_batch():
+    batches = []
+    controller, queries = make_controller(retrieve_many=lambda questions: batches.append(questions) or {"documents": []})
+    merged = "Chào shop\nHọc phí TestAS là bao nhiêu?\nLịch thi tháng 3 thế nào?"
+    assert controller.questions(merged) == ["Học phí TestAS là bao nhiêu?", "Lịch thi tháng 3 thế nào?"]
+
+    controller.retrieve_now(merged)
+    controller.retrieve_now("Học phí TestAS là bao nhiêu?")
+    assert batches == [["Học phí TestAS là bao nhiêu?", "Lịch thi tháng 3 thế nào?"]]
+    assert queries == ["Học phí TestAS là bao nhiêu?"]
+    assert controller.get_stats()["pre_injected"] == 2
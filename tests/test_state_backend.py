@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+from controller.DebounceMessageController import DebounceMessageController
+from controller.StateBackend import InMemoryStateBackend, SQLiteStateBackend, StateBackend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStateBackend(str(tmp_path / "state.db"))
+    return InMemoryStateBackend()
+
+def test_suspension_roundtrip(backend):
+    until = time.time() + 60
+    backend.set_suspension("user1", until)
+
+    assert backend.get_suspension("user1") == until
+    assert backend.count_suspensions() == 1
+
+    backend.delete_suspension("user1")
+    assert backend.get_suspension("user1") is None
+
+def test_buffer_is_popped_only_when_due(backend):
+    now = time.time()
+    backend.append_message("user1", {"text": "hi", "reply_to": None}, now + 10)
+    backend.append_message("user1", {"text": "there", "reply_to": None}, now + 5)
+
+    messages, deadline = backend.pop_messages_if_due("user1", now)
+    assert messages is None
+    assert deadline == now + 10  # deadline never moves backwards
+
+    messages, deadline = backend.pop_messages_if_due("user1", now + 10)
+    assert [m["text"] for m in messages] == ["hi", "there"]
+    assert backend.pop_messages_if_due("user1", now + 10) == ([], None)
+
+def test_session_record_roundtrip(backend):
+    backend.put_session_record("user1", {"last_date": time.time(), "history": [["user", "hi"]]})
+    assert backend.get_session_record("user1")["history"] == [["user", "hi"]]
+
+    backend.delete_session_record("user1", older_than=time.time() - 60)
+    assert backend.get_session_record("user1") is not None
+
+    backend.clear_sessions()
+    assert backend.get_session_record("user1") is None
+
+def test_counter_increments(backend):
+    assert backend.get_counter("generation") == 0
+    assert backend.increment_counter("generation") == 1
+    assert backend.increment_counter("generation") == 2
+    assert backend.get_counter("generation") == 2
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "state.db")
+    worker1, worker2 = SQLiteStateBackend(path), SQLiteStateBackend(path)
+
+    worker1.set_suspension("user1", time.time() + 60)
+    assert worker2.get_suspension("user1") is not None
+
+def test_fragments_from_two_workers_fire_once(tmp_path):
+    path = str(tmp_path / "state.db")
+    calls = []
+    worker1 = DebounceMessageController(wait_seconds=0.1, state_backend=SQLiteStateBackend(path))
+    worker2 = DebounceMessageController(wait_seconds=0.1, state_backend=SQLiteStateBackend(path))
+
+    def callback(user_id, messages):
+        calls.append([m["text"] for m in messages])
+
+    worker1.add_message("user1", {"text": "hi", "reply_to": None}, callback)
+    time.sleep(0.05)
+    worker2.add_message("user1", {"text": "TestAS?", "reply_to": None}, callback)
+    time.sleep(0.4)
+
+    assert calls == [["hi", "TestAS?"]]
+
+def test_backend_must_implement_every_operation():
+    class PartialBackend(StateBackend):
+        def set_suspension(self, user_id, until):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialBackend()
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from utils.stream_parser import JsonStringFieldParser, SentenceSegmenter, StreamedReply
+
+
+def feed_all(parser, chunks):
+    return "".join(parser.feed(chunk) for chunk in chunks)
+
+def test_decodes_field_across_arbitrary_chunks():
+    message = 'Chào bạn 😊\n"TestAS" \\ sắp thi, hạn chót: 15/07.'
+    raw = json.dumps({"message": message, "image_urls": [], "customer_potential": 0.4})
+    for size in (1, 2, 3, 7):
+        parser = JsonStringFieldParser("message")
+        chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+        assert feed_all(parser, chunks) == message
+        assert parser.done
+        assert parser.parse()["customer_potential"] == 0.4
+
+def test_ascii_escapes_and_surrogate_pairs():
+    raw = json.dumps({"message": "ạ😊"}, ensure_ascii=True)
+    parser = JsonStringFieldParser("message")
+    assert feed_all(parser, list(raw)) == "ạ😊"
+
+def test_ignores_other_fields_before_the_key():
+    parser = JsonStringFieldParser("message")
+    out = feed_all(parser, ['{"image_urls": ["a.jpg"], ', '"mess', 'age": "hi"}'])
+    assert out == "hi"
+
+def test_plain_text_is_passed_through():
+    parser = JsonStringFieldParser("message")
+    assert parser.feed("  ") == ""
+    assert parser.feed("Xin chào") == "  Xin chào"
+    assert parser.feed(' "bạn"') == ' "bạn"'
+    assert parser.parse() is None
+
+def test_segments_at_paragraphs_and_sentences():
+    segmenter = SentenceSegmenter(min_length=20)
+    assert segmenter.feed("Chào bạn.\n\nKhóa học ") == ["Chào bạn."]
+    assert segmenter.feed("bắt đầu vào tháng 9. Học phí") == ["Khóa học bắt đầu vào tháng 9."]
+    assert segmenter.flush() == ["Học phí"]
+
+def test_short_sentences_are_merged():
+    segmenter = SentenceSegmenter(min_length=20)
+    assert segmenter.feed("Dạ. Vâng ạ. ") == []
+    assert segmenter.feed("Bạn cần gì thêm không? ") == ["Dạ. Vâng ạ. Bạn cần gì thêm không?"]
+
+def test_segments_never_exceed_the_limit():
+    segmenter = SentenceSegmenter(min_length=5, max_length=30)
+    text = "word " * 40 + "x" * 70
+    segments = segmenter.feed(text) + segmenter.flush()
+    assert all(0 < len(segment) <= 30 for segment in segments)
+    assert "".join(segments).replace(" ", "") == text.replace(" ", "")
+
+def test_reply_cut_inside_the_message_raises():
+    sent = []
+    reply = StreamedReply(sent.append)
+    reply.feed('{"message": "Chào bạn, TestAS là bài thi năng lực dành cho sinh viên quốc tế. Bài')
+    with pytest.raises(ValueError):
+        reply.finish_hop(False)
+    assert sent == ["Chào bạn, TestAS là bài thi năng lực dành cho sinh viên quốc tế."]
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from controller.ToolController import ToolController
+from utils.stream_parser import StreamedReply
+
+
+def call(name, **args):
+    return SimpleNamespace(name=name, args=args)
+
+def response(*function_calls, text=None):
+    return SimpleNamespace(function_calls=list(function_calls) or None, text=text)
+
+class FakeChat:
+    """
+    Replies with the scripted responses, recording what was sent with which config.
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def send(self, message, config):
+        self.sent.append((message, config))
+        return self.responses.pop(0)
+
+    async def asend(self, message, config):
+        return self.send(message, config)
+
+
+def test_json_settings_are_dropped_for_tool_hops():
+    config = {"temperature": 0.0, "response_mime_type": "application/json", "response_schema": "BotMessage"}
+    assert ToolController.without_json(config) == {"temperature": 0.0}
+    assert "response_schema" in config
+
+def test_direct_answer_takes_one_model_call():
+    queries = []
+    controller = ToolController([], {"retrieve": queries.append})
+    chat = FakeChat(response(text='{"message": "hi"}'))
+
+    # a turn without tools declared
+    assert controller.run(chat.send, "hello", "answer", "answer").text == '{"message": "hi"}'
+    assert chat.sent == [("hello", "answer")]
+    assert queries == []
+    assert controller.get_stats()["tool_turns"] == 0
+
+def test_direct_answer_to_tool_hop_is_the_reply():
+    controller = ToolController([], {"retrieve": lambda query: []})
+    chat = FakeChat(response(text="hi"))
+
+    assert controller.run(chat.send, "hello", "tools", "answer").text == "hi"
+    assert [config for _, config in chat.sent] == ["tools"]
+    stats = controller.get_stats()
+    assert stats["direct_answers"] == 1 and stats["tool_turns"] == 0
+
+def streamed_send(chat, reply):
+    # streams the scripted responses in chunks, as `chat.send_message_stream`
+    def send(message, config):
+        result = chat.send(message, config)
+        reply.start_hop()
+        text = result.text or ""
+        for i in range(0, len(text), 5):
+            reply.feed(text[i:i + 5])
+        reply.finish_hop(bool(result.function_calls))
+        return result
+    return send
+
+def test_streamed_direct_answer_is_sent_once():
+    sent = []
+    reply = StreamedReply(sent.append)
+    controller = ToolController([], {"retrieve": lambda query: []})
+    chat = FakeChat(response(text="TestAS không khó nếu bạn luyện đề đều đặn."))
+
+    controller.run(streamed_send(chat, reply), "TestAS có khó không", "tools", "answer")
+    assert sent == ["TestAS không khó nếu bạn luyện đề đều đặn."]
+    assert len(chat.sent) == 1
+
+def test_streamed_text_of_a_tool_call_hop_is_not_sent():
+    sent = []
+    reply = StreamedReply(sent.append)
+    controller = ToolController([], {"retrieve": lambda query: ["doc"]})
+    chat = FakeChat(
+        response(call("retrieve", query="TestAS"), text="Để mình tra cứu."),
+        response(text='{"message": "TestAS là bài thi năng lực."}'),
+    )
+
+    controller.run(streamed_send(chat, reply), "TestAS là gì?", "tools", "answer")
+    assert sent == ["TestAS là bài thi năng lực."]
+    assert reply.parser.parse() == {"message": "TestAS là bài thi năng lực."}
+
+def test_retrieval_takes_two_model_calls_and_one_retrieval():
+    queries = []
+
+    def retrieve(query):
+        queries.append(query)
+        return {"documents": ["doc"]}
+
+    controller = ToolController([], {"retrieve": retrieve})
+    chat = FakeChat(response(call("retrieve", query="fees")), response(text='{"message": "ok"}'))
+
+    assert controller.run(chat.send, "how much?", "tools", "answer").text == '{"message": "ok"}'
+    assert queries == ["fees"]
+    assert [config for _, config in chat.sent] == ["tools", "answer"]
+    assert len(chat.sent[1][0]) == 1
+    stats = controller.get_stats()
+    assert stats["tool_calls"] == {"retrieve": 1}
+    assert set(stats["avg_hop_latency_ms"]) == {0, 1}
+
+def test_hops_are_bounded():
+    controller = ToolController([], {"retrieve": lambda query: []}, max_hops=2)
+    chat = FakeChat(
+        response(call("retrieve", query="a")),
+        response(call("retrieve", query="b")),
+        response(text="done"),
+    )
+
+    assert controller.run(chat.send, "q", "tools", "answer").text == "done"
+    assert [config for _, config in chat.sent] == ["tools", "tools", "answer"]
+
+def test_parallel_calls_run_concurrently_and_errors_are_returned():
+    barrier = threading.Barrier(2, timeout=2)
+
+    def slow(query):
+        barrier.wait()
+        return query
+
+    def broken():
+        raise ValueError("boom")
+
+    controller = ToolController([], {"slow": slow, "broken": broken})
+    parts = controller.execute([call("slow", query="a"), call("slow", query="b")])
+    assert len(parts) == 2
+
+    controller.execute([call("broken"), call("missing")])
+    assert controller.get_stats()["tool_errors"] == 2
+
+def test_async_calls_use_async_handlers_concurrently():
+    async def retrieve(query):
+        await asyncio.sleep(0.1)
+        return {"documents": [query]}
+
+    controller = ToolController([], {}, async_handlers={"retrieve": retrieve})
+    chat = FakeChat(
+        response(call("retrieve", query="a"), call("retrieve", query="b"), call("retrieve", query="c")),
+        response(text="done"),
+    )
+
+    async def run():
+        return await controller.arun(chat.asend, "q", "tools", "answer")
+
+    start = time.monotonic()
+    assert asyncio.run(run()).text == "done"
+    assert time.monotonic() - start < 0.25
+    assert len(chat.sent[1][0]) == 3
+    assert controller.get_stats()["tool_calls"] == {"retrieve": 3}
+
+def test_calls_of_a_batched_function_share_one_batch_call():
+    batches, single = [], []
+
+    def retrieve_batch(calls):
+        batches.append([args["query"] for args in calls])
+        return [{"documents": [args["query"]]} for args in calls]
+
+    controller = ToolController(
+        [], {"retrieve": lambda query: single.append(query), "other": lambda: "x"},
+        batch_handlers={"retrieve": retrieve_batch},
+    )
+    parts = controller.execute([call("retrieve", query="a"), call("other"), call("retrieve", query="b")])
+    assert len(parts) == 3 and None not in parts
+    assert batches == [["a", "b"]] and single == []
+    assert controller.get_stats()["tool_calls"] == {"retrieve": 2, "other": 1}
+
+    # a single call, or an overridden function, is not batched
+    controller.execute([call("retrieve", query="c")])
+    controller.execute([call("retrieve", query="d"), call("retrieve", query="e")], overrides={"retrieve": lambda query: single.append(query)})
+    assert batches == [["a", "b"]] and single == ["c", "d", "e"]
+
+def test_async_batch_handlers():
+    batches = []
+
+    async def retrieve_batch(calls):
+        batches.append([args["query"] for args in calls])
+        return [{"documents": []} for _ in calls]
+
+    controller = ToolController([], {}, async_batch_handlers={"retrieve": retrieve_batch})
+    parts = asyncio.run(controller.aexecute([call("retrieve", query="a"), call("retrieve", query="b")]))
+    assert len(parts) == 2 and batches == [["a", "b"]]
@@ -0,0 +1,88 @@
+import os
+
+from controller.VectorStore import LocalVectorStore
+
+
+def make_store(tmp_path):
+    store = LocalVectorStore(str(tmp_path), "docs")
+    store.add(
+        ids=["a", "b", "c"],
+        embeddings=[[1.0, 0.0], [0.0, 2.0], [1.0, 1.0]],
+        documents=["about dates", "about fees", "dates and fees"],
+        metadatas=[{"source_url": "x"}, {"source_url": "y"}, {"source_url": "x"}],
+    )
+    return store
+
+def test_batched_query_returns_chroma_shaped_top_k(tmp_path):
+    store = make_store(tmp_path)
+
+    results = store.query(query_embeddings=[[3.0, 0.1], [0.0, 1.0]], n_results=2)
+    assert results["ids"] == [["a", "c"], ["b", "c"]]
+    assert results["documents"][0] == ["about dates", "dates and fees"]
+    assert results["metadatas"][1][0] == {"source_url": "y"}
+    assert results["distances"][1][0] < 1e-6
+
+def test_query_with_where_filter(tmp_path):
+    store = make_store(tmp_path)
+
+    results = store.query(query_embeddings=[0.0, 1.0], n_results=5, where={"source_url": "x"})
+    assert results["ids"] == [["c", "a"]]
+
+def test_persisted_and_memory_mapped(tmp_path):
+    make_store(tmp_path)
+
+    store = LocalVectorStore(str(tmp_path), "docs")
+    assert store.count() == 3
+    assert store.query(query_embeddings=[[0.0, 1.0]], n_results=1)["ids"] == [["b"]]
+
+    # writes after a memory-mapped load
+    store.add(ids=["d"], embeddings=[[-1.0, 0.0]], documents=["other"])
+    assert LocalVectorStore(str(tmp_path), "docs").count() == 4
+
+def test_add_replaces_and_delete_by_where(tmp_path):
+    store = make_store(tmp_path)
+    store.add(ids=["a"], embeddings=[[0.0, 1.0]], documents=["new a"], metadatas=[{"source_url": "y"}])
+    assert store.count() == 3
+    assert store.get(ids=["a"])["documents"] == ["new a"]
+
+    store.delete(where={"source_url": "y"})
+    assert store.get()["ids"] == ["c"]
+    # nothing selected, nothing deleted
+    store.delete()
+    assert store.count() == 1
+
+def test_workers_sharing_the_directory_see_each_others_writes(tmp_path):
+    first = make_store(tmp_path)
+    second = LocalVectorStore(str(tmp_path), "docs")
+
+    # neither overwrites the other's rows
+    first.add(ids=["d"], embeddings=[[-1.0, 0.0]], documents=["from first"])
+    second.add(ids=["e"], embeddings=[[0.0, -1.0]], documents=["from second"])
+    assert sorted(first.get()["ids"]) == sorted(second.get()["ids"]) == ["a", "b", "c", "d", "e"]
+    assert second.query(query_embeddings=[[-1.0, 0.0]], n_results=1)["ids"] == [["d"]]
+
+    first.delete(ids=["e"])
+    assert second.count() == 4
+
+def test_upserts_append_and_dead_rows_are_compacted(tmp_path):
+    store = make_store(tmp_path)
+    log_size = os.path.getsize(tmp_path / "docs" / "records.jsonl")
+    store.add(ids=["d"], embeddings=[[-1.0, 0.0]], documents=["other"])
+    # only the new line is written
+    assert os.path.getsize(tmp_path / "docs" / "records.jsonl") - log_size < log_size
+    assert store.file_rows == 4
+
+    store.delete(ids=["a", "b", "c"])
+    assert store.file_rows == 1 and store.get()["ids"] == ["d"]
+    assert len([name for name in os.listdir(tmp_path / "docs") if name.startswith("vectors-")]) == 1
+    assert LocalVectorStore(str(tmp_path), "docs").get()["documents"] == ["other"]
+
+def test_line_cut_by_a_crash_is_ignored_and_overwritten(tmp_path):
+    make_store(tmp_path)
+    with open(tmp_path / "docs" / "records.jsonl", "ab") as fhandle:
+        fhandle.write(b'{"add": [{"id": "x", "ro')
+
+    store = LocalVectorStore(str(tmp_path), "docs")
+    assert store.count() == 3
+    store.add(ids=["d"], embeddings=[[-1.0, 0.0]], documents=["other"])
+    assert LocalVectorStore(str(tmp_path), "docs").count() == 4
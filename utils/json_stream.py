@@ -0,0 +1,94 @@
+import codecs
+import json
+from itertools import islice
+from typing import IO, Any, Iterable, Iterator, List
+
+JSON_READ_SIZE = 1 << 16  # in characters (or bytes), per read of the file
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+def iter_json_array(fp: IO, read_size: int = JSON_READ_SIZE) -> Iterator[Any]:
+    """
+    Yields the items of a top-level JSON array read from a text or binary
+    file, one at a time: memory holds one item and one read, not the file.
+
+    :raises ValueError: If the file is not a JSON array, or is malformed
+        (raised when the parser gets there).
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer, pos, eof = "", 0, False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        data = ""
+        while not data:
+            raw = fp.read(read_size)
+            # a read may end inside a multi-byte character
+            data = utf8.decode(raw, final=not raw) if isinstance(raw, bytes) else raw
+            if not raw:
+                break
+        if not data:
+            eof = True
+            return False
+        # drop what was consumed already
+        buffer, pos = buffer[pos:] + data, 0
+        return True
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ""
+
+    if next_char() != "[":
+        raise ValueError("expected a JSON array")
+    pos += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        next_char()
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+            # a number cut by the read ("12" of "12.5") decodes too early
+            complete = eof or (
+                end < len(buffer)
+                and (isinstance(item, bool) or not isinstance(item, (int, float)) or buffer[end] in _DELIMITERS)
+            )
+        except json.JSONDecodeError:
+            complete = False
+        if not complete:
+            if not fill():
+                # at the end of the file, parse once more for the actual error
+                item, end = decoder.raw_decode(buffer, pos)
+            continue
+        pos = end
+        yield item
+
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"expected ',' or ']' in the JSON array, got {separator or 'end of file'!r}")
+        pos += 1
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Groups an iterable into lists of `size` items, the last one possibly shorter.
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
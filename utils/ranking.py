@@ -0,0 +1,48 @@
+from typing import Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+RRF_K = 60  # rank offset of reciprocal rank fusion, damps the weight of the very first ranks
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = RRF_K) -> List[Tuple[Hashable, float]]:
+    """
+    Merges ranked lists of ids (e.g. dense and lexical hits) by the sum of
+    1 / (k + rank) of each id over the lists, ties kept in first-seen order.
+    Scores of the retrievers are not comparable, their ranks are.
+
+    :return: (id, fused score) pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def maximal_marginal_relevance(relevance, embeddings, n_results: int, diversity: float = 0.3) -> List[int]:
+    """
+    Picks `n_results` candidates, each the most relevant one minus its
+    similarity to the candidates already picked (weighted by `diversity`,
+    0 keeps the relevance order), so near-duplicate chunks do not fill the
+    context.
+
+    :param relevance: Relevance of each candidate to the query, in [0, 1].
+    :param embeddings: Embedding of each candidate.
+    :return: Indexes of the picked candidates, in picking order.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if not len(vectors):
+        return []
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    relevance = np.asarray(relevance, dtype=np.float32)
+    # highest similarity of each candidate to the picked ones
+    redundancy = np.full(len(vectors), -1.0, dtype=np.float32)
+    picked: List[int] = []
+    for _ in range(min(n_results, len(vectors))):
+        scores = (1 - diversity) * relevance - diversity * redundancy if picked else relevance.copy()
+        scores[picked] = -np.inf
+        best = int(np.argmax(scores))
+        picked.append(best)
+        redundancy = np.maximum(redundancy, vectors @ vectors[best])
+    return picked
@@ -0,0 +1,133 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+
+class _Timer:
+    __slots__ = ("deadline", "seq", "callback", "args")
+
+    def __init__(self, deadline: float, seq: int, callback: Callable[..., Any], args: Tuple):
+        self.deadline = deadline
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+
+
+class TimerScheduler:
+    """
+    Keyed timers served by a single background thread and a min-heap.
+
+    Re-arming a key pushes a new heap entry (O(log n)) and leaves the old one
+    behind as a stale entry that is skipped when popped, so no thread is ever
+    created per timer. Expired callbacks run on a bounded thread pool.
+    """
+    def __init__(self, max_workers: int = 8, name: str = "scheduler"):
+        self.name = name
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._timers: Dict[Hashable, _Timer] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+
+        # metrics
+        self.fired = 0
+        self.last_fire_lag = 0.0
+        self.max_fire_lag = 0.0
+        self.total_fire_lag = 0.0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[..., Any], *args):
+        """
+        (Re)arm the timer for `key` to call `callback(*args)` after `delay` seconds.
+        Any pending timer for the same key is replaced.
+        """
+        self.schedule_at(key, time.monotonic() + max(0.0, delay), callback, *args)
+
+    def schedule_at(self, key: Hashable, deadline: float, callback: Callable[..., Any], *args):
+        """
+        Same as `schedule`, with an absolute `time.monotonic()` deadline.
+        """
+        with self._cond:
+            seq = next(self._seq)
+            self._timers[key] = _Timer(deadline, seq, callback, args)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            self._compact()
+            # wake the scheduler thread only if this is the new earliest deadline
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Cancel the pending timer for `key`.
+        :return: True if a timer was pending.
+        """
+        with self._cond:
+            return self._timers.pop(key, None) is not None
+
+    def is_pending(self, key: Hashable) -> bool:
+        with self._cond:
+            return key in self._timers
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._timers)
+
+    def _compact(self):
+        # drop stale entries once they outnumber the live ones
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._timers):
+            self._heap = [
+                (timer.deadline, timer.seq, key) for key, timer in self._timers.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, seq, key = self._heap[0]
+                    timer = self._timers.get(key)
+                    if timer is None or timer.seq != seq:
+                        # cancelled or re-armed
+                        heapq.heappop(self._heap)
+                        continue
+                    now = time.monotonic()
+                    if deadline > now:
+                        self._cond.wait(deadline - now)
+                        continue
+                    heapq.heappop(self._heap)
+                    self._timers.pop(key)
+                    break
+
+                lag = now - deadline
+                self.fired += 1
+                self.last_fire_lag = lag
+                self.max_fire_lag = max(self.max_fire_lag, lag)
+                self.total_fire_lag += lag
+
+            self._executor.submit(self._call, key, timer)
+
+    def _call(self, key: Hashable, timer: _Timer):
+        try:
+            timer.callback(*timer.args)
+        except Exception as e:
+            print(f"[TimerScheduler] {self.name}: error in callback for {key}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            fired = self.fired or 1
+            return {
+                "pending_timers": len(self._timers),
+                "heap_size": len(self._heap),
+                "fired": self.fired,
+                "last_fire_lag_ms": self.last_fire_lag * 1000,
+                "avg_fire_lag_ms": self.total_fire_lag / fired * 1000,
+                "max_fire_lag_ms": self.max_fire_lag * 1000,
+            }
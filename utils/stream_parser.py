@@ -0,0 +1,208 @@
+import json
+import re
+from typing import Callable, List
+
+MESSENGER_TEXT_LIMIT = 2000
+MIN_SEGMENT_LENGTH = 60
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+# end of a sentence (punctuation, optional closing quotes/brackets, then
+# whitespace) or of a line
+_SENTENCE_END = re.compile(r"[.!?…][\"'”’)\]]*\s+|\n")
+
+
+class JsonStringFieldParser:
+    """
+    Incrementally decodes the string value of one field of a JSON object
+    streamed in arbitrary chunks, e.g. `message` of a streamed `BotMessage`:
+
+        parser.feed('{"mess')         -> ''
+        parser.feed('age": "Chào b')  -> 'Chào b'
+        parser.feed('ạn\\n"}')         -> 'ạn\n'
+
+    Escapes split across chunks (`\\u1EA1`, surrogate pairs) are handled. The
+    key is located by pattern, the field is expected before any other string
+    value containing the same `"field":` text, as with Gemini's schema order.
+
+    A stream that does not start as JSON (`{` or a code fence) is plain text
+    and passed through as is.
+    """
+    def __init__(self, field: str = "message"):
+        self.key_pattern = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self.buffer = ""
+        self.position = -1  # index of the next undecoded char of the value
+        self.done = False
+        self.plain = None  # unknown until the first non-blank char
+
+    def feed(self, chunk: str) -> str:
+        """
+        :return: The characters of the value decoded from this chunk.
+        """
+        self.buffer += chunk
+        if self.plain is None and self.buffer.strip():
+            self.plain = not self.buffer.lstrip().startswith(("{", "`"))
+            if self.plain:
+                return self.buffer
+        if self.plain:
+            return chunk
+        if self.done:
+            return ""
+        if self.position < 0:
+            match = self.key_pattern.search(self.buffer)
+            if not match:
+                return ""
+            self.position = match.end()
+
+        decoded = []
+        buffer, i = self.buffer, self.position
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.done = True
+                i += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            # escape sequence, wait for the rest of it if cut
+            if i + 1 >= len(buffer):
+                break
+            code = buffer[i + 1]
+            if code != "u":
+                decoded.append(_ESCAPES.get(code, code))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            codepoint = int(buffer[i + 2:i + 6], 16)
+            if 0xD800 <= codepoint < 0xDC00:
+                # high surrogate, needs the following `\uDCxx`
+                if i + 12 > len(buffer):
+                    break
+                low = int(buffer[i + 8:i + 12], 16)
+                decoded.append(chr(0x10000 + ((codepoint - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                decoded.append(chr(codepoint))
+                i += 6
+        self.position = i
+        return "".join(decoded)
+
+    def parse(self) -> dict | None:
+        """
+        :return: The whole object once the stream is complete, None if it is not valid JSON.
+        """
+        try:
+            return json.loads(self.buffer)
+        except ValueError:
+            return None
+
+
+class SentenceSegmenter:
+    """
+    Cuts a stream of text into messages: at paragraph breaks (blank line), at
+    sentence or line ends once at least `min_length` characters are pending,
+    and never longer than `max_length` (Messenger's text limit).
+    """
+    def __init__(self, min_length: int = MIN_SEGMENT_LENGTH, max_length: int = MESSENGER_TEXT_LIMIT):
+        self.min_length = min_length
+        self.max_length = max_length
+        self.pending = ""
+
+    def _cut(self) -> int:
+        """
+        :return: Length of the next complete segment in `pending`, 0 if none.
+        """
+        paragraph = self.pending.find("\n\n")
+        if 0 <= paragraph < self.max_length:
+            return paragraph + 2
+
+        cut = 0
+        for match in _SENTENCE_END.finditer(self.pending, 0, self.max_length):
+            cut = match.end()
+            if cut >= self.min_length:
+                return cut
+        if len(self.pending) <= self.max_length:
+            return 0
+        # no boundary within the limit: last sentence, else last space, else hard cut
+        if cut:
+            return cut
+        space = self.pending.rfind(" ", 0, self.max_length)
+        return space + 1 if space > 0 else self.max_length
+
+    def feed(self, text: str) -> List[str]:
+        """
+        :return: The segments completed by `text`, stripped, empty ones dropped.
+        """
+        self.pending += text
+        segments = []
+        while True:
+            cut = self._cut()
+            if not cut:
+                break
+            segment, self.pending = self.pending[:cut].strip(), self.pending[cut:]
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self) -> List[str]:
+        """
+        :return: What is left once the stream ended, split to the length limit.
+        """
+        segments = []
+        while self.pending.strip():
+            if len(self.pending) <= self.max_length:
+                segments.append(self.pending.strip())
+                self.pending = ""
+                break
+            space = self.pending.rfind(" ", 0, self.max_length)
+            cut = space + 1 if space > 0 else self.max_length
+            segment, self.pending = self.pending[:cut].strip(), self.pending[cut:]
+            if segment:
+                segments.append(segment)
+        self.pending = ""
+        return segments
+
+
+class StreamedReply:
+    """
+    Streams the reply of a tool loop turn to `on_segment`, hop by hop: the
+    text of each model call is decoded and segmented as it arrives, the reply
+    is in the last hop. Text still pending when a hop ends with a function
+    call (e.g. "let me look it up") is dropped, not sent.
+    """
+    def __init__(self, on_segment: Callable[[str], None], clean: Callable[[str], str] = str.strip):
+        """
+        :param clean: Applied to each segment, empty results are not sent.
+        """
+        self.on_segment = on_segment
+        self.clean = clean
+        self.parser = JsonStringFieldParser("message")
+        self.segmenter = SentenceSegmenter()
+        self.sent = 0  # segments handed to `on_segment`
+
+    def start_hop(self):
+        self.parser, self.segmenter = JsonStringFieldParser("message"), SentenceSegmenter()
+
+    def _emit(self, segments: List[str]):
+        for segment in segments:
+            segment = self.clean(segment)
+            if segment:
+                self.sent += 1
+                self.on_segment(segment)
+
+    def feed(self, text: str):
+        self._emit(self.segmenter.feed(self.parser.feed(text)))
+
+    def finish_hop(self, function_call: bool):
+        """
+        :param function_call: The hop called a function, the reply comes later.
+        :raise ValueError: A JSON reply ended inside its `message` field.
+        """
+        if function_call:
+            self.segmenter.pending = ""
+            return
+        if self.parser.plain is False and not self.parser.done:
+            raise ValueError("reply stream ended inside the message field")
+        self._emit(self.segmenter.flush())
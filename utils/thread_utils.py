@@ -1,9 +1,20 @@
+import functools
+import itertools
 import threading
-import time
 
-def delayed_call(delay, callback, *args, **kwargs):
-    def wrapper():
-        time.sleep(delay)
-        callback(*args, **kwargs)
+from utils.scheduler import TimerScheduler
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_call_ids = itertools.count()
 
-    threading.Thread(target=wrapper).start()
\ No newline at end of file
+def _get_scheduler() -> TimerScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = TimerScheduler(max_workers=4, name="delayed-call")
+        return _scheduler
+
+def delayed_call(delay, callback, *args, **kwargs):
+    # shared timer thread instead of one sleeping thread per call
+    _get_scheduler().schedule(next(_call_ids), delay, functools.partial(callback, *args, **kwargs))